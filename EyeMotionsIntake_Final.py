@@ -1,11 +1,19 @@
+from GazeCatalog_Final import DatasetCatalog, parse_data_name, record_id
+from GazeLayout_Final import DEFAULT_AOIS, participant_aois
+from GazeMetrics_Final import Metrics
+
 import numpy as np
+import csv
+import math
 import pandas as pd
 import os
-import itertools
 import warnings
 
 warnings.filterwarnings("ignore")
 
+AOI_LABELS = DEFAULT_AOIS.labels  #AOI code -> name, as used throughout the exported data (for the default Left/Right layout, see GazeLayout_Final.AOISet for others)
+MARKOV_ORDER = DEFAULT_AOIS.order  #Order of the AOIs in the exported Markov dictionaries, [1, 2, -1, 0].  In the matrices themselves, row/column code+1 holds code (i.e. NaN, Neither, Left, Right)
+
 def check_files(data_folder, timestamp_folder):
     """
     Gathers and confirms the existence of all data files in one place for subsequent analysis.
@@ -17,39 +25,523 @@ def check_files(data_folder, timestamp_folder):
 
     Returns
     -------
-    array : a 2 column array containing all raw data files and corresponding response files, respectively.
+    array : a 2 column array containing all raw data files and corresponding response files, respectively.  Data files without a (unique) response file are left out, see GazeCatalog_Final.DatasetCatalog
     """
-    data_list = os.listdir(data_folder)
-    ts_list = os.listdir(timestamp_folder)
+    catalog = DatasetCatalog(data_folder, timestamp_folder)  #Based on naming scheme outlined in README
+    catalog.report()
+    return catalog.pairs
     
-    for item in data_list:
-        if ".csv" not in item:
-            data_list.remove(item)
-    
-    array = np.empty([len(data_list),2],dtype = object)
+def read_eyemotions(data_file):
+    """
+    Parses the columns needed for the analysis out of a raw EyeMotions file.
 
-    for i,item in enumerate(data_list): #Based on naming scheme outlined in README
-        array[i,0] = data_folder+item
-        num = str(item.split("CE")[0]) + "CE"
-        code = item.split(" ")[2][0].upper()
-        
-        if code == "A":
-            code = "I"
-        elif code == "L":
-            code = "J"
+    Parameters
+    ----------
+    data_file : path of the EyeMotions .csv (formatted as per README)
+
+    Returns
+    -------
+    dict : the "Timestamp" (float64), "Gaze X" and "Gaze Y" (float32 where that is lossless, see compact()) columns as arrays
+    """
+    with open(data_file) as file:
+        for i,line in enumerate(file):  #Finds starting point of relevant data within raw EyeMotions file, only reading the header
+            if line.split(",")[0].strip().strip('"') == "#DATA":
+                break
+    i = i+1
+    data = pd.read_csv(data_file, skiprows = i, usecols=["Timestamp", "Gaze X", "Gaze Y"])
+    return {"Timestamp": data["Timestamp"].to_numpy(dtype = np.float64),  #Kept at full precision, the dwell times are differences of timestamps
+            "Gaze X": compact(data["Gaze X"].to_numpy(dtype = np.float64)),
+            "Gaze Y": compact(data["Gaze Y"].to_numpy(dtype = np.float64))}
+
+NA_VALUES = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}  #Read as NaN by pd.read_csv()
+
+def last_timestamp(data_file, tail_bytes = 64*1024):
+    """
+    Finds the last "Timestamp" of an EyeMotions file without parsing it: only the header (up to #DATA and the column names) and the last few lines are read.
+
+    Parameters
+    ----------
+    data_file : path of the EyeMotions .csv (formatted as per README)
+    tail_bytes : how much of the end of the file is read at first, doubled until it holds a whole line
+
+    Returns
+    -------
+    float : the last Timestamp, exactly as read_eyemotions() would read it (NaN if it is empty), or None if it can't be told without parsing the file (i.e. no #DATA, or an unusual last line)
+    """
+    with open(data_file, "rb") as file:
+        for line in file:
+            if line.decode(errors = "replace").split(",")[0].strip().strip('"') == "#DATA":
+                break
         else:
-            print(f"Error w/ naming for {item}")
-    
-        for j in ts_list:
-            if num in j and code in j:
-                array[i,1] = timestamp_folder+j
+            return None
+        header = next(csv.reader([file.readline().decode(errors = "replace").rstrip("\r\n")]), [])
+        if "Timestamp" not in header:
+            return None
+        data_start = file.tell()
+        size = file.seek(0, os.SEEK_END)
+
+        while True:
+            start = max(data_start, size - tail_bytes)
+            file.seek(start)
+            lines = file.read(size - start).split(b"\n")
+            if start > data_start:  #The first line is cut off
+                lines = lines[1:]
+            lines = [line.rstrip(b"\r") for line in lines if line.rstrip(b"\r") != b""]  #Blank lines are skipped, as by pd.read_csv()
+            if len(lines) > 0 or start == data_start:
                 break
-            if j == (len(ts_list)-1):
-                print(f"No Timestamp for {item}")
-    return array
+            tail_bytes *= 2
+    if len(lines) == 0:
+        return None
+    fields = next(csv.reader([lines[-1].decode(errors = "replace")]), [])
+    if len(fields) != len(header):
+        return None
+    value = fields[header.index("Timestamp")]
+    if value in NA_VALUES:
+        return math.nan
+    if value != value.strip():
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def valid_times(times_sheet):
+    #The rows of a Times sheet (see read_timestamps()) with both a trial number and a start time
+    times_sheet = times_sheet[times_sheet[:,0]*0 == 0]
+    return times_sheet[times_sheet[:,1]*0 == 0]
+
+def missing_data(data_file, times_sheet):
+    """
+    Checks, from the last lines of data_file alone (see last_timestamp()), whether the tracker stopped recording before the end of the last trial, i.e. whether Intake would throw the participant out with "Missing Data".
+
+    Parameters
+    ----------
+    data_file : path of the EyeMotions .csv
+    times_sheet : the participant's Times sheet, filtered by valid_times()
+
+    Returns
+    -------
+    bool : True only if the participant is certain to be thrown out.  Files whose last timestamp can't be read this way, or lies within rounding of the end of the last trial, return False and are left to the full check
+    """
+    end = times_sheet[-1,2]*1000
+    if end*0 != 0:  #NaN, which no timestamp is after
+        return True
+    last = last_timestamp(data_file)
+    if last is None:
+        return False
+    return math.isnan(last) or last < end - 1e-6
+
+def compact(column):
+    #Stores a float64 column as float32 when that loses nothing (i.e. whole or half pixel coordinates), halving its memory
+    small = column.astype(np.float32)
+    if np.array_equal(small, column, equal_nan = True):
+        return small
+    return column
+
+def read_timestamps(timestamp_file):
+    """
+    Parses the Resps and Times sheets of a response file.
+
+    Parameters
+    ----------
+    timestamp_file : path of the _Resps_Scenes.xlsx file (formatted as per README)
+
+    Returns
+    -------
+    dict : "Resps" holds the "Trial", " row" and " column" columns, "Times" holds the "Trial", "Start (seconds)" and "End" columns sorted by start time
+    """
+    with pd.ExcelFile(timestamp_file) as workbook:  #The workbook is only opened and unzipped once for both sheets
+        ID_sheet = workbook.parse(sheet_name = 0, usecols = ["Trial", " row", " column"]).to_numpy()
+        times_sheet = workbook.parse(sheet_name = 1, usecols = ["Trial", "Start (seconds)", "End"]).sort_values(by = ["Start (seconds)"]).to_numpy()
+    return {"Resps": ID_sheet, "Times": times_sheet}
+
+def classify_gaze(x, y):
+    """
+    Turns arrays of gaze coordinates into the AOIs being looked at (Left = 1, Right = 2, Neither = 0, or NaN = -1) all at once.
+
+    Parameters
+    ----------
+    x : array of "Gaze X" values
+    y : array of "Gaze Y" values
+
+    Returns
+    -------
+    codes : int8 array of AOI codes, one per sample
+    """
+    #The default Left/Right layout, other layouts are defined per trial in a file (see GazeLayout_Final.py)
+    codes = np.zeros(np.shape(x)[0], dtype = np.int8)
+    in_y = (y > 330) & (y < 750)
+    codes[in_y & (x > 200) & (x < 820)] = 1
+    codes[in_y & (x > 1100) & (x < 1720)] = 2
+    codes[~(np.isfinite(x) & np.isfinite(y))] = -1  #Missing (or infinite) coordinates are tracker errors
+    return codes
+
+def classify_point(x, y):
+    #Plain float version of classify_gaze() for one sample at a time (see GazeStream_Final.py)
+    if not (math.isfinite(x) and math.isfinite(y)):
+        return -1
+    if 330 < y < 750:
+        if 200 < x < 820:
+            return 1
+        if 1100 < x < 1720:
+            return 2
+    return 0
+
+def segment_offsets(lengths):
+    #Trials are handled back to back in one array, trial k covering [offsets[k], offsets[k+1])
+    return np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+def segment_ids(offsets):
+    #The trial (segment) each entry belongs to
+    return np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+
+def dwell_times(timestamps, rows):
+    """
+    Times and gaze loc are recorded simultaneously, but we technically want the time spent at each loc.  The time of a sample is half the distance between its neighbours.
+
+    Parameters
+    ----------
+    timestamps : the full "Timestamp" column of the EyeMotions data
+    rows : indices of the samples
+
+    Returns
+    -------
+    array : the time (ms) attributed to each of the samples
+    """
+    return (timestamps.take(rows+1) - timestamps.take(rows-1))/2  #take() wraps negative indices the same way plain indexing does
+
+def look_aoi(data, start_i, end_i, layouts = None):
+    """
+    Builds the lookAOI columns of one trial, or of several trials back to back, from the EyeMotions data.
+
+    Parameters
+    ----------
+    data : Intake.data, i.e. the "Timestamp", "Gaze X" and "Gaze Y" columns as returned by read_eyemotions()
+    start_i : index (or array of indices) of the first sample of each trial
+    end_i : index (or array of indices) one past the last sample of each trial
+    layouts : optional list of the GazeLayout_Final.AOILayout of each trial, the default of None classifies every trial with classify_gaze()
+
+    Returns
+    -------
+    lookAOI : dictionary of the columns "Raw" (int8 raw gaze location), "AOI" (int8, the (to be) interpolated gaze location) and "Time" (float64 time spent at each sample)
+    """
+    start_i = np.atleast_1d(start_i)
+    offsets = segment_offsets(np.atleast_1d(end_i) - start_i)
+    segment = segment_ids(offsets)
+    rows = np.arange(offsets[-1]) - offsets[segment] + start_i[segment]
     
+    x = data["Gaze X"].take(rows)
+    y = data["Gaze Y"].take(rows)
+    if layouts is None:
+        raw = classify_gaze(x, y)
+    else:  #Each distinct layout classifies all the samples of its trials at once
+        raw = np.zeros(len(rows), dtype = layouts[0].table.dtype if len(layouts) > 0 else np.int8)
+        distinct = {id(layout): layout for layout in layouts}
+        which = np.array([list(distinct).index(id(layout)) for layout in layouts], dtype = np.int64)[segment]
+        order = np.argsort(which, kind = "stable")  #The samples of each layout, grouped
+        bounds = np.searchsorted(which[order], np.arange(len(distinct)+1))
+        for k,layout in enumerate(distinct.values()):
+            group = order[bounds[k]:bounds[k+1]]
+            raw[group] = layout.classify(x[group], y[group])
+    return {"Raw": raw, "AOI": raw.copy(), "Time": dwell_times(data["Timestamp"], rows)}
+
+def nan_runs(codes, offsets = None):
+    """
+    Finds every run of consecutive NaN (-1) samples from the run-length boundaries of the code array.  Runs never cross from one trial into the next.
+
+    Parameters
+    ----------
+    codes : array of AOI codes
+    offsets : trial boundaries when codes holds several trials back to back (see segment_offsets()), the default treats codes as a single trial
+
+    Returns
+    -------
+    starts : index of the first sample of each NaN run
+    lengths : number of samples in each NaN run
+    """
+    if offsets is None:
+        offsets = np.array([0, len(codes)])
+    is_nan = codes == -1
+    edge = np.zeros(len(codes)+1, dtype = bool)
+    edge[offsets] = True
+    nan_before = np.concatenate(([False], is_nan[:-1])) & ~edge[:-1]
+    nan_after = np.concatenate((is_nan[1:], [False])) & ~edge[1:]
+    starts = np.flatnonzero(is_nan & ~nan_before)
+    ends = np.flatnonzero(is_nan & ~nan_after) + 1
+    return starts, ends - starts
+
+def fill_gaps(lookAOI, max_gap = 1, offsets = None):
+    """
+    Fills every NaN run of at most max_gap samples in the interpolated "AOI" column of lookAOI, in place.  Each run takes the raw location of the sample immediately before it, the same rule Intake.NaN_replace applies to a single index.
+    A run at the very start of a trial has no sample before it, so it takes the first sample after it instead, whatever max_gap is.
+
+    Parameters
+    ----------
+    lookAOI : the columns built by look_aoi()
+    max_gap : the longest run of NaNs that gets filled.  The default of 1 only fills isolated NaNs, 0 disables filling
+    offsets : trial boundaries when lookAOI holds several trials back to back, the default treats lookAOI as a single trial
+    """
+    if offsets is None:
+        offsets = np.array([0, len(lookAOI["Raw"])])
+    starts, lengths = nan_runs(lookAOI["Raw"], offsets)
+    keep = lengths <= max_gap
+    starts = starts[keep]
+    lengths = lengths[keep]
+    
+    segment = np.searchsorted(offsets, starts, side = "right") - 1
+    leading = starts == offsets[segment]
+    source = np.where(leading, np.minimum(starts + lengths, offsets[segment+1] - 1), starts - 1)  #A run that is the whole trial takes its own (NaN) sample
+    fill = lookAOI["Raw"][source]
+    position = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths)-lengths, lengths)  #Position of each sample within its run
+    lookAOI["AOI"][np.repeat(starts, lengths) + position] = np.repeat(fill, lengths)
+    return lookAOI
+
+def trial_indices(timestamps, starts, ends):
+    """
+    Resolves the start and end indices of every trial in one batch of binary searches over the (monotonic) Timestamp column.
+    
+    Trials are searched in order, each one starting just past the end of the previous trial, so that a trial starting before the previous one ended is flagged as an overlap.
+
+    Parameters
+    ----------
+    timestamps : the full "Timestamp" column of the EyeMotions data (ms)
+    starts : array of trial start times (seconds), sorted by start
+    ends : array of trial end times (seconds), same order as starts
+
+    Returns
+    -------
+    start_i : index of the first sample at or after each start time
+    end_i : index of the first sample after start_i at or after each end time (i.e. one past the last sample of the trial)
+    overlap : boolean array, True where the previous trial's end already lies beyond this trial's start
+    """
+    start_lo = np.searchsorted(timestamps, starts*1000, side = "left")
+    end_lo = np.searchsorted(timestamps, ends*1000, side = "left")
+    
+    #Sequentially, start_i[k] = max(end_i[k-1]+1, start_lo[k]) and end_i[k] = max(start_i[k]+1, end_lo[k]).
+    #Unrolling that recurrence gives end_i[k] = 2k + max(1, max over j <= k of (max(start_lo[j]+1, end_lo[j]) - 2j))
+    k = np.arange(len(starts))
+    end_i = 2*k + np.maximum.accumulate(np.maximum(np.maximum(start_lo+1, end_lo) - 2*k, 1))
+    search_from = np.concatenate(([0], end_i[:-1]+1))
+    start_i = np.maximum(search_from, start_lo)
+    
+    valid = search_from < len(timestamps)
+    overlap = np.zeros(len(starts), dtype = bool)
+    overlap[valid] = timestamps[search_from[valid]] > starts[valid]*1000
+    return start_i, end_i, overlap
+
+def run_lengths(codes, times, offsets = None):
+    """
+    Run-length encodes a trial (or several trials back to back), i.e. combines a series of instances in the same AOI into one instance (3 5ms instances at Left -> 15 ms at Left).
+
+    Parameters
+    ----------
+    codes : the (interpolated) AOI code of every sample
+    times : the time spent at every sample
+    offsets : trial boundaries when codes holds several trials back to back, the default treats codes as a single trial.  Runs never cross from one trial into the next.
+
+    Returns
+    -------
+    runs : dict of parallel arrays "AOI" (code of each run), "Start" (index of the first sample of each run within its trial) and "Time" (total time of each run)
+    run_offsets : the runs of trial k are runs[...][run_offsets[k]:run_offsets[k+1]]
+    """
+    if offsets is None:
+        offsets = np.array([0, len(codes)])
+    change = np.ones(len(codes), dtype = bool)
+    change[1:] = codes[1:] != codes[:-1]
+    change[offsets[:-1][np.diff(offsets) > 0]] = True
+    
+    starts = np.flatnonzero(change)
+    run_id = np.cumsum(change) - 1
+    run_offsets = np.searchsorted(starts, offsets)
+    runs = {"AOI": codes[starts],
+            "Start": starts - offsets[segment_ids(run_offsets)],
+            "Time": np.bincount(run_id, weights = times, minlength = len(starts))}  #bincount adds each run up in order, exactly like a running total
+    return runs, run_offsets
+
+def transition_counts(codes, keep = None, offsets = None, size = 4):
+    """
+    Counts the transitions between successive entries of a sequence of AOI codes (samples or runs) in one pass.
+
+    Parameters
+    ----------
+    codes : array of AOI codes
+    keep : optional boolean mask, entries that are False are skipped over (i.e. the entries on either side of them count as successive)
+    offsets : trial boundaries when codes holds several trials back to back, transitions are then only counted within each trial
+    size : number of codes including NaN and Neither (GazeLayout_Final.AOISet.size), the default of 4 being the Left/Right layout
+
+    Returns
+    -------
+    counts : size x size int array, counts[a+1, b+1] is the number of transitions from code a to code b.  With offsets, one such matrix per trial (n_trials x size x size)
+    """
+    index = np.asarray(codes).astype(np.int64) + 1
+    if offsets is None:
+        segment = np.zeros(len(index), dtype = np.int64)
+    else:
+        segment = segment_ids(offsets)
+    if keep is not None:
+        index = index[keep]
+        segment = segment[keep]
+    
+    pairs = (segment[:-1]*size*size + index[:-1]*size + index[1:])[segment[:-1] == segment[1:]]
+    counts = np.bincount(pairs, minlength = size*size*(1 if offsets is None else len(offsets)-1)).reshape(-1,size,size)
+    if offsets is None:
+        return counts[0]
+    return counts
+
+def transition_probs(counts):
+    #Normalises each row of a count matrix into the likelihood of each movement, rows without any transitions become NaN
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return counts / counts.sum(axis = -1, keepdims = True)
+
+def transition_neithers(codes, times, neither_cut, run_offsets = None):
+    """
+    Finds the "transition neithers" of a run-length timeline: Neither runs shorter than neither_cut that sit between two different AOIs, i.e. a Left and a Right run (in either order).
+
+    Parameters
+    ----------
+    codes : AOI code of each run
+    times : time of each run (ms)
+    neither_cut : the maximum time of a transition Neither
+    run_offsets : trial boundaries when the runs of several trials are back to back (see run_lengths()), the default treats them as a single trial
+
+    Returns
+    -------
+    mask : boolean array, True for every run that is a transition Neither
+    """
+    if run_offsets is None:
+        run_offsets = np.array([0, len(codes)])
+    segment = segment_ids(run_offsets)
+    mask = np.zeros(len(codes), dtype = bool)
+    before = codes[:-2]
+    after = codes[2:]
+    mask[1:-1] = (codes[1:-1] == 0) & (times[1:-1] < neither_cut) & (before > 0) & (after > 0) & (before != after) & (segment[:-2] == segment[2:])
+    return mask
+
+def markov_view(counts, aois = DEFAULT_AOIS):
+    #Count matrix (or a dictionary of them, possibly nested) -> {from: {to: [probability, count]}} as exported in the .json, aois being the GazeLayout_Final.AOISet the codes stand for
+    if not isinstance(counts, np.ndarray):
+        return {key: markov_view(value, aois) for key,value in counts.items()}
+    probs = transition_probs(counts).tolist()
+    counts = counts.tolist()
+    labels = aois.labels
+    return {labels[a]: {labels[b]: [probs[a+1][b+1], counts[a+1][b+1]] for b in aois.order} for a in aois.order}
+
+def look_string(look, labels = AOI_LABELS):
+    #(AOI code, time) -> "{loc}: x.yzms"
+    if look is None:
+        return "err"
+    return f"{labels[look[0]]}: {look[1]}ms"
+
+def export_view(dictionary, timeline_strings = True):
+    """
+    Converts the numeric timelines, looks and Markov count matrices of Intake.return_dict() (or a merged dictionary of several participants) into their .json form.
+
+    Parameters
+    ----------
+    dictionary : {participant: {data category: {trial: data}}} as returned by Intake.return_dict()
+    timeline_strings : If True (the default), the Timeline becomes a list of "{loc}: x.yzms" strings and each look a single "{loc}: x.yzms" string ("err" if there is none).
+                       If False, the Timeline stays as the parallel lists "AOI", "Start" and "Time", and each look becomes a [loc, time] pair (null if there is none).
+
+    Returns
+    -------
+    out : a copy of dictionary that can be written with json.dump (the data other than Timeline, looks and Markov chains is shared, not copied)
+    """
+    out = {}
+    for participant in dictionary:
+        out[participant] = dict(dictionary[participant])
+        aois = participant_aois(dictionary[participant])
+        timelines = {}
+        for trial,runs in dictionary[participant]["Timeline"].items():
+            labels = [aois.labels[code] for code in runs["AOI"].tolist()]
+            if timeline_strings:
+                timelines[trial] = [f"{label}: {time}ms" for label,time in zip(labels, runs["Time"])]
+            else:
+                timelines[trial] = {"AOI": labels, "Start": runs["Start"].tolist(), "Time": runs["Time"].tolist()}
+        out[participant]["Timeline"] = timelines
+        
+        for category in ["LastLook", "FirstLook", "LastValid", "FirstValid"]:
+            if timeline_strings:
+                out[participant][category] = {trial: look_string(look, aois.labels) for trial,look in dictionary[participant][category].items()}
+            else:
+                out[participant][category] = {trial: None if look is None else [aois.labels[look[0]], float(look[1])] for trial,look in dictionary[participant][category].items()}
+        
+        for category in ["Markov", "Adj_Markov", "Nei_Markov"]:
+            out[participant][category] = markov_view(dictionary[participant][category], aois)
+    return out
+
+def markov_counts(view, aois = DEFAULT_AOIS):
+    #Inverse of markov_view(): {from: {to: [probability, count]}} (or a dictionary of them, possibly nested) -> count matrix, a matrix being returned as is
+    if not isinstance(view, dict):
+        return view
+    if any(isinstance(value, dict) for row in view.values() for value in row.values()):  #Keyed by something else first, i.e. Nei_Markov by cutoff
+        return {key: markov_counts(value, aois) for key,value in view.items()}
+    codes = {label: code for code,label in aois.labels.items()}
+    counts = np.zeros((aois.size, aois.size), dtype = np.int64)
+    for a,row in view.items():
+        for b,value in row.items():
+            counts[codes[a]+1, codes[b]+1] = value[1]
+    return counts
+
+def look_value(look, codes):
+    #Inverse of the .json form of a look: "{loc}: x.yzms" or [loc, time] ("err" or None if there is none) -> (AOI code, time), a numeric look being returned as is
+    if look is None or look == "err":
+        return None
+    if isinstance(look, str):
+        label, time = look.rsplit(": ", 1)
+        return (codes[label], float(time[:-2]))
+    if isinstance(look[0], str):
+        return (codes[look[0]], float(look[1]))
+    return look
+
+def numeric_results(dictionary):
+    """
+    Converts results in their .json form (i.e. as returned by GazeAOI() or loaded from its JSON_out) back into the numeric form of Intake.return_dict(), so they can be passed to gazeTable(), gazeExport() or GazeStats_Final.compare_conditions().  Participants already in numeric form are passed through untouched.
+
+    The looks and Markov chains are converted back exactly.  A Timeline written as parallel lists (timeline_strings = False) is converted back too, while a Timeline of "{loc}: x.yzms" strings doesn't hold the start of each run and is left as is.
+
+    Parameters
+    ----------
+    dictionary : {participant: {data category: {trial: data}}}, in either form
+
+    Returns
+    -------
+    out : a copy of dictionary in numeric form (the data other than Timeline, looks and Markov chains is shared, not copied)
+    """
+    out = {}
+    for participant in dictionary:
+        results = dictionary[participant]
+        if not any(isinstance(matrix, dict) for matrix in results["Markov"].values()):
+            out[participant] = results
+            continue
+        aois = participant_aois(results)
+        codes = {label: code for code,label in aois.labels.items()}
+        out[participant] = dict(results)
+        timelines = {}
+        for trial,runs in results["Timeline"].items():
+            if isinstance(runs, dict) and isinstance(runs["AOI"], list):
+                runs = {"AOI": np.array([codes[label] for label in runs["AOI"]], dtype = aois.dtype),
+                        "Start": np.array(runs["Start"], dtype = np.int64),
+                        "Time": np.array(runs["Time"], dtype = np.float64)}
+            timelines[trial] = runs
+        out[participant]["Timeline"] = timelines
+        
+        for category in ["LastLook", "FirstLook", "LastValid", "FirstValid"]:
+            out[participant][category] = {trial: look_value(look, codes) for trial,look in results[category].items()}
+        
+        for category in ["Markov", "Adj_Markov", "Nei_Markov"]:
+            out[participant][category] = {trial: markov_counts(view, aois) for trial,view in results[category].items()}
+    return out
+
+def participant_id(data_file):
+    #The identifier of a data file's participant in the results, i.e. "001_109CELetter" (see record_id() in GazeCatalog_Final.py)
+    record = parse_data_name(os.path.basename(data_file))
+    if record is not None:
+        return record_id(record)
+    ID = data_file.split("/")[-1]  #Not named as per README, fall back to the third word being the condition
+    return ID.split("CE")[0] +"CE"+ ID.split(" ")[2]
+
 class Intake():
-    def __init__(self, data_file, timestamp_file, neither_cutoff):
+    def __init__(self, data_file, timestamp_file, neither_cutoff, max_nan_gap = 1, cache = None, sheets = None, metrics = None, layouts = None, gaze = None, precheck = True):
         """
         Given an EyeMotions file & corresponding response file calculates the following variables into a dictionary that is exported via self.return_dict():
             
@@ -67,33 +559,60 @@ class Intake():
             ParticipantError*: The percent of a given participant's total data not made of NaN locations
             
             *This variable is processed per participant, whereas all others are nested dictionaries containing data per trial per participant
-            ^The data in this variable follows the following format: "{loc}: "x.yzms""
+            ^Held as numbers (run-length arrays for the Timeline, (AOI code, time) pairs for the looks) and converted by export_view() to the following format: "{loc}: "x.yzms""
+        
+        neither_cutoff can also be a list of cutoffs, in which case Nei_Markov is calculated for each of them (see return_dict()) while everything else is only calculated once
+        max_nan_gap sets the longest run of NaN samples that gets filled in with the neighbouring location (see fill_gaps()), the default of 1 only fills isolated NaNs
+        cache is an optional GazeCache_Final.RecordingCache holding already parsed copies of the input files
+        sheets is the already parsed response file (see read_timestamps()), i.e. from a GazeCache_Final.WorkbookLoader, the default of None parses timestamp_file here
+        gaze is likewise the already parsed data file (see read_eyemotions()), i.e. from a GazeCache_Final.PairLoader
+        precheck, if True (the default), first reads only the end of the data file (see missing_data()), so a participant whose tracker stopped early is thrown out without parsing the whole file.  self.data is then None
+        metrics is an optional GazeMetrics_Final.Metrics that records the time, samples and memory of each stage
+        layouts is an optional GazeLayout_Final.TrialLayouts (i.e. from load_layouts()) with the AOIs of every trial, the default of None being the Left/Right AOIs of classify_gaze().  The results then hold one ratio per AOI, (N+2)x(N+2) Markov matrices and the list of "AOIs" (and of "AOI_Keys", if the layouts have keys other than the names)
         """
-        ID = data_file.split("/")[-1]
-        ID = ID.split("CE")[0] +"CE"+ ID.split(" ")[2]
+        ID = participant_id(data_file)
         self.ID = ID
         
         self.err_list = []
+        self.neither_cutoffs = list(neither_cutoff) if isinstance(neither_cutoff, (list, tuple)) else [neither_cutoff]
+        self.metrics = Metrics(enabled = False) if metrics is None else metrics  #Its own, since the participant is set on it
+        self.metrics.participant = ID
+        self.layouts = layouts
+        self.aois = DEFAULT_AOIS if layouts is None else layouts.aois
         
-        df = pd.read_csv(data_file).to_numpy()[:,0]
-        for i,j in enumerate(df):  #Finds starting point of relevant data within raw EyeMotions file
-            if j == "#DATA":
-                break
-        i = i+2
-        self.data = pd.read_csv(data_file, skiprows = i, usecols=["Timestamp", "Gaze X", "Gaze Y"]).to_numpy()
-        self.data = np.hstack((np.arange(self.data.shape[0]).reshape(-1,1),self.data))
+        if sheets is None:
+            with self.metrics.stage("read_timestamps"):
+                if cache is None:
+                    sheets = read_timestamps(timestamp_file)
+                else:
+                    sheets = cache.load(timestamp_file, read_timestamps)
+        times_sheet = valid_times(sheets["Times"])
+        if precheck and gaze is None:
+            with self.metrics.stage("precheck"):
+                rejected = missing_data(data_file, times_sheet)
+            if rejected:  #Thrown out before the expensive parse
+                self.data = None
+                self.reject()
+                return
+        
+        if gaze is None:  #A loaded gaze had its reading recorded by its loader
+            with self.metrics.stage("read_eyemotions") as stage:
+                if cache is None:
+                    gaze = read_eyemotions(data_file)
+                else:  #Warm runs skip the text/xlsx parsing entirely
+                    gaze = cache.load(data_file, read_eyemotions)
+                stage.samples = gaze["Timestamp"].shape[0]
+        
+        self.data = gaze  #The parsed (or memory-mapped cached) columns themselves, never copied
         self.IDs = {}  #a dictionary that links the trial number (1,2,3...144) to the row/column identifier (1-4 etc.)
-        ID_sheet = pd.read_excel(timestamp_file, sheet_name = 0, usecols = ["Trial", " row", " column"]).to_numpy()
+        ID_sheet = sheets["Resps"]
 
         for row in np.nditer(ID_sheet[1:,:], flags=['external_loop', "refs_ok"], order='C'):
             self.IDs[str(row[0])] = f"{int(row[1])}-{int(row[2])}"
         
         self.times = {}  #start and end times and indices for each trial
-        times_sheet = pd.read_excel(timestamp_file, sheet_name = 1, usecols = ["Trial", "Start (seconds)", "End"]).sort_values(by = ["Start (seconds)"]).to_numpy()
-        times_sheet = times_sheet[times_sheet[:,0]*0 == 0]
-        times_sheet = times_sheet[times_sheet[:,1]*0 == 0]
         
-        if self.data[-1,1] > times_sheet[-1,2]*1000:  #It is possible for the tracker to stop recording before the end of a trial, these participants are thrown out
+        if self.data["Timestamp"][-1] > times_sheet[-1,2]*1000:  #It is possible for the tracker to stop recording before the end of a trial, these participants are thrown out
             self.check_err = True
             for row in times_sheet:
                 trial_name = self.IDs[str(int(row[0]))]
@@ -105,7 +624,8 @@ class Intake():
             self.trial_list = []
             for i in times_sheet[:,0]:
                 self.trial_list.append(str(int(i)))
-            overlap = self.find_times()  #Finds the indices of each start and end time
+            with self.metrics.stage("find_times", samples = self.data["Timestamp"].shape[0]):
+                overlap = self.find_times()  #Finds the indices of each start and end time
             
             if len(overlap) > 0:  #Overlapping trials are actually removed as part of the self.find_times() function, but are recorded here for user notice
                 self.err_list.append(f"{ID} - Overlapping trials ({len(overlap)}):")
@@ -127,81 +647,73 @@ class Intake():
             self.outDict[ID]["Nei_Markov"] = {}
             self.outDict[ID]["TrialError"] = {}
             
-            errArray = np.zeros([len(self.times),2])
+            self.nei_sweep = {cutoff: {} for cutoff in self.neither_cutoffs}  #Nei_Markov per neither cutoff, see return_dict()
             
-            for z,trial in enumerate(self.times):
-                self.outDict[ID]["Ratios"][trial] = {}
-    
-                self.outDict[ID]["Time_Total"][trial] = (self.times[trial]["end"]-self.times[trial]["start"])*1000  #Probably redundant
-                self.outDict[ID]["Ratios"][trial]["Total"] = (self.times[trial]["end"]-self.times[trial]["start"])*1000
-                
-                lookAOI = np.zeros([self.times[trial]["end_i"]-self.times[trial]["start_i"],3])  #Very important temporary array that stores the raw gaze location, the interpolated gaze location, and the time
-                
-                with np.nditer(self.data[self.times[trial]["start_i"]:self.times[trial]["end_i"],:], flags=['external_loop', 'refs_ok'], order='C') as it:
-                    for i,row in enumerate(it):
-                        lookAOI[i,0] = self.classify(row[2],row[3])  #Turns coordinates into the AOIs being looked at: Left, Right, Neither, or NaN (Error)
-                        self.times[trial]["NaNIndices"] = np.where(lookAOI[:,0] == -1)[0]
-                        
-                        time_calc = (self.data[int(row[0])+1,1] - self.data[int(row[0])-1,1])/2  #Times and gaze loc are recorded simultaneously, but we technically want the time spent at each loc
-                        lookAOI[i,2] = time_calc
-                        
-                
-                lookAOI[:,1] = lookAOI[:,0]
-                
-                self.outDict[ID]["Raw_Timeline"][trial] = lookAOI  #now referenceable throughout the object, gets deleted upon export      
-                
-                NaN_remove_list = []
-                for i,index in enumerate(self.times[trial]["NaNIndices"]):  #Ignore isolated NaNs, technically an extended period of time could suggest a person intentionally looking away from the screen, but that is unlikely in a single 5ms window
-                    if i+1 != len(self.times[trial]["NaNIndices"]):
-                        if abs(self.times[trial]["NaNIndices"][i+1]-index) != 1 and abs(self.times[trial]["NaNIndices"][i-1]-index) != 1:
-                            self.NaN_replace(ID, trial, self.times[trial]["NaNIndices"][i])
-                    else:
-                        if abs(self.times[trial]["NaNIndices"][i-1]-index) != 1:
-                            self.NaN_replace(ID, trial, self.times[trial]["NaNIndices"][i])
-                self.times[trial]["NaN_remove_list"] = NaN_remove_list
-                
-                #Most of the calculations:
-                self.ratios(ID, trial)  #Ratios spent in each AOI per trial plus total trial time
-                times2 = self.timeline(ID, trial)  #returns the list as well as adds it to the dictionary
-                self.looks(ID, trial)  #The first and last places a participant looked during a trial
-                self.markov(ID, trial)  #Data for a Markov Chain
-                self.adj_markov(ID, trial, times2)  #Markov Chain that goes on overall looks not individual timestamps (i.e. a person looking at the Left AOI is treated as one instance rather than multiple)
-                self.nei_markov(ID, trial, times2, neither_cut= neither_cutoff)  #Same as adj but ignoring Neithers under a certain time, could potentially be just transition time as there is space between the Left and Right AOIs
-                
-                self.outDict[ID]["TrialError"][trial] = 1 - (lookAOI[:,0] == -1).sum()/np.shape(lookAOI)[0]  #Ratio of data that is not NaN
-                errArray[z,0] = (lookAOI[:,0] == -1).sum()
-                errArray[z,1] = np.shape(lookAOI)[0]
+            #Every trial is a segment of one participant wide array, trial k being rows self.offsets[k]:self.offsets[k+1], so each stage below runs once per participant rather than once per trial
+            self.trials = list(self.times)  #The trials left after removing overlaps, in the order they are reported
+            start_i = np.array([self.times[trial]["start_i"] for trial in self.trials], dtype = np.int64)
+            end_i = np.array([self.times[trial]["end_i"] for trial in self.trials], dtype = np.int64)
+            self.offsets = segment_offsets(end_i - start_i)
+            samples = int(self.offsets[-1])
+            for k,trial in enumerate(self.trials):
+                self.metrics.count("trial", int(self.offsets[k+1] - self.offsets[k]), trial = trial)
+            
+            with self.metrics.stage("look_aoi", samples = samples):
+                self.lookAOI = look_aoi(self.data, start_i, end_i, None if layouts is None else [layouts.layout(trial) for trial in self.trials])  #Very important temporary columns that store the raw gaze location, the interpolated gaze location, and the time
+            
+            for k,trial in enumerate(self.trials):
+                self.outDict[ID]["Raw_Timeline"][trial] = {column: self.lookAOI[column][self.offsets[k]:self.offsets[k+1]] for column in self.lookAOI}  #Views, now referenceable per trial throughout the object, gets deleted upon export
+            
+            with self.metrics.stage("fill_gaps", samples = samples):
+                fill_gaps(self.lookAOI, max_gap = max_nan_gap, offsets = self.offsets)  #Ignore isolated NaNs, technically an extended period of time could suggest a person intentionally looking away from the screen, but that is unlikely in a single 5ms window
+            
+            #Most of the calculations:
+            with self.metrics.stage("ratios", samples = samples):
+                self.ratios(ID)  #Ratios spent in each AOI per trial plus total trial time
+            with self.metrics.stage("timeline", samples = samples):
+                self.timeline(ID)  #The run-length timeline of every trial
+            with self.metrics.stage("looks", samples = samples):
+                self.looks(ID)  #The first and last places a participant looked during a trial
+            with self.metrics.stage("markov", samples = samples):
+                self.markov(ID)  #Data for a Markov Chain
+            with self.metrics.stage("adj_markov", samples = samples):
+                self.adj_markov(ID)  #Markov Chain that goes on overall looks not individual timestamps (i.e. a person looking at the Left AOI is treated as one instance rather than multiple)
+            with self.metrics.stage("nei_markov", samples = samples):
+                for cutoff in self.neither_cutoffs:  #Only this stage depends on the cutoff, so a sweep over several cutoffs shares everything else
+                    self.nei_markov(ID, neither_cut= cutoff)  #Same as adj but ignoring Neithers under a certain time, could potentially be just transition time as there is space between the Left and Right AOIs
+            with self.metrics.stage("errors", samples = samples):
+                self.errors(ID)  #Ratio of data that is not NaN, per trial and per participant
+            if layouts is not None:
+                self.outDict[ID]["AOIs"] = self.aois.names  #So the exports know what each code stands for
+                if self.aois.keys != self.aois.names:
+                    self.outDict[ID]["AOI_Keys"] = self.aois.keys  #And what their Ratios are keyed by
             
-            self.outDict[ID]["ParticipantError"] = 1 - errArray[:,0].sum()/errArray[:,1].sum()
+            self.outDict[ID]["Nei_Markov"] = self.nei_sweep[self.neither_cutoffs[0]]
             
         else:  #When a trial is missing data
-            self.check_err = False
-            print(f"{ID} skipped: missing time")
-            self.err_list.append(f"{ID} - Missing Data")
+            self.reject()
             
+    def reject(self):
+        #Throws the participant out for missing data
+        self.check_err = False
+        print(f"{self.ID} skipped: missing time")
+        self.err_list.append(f"{self.ID} - Missing Data")
         
     def find_times(self):
-        #Iterates through each start and end time (in seconds) and converts it to the indices where those times occur in the EyeMotions Data
-        start_search = 0
+        #Converts each start and end time (in seconds) to the indices where those times occur in the EyeMotions Data via trial_indices(), overlapping trials are removed
+        names = [self.IDs[trial] for trial in self.trial_list]
+        starts = np.array([self.times[trial_name]["start"] for trial_name in names], dtype = float)
+        ends = np.array([self.times[trial_name]["end"] for trial_name in names], dtype = float)
+        self.start_i, self.end_i, overlaps = trial_indices(self.data["Timestamp"], starts, ends)  #Kept (in self.trial_list order) so later stages can slice views of self.data
+        
         errs = []
-        prev_trial = ""
-        for trial in self.trial_list:
-            trial_name = self.IDs[trial]
-            with np.nditer(self.data[start_search:,:], flags=['external_loop', 'refs_ok'], order='C') as it:
-                for row in it:
-                    if self.data[start_search][1] > self.times[trial_name]["start"]*1000:
-                        errs.append(prev_trial)
-                        errs.append(trial_name)
-                        
-                    if row[1] >= self.times[trial_name]["start"]*1000:
-                        self.times[trial_name]["start_i"] = int(row[0])
-                        break
-                for row in it:
-                    if row[1] >= self.times[trial_name]["end"]*1000:
-                        self.times[trial_name]["end_i"] = int(row[0])
-                        start_search = int(row[0])+1
-                        break
-            prev_trial = trial_name
+        for k,trial_name in enumerate(names):
+            self.times[trial_name]["start_i"] = int(self.start_i[k])
+            self.times[trial_name]["end_i"] = int(self.end_i[k])
+            if overlaps[k]:
+                if k > 0:
+                    errs.append(names[k-1])
+                errs.append(trial_name)
         
         ret_errs = []
         for i in errs:
@@ -212,166 +724,92 @@ class Intake():
     
     
     def classify(self, x, y):
-        #Change this if your AOIs change
-        if x*0!=0 or y*0!=0:
-            check = -1
-        else:
-            check = 0
-            if y > 330 and y < 750:
-                if x > 200 and x < 820:
-                    check = 1
-                if x > 1100 and x < 1720:
-                    check = 2
-        return check
+        #Single point version of classify_gaze(), kept for convenience
+        return int(classify_gaze(np.array([x], dtype = float), np.array([y], dtype = float))[0])
     
     def number_decode(self,val):
-        if val == 0:
-            return "Neither"
-        if val == 1:
-            return "Left"
-        if val == 2:
-            return "Right"
-        if val == -1:
-            return "NaN"
+        return self.aois.labels.get(int(val))
     
     def NaN_replace(self,ID, trial, index):
-        #Replace the NaN loc with either the loc of the instance immediately before or after it
-        try:
-            self.outDict[ID]["Raw_Timeline"][trial][index,1] = self.outDict[ID]["Raw_Timeline"][trial][index-1,0]
-        except:
-            self.outDict[ID]["Raw_Timeline"][trial][index,1] = self.outDict[ID]["Raw_Timeline"][trial][index+1,0]
+        #Replace the NaN loc with either the loc of the instance immediately before or after it (after for the first instance, as in fill_gaps())
+        if index > 0:
+            self.outDict[ID]["Raw_Timeline"][trial]["AOI"][index] = self.outDict[ID]["Raw_Timeline"][trial]["Raw"][index-1]
+        else:
+            self.outDict[ID]["Raw_Timeline"][trial]["AOI"][index] = self.outDict[ID]["Raw_Timeline"][trial]["Raw"][index+1]
     
-    def ratios(self, ID, trial):
-        #Sums instances of each and then divides by the total number of instances
-        self.outDict[ID]["Ratios"][trial]["L"] = [None,None]
-        self.outDict[ID]["Ratios"][trial]["R"] = [None,None]
-        self.outDict[ID]["Ratios"][trial]["NaN"] = [None,None]
-        self.outDict[ID]["Ratios"][trial]["Neither"] = [None,None]
+    def ratios(self, ID):
+        #Sums the time of each AOI per trial and divides by the total time, as one weighted bincount over every trial (which adds up each trial's samples in order, exactly like a running total)
+        segment = segment_ids(self.offsets)
+        size = self.aois.size
+        bins = segment*size + self.lookAOI["AOI"] + 1  #Promoted from int8 by segment
+        times = np.bincount(bins, weights = self.lookAOI["Time"], minlength = size*len(self.trials)).reshape(-1,size)
+        samples = np.bincount(bins, minlength = size*len(self.trials)).reshape(-1,size)
+        total = sum(times[:,code+1] for name,code in self.aois.ratio_keys)  #Added in export order, i.e. L + R + NaN + Neither
         
-        L_temp = sum(self.outDict[ID]["Raw_Timeline"][trial][self.outDict[ID]["Raw_Timeline"][trial][:,1] == 1][:,2])
-        R_temp = sum(self.outDict[ID]["Raw_Timeline"][trial][self.outDict[ID]["Raw_Timeline"][trial][:,1] == 2][:,2])
-        NaN_temp = sum(self.outDict[ID]["Raw_Timeline"][trial][self.outDict[ID]["Raw_Timeline"][trial][:,1] == -1][:,2])
-        Nei_temp = sum(self.outDict[ID]["Raw_Timeline"][trial][self.outDict[ID]["Raw_Timeline"][trial][:,1] == 0][:,2])
-        total_temp = L_temp + R_temp + NaN_temp + Nei_temp
-
-        self.outDict[ID]["Ratios"][trial]["L"][1] = L_temp
-        self.outDict[ID]["Ratios"][trial]["R"][1] = R_temp
-        self.outDict[ID]["Ratios"][trial]["NaN"][1] = NaN_temp
-        self.outDict[ID]["Ratios"][trial]["Neither"][1] = Nei_temp
+        for k,trial in enumerate(self.trials):
+            self.outDict[ID]["Time_Total"][trial] = (self.times[trial]["end"]-self.times[trial]["start"])*1000  #Probably redundant
+            self.outDict[ID]["Ratios"][trial] = {"Total": (self.times[trial]["end"]-self.times[trial]["start"])*1000}
+            for name,code in self.aois.ratio_keys:
+                time = times[k,code+1] if samples[k,code+1] > 0 else 0  #An AOI that was never looked at stays an integer 0
+                self.outDict[ID]["Ratios"][trial][name] = [time/total[k], time]
         
-        self.outDict[ID]["Ratios"][trial]["L"][0] = L_temp/total_temp
-        self.outDict[ID]["Ratios"][trial]["R"][0] = R_temp/total_temp
-        self.outDict[ID]["Ratios"][trial]["NaN"][0] = NaN_temp/total_temp
-        self.outDict[ID]["Ratios"][trial]["Neither"][0] = Nei_temp/total_temp
-        
-    def timeline(self, ID, trial):
-        #Converts each row of LookAOI to a more easily digestible string, combines a series of instances in the same AOI into one instance (i.e. 3 5ms instances at Left -> 15 ms at Left)
-        temp_df = self.outDict[ID]["Raw_Timeline"][trial][:,1:]
-        temp_code = temp_df[0,0]
-        temp_time = temp_df[0,1]
-        temp_list = []
-        
-        with np.nditer(temp_df[1:,:], flags=['external_loop', 'refs_ok'], order='C') as it:
-            for row in it:
-                if row[0] != temp_code:
-                    temp_list.append(f"{self.number_decode(temp_code)}: {temp_time}ms")
-                    temp_code = row[0]
-                    temp_time = row[1]
-                else:
-                    temp_time += row[1]    
-                    
-        if temp_code == temp_df[-1,0]:
-                    temp_list.append(f"{self.number_decode(temp_code)}: {temp_time}ms")
-
-        self.outDict[ID]["Timeline"][trial] = temp_list
-        return temp_list
+    def timeline(self, ID):
+        #Combines a series of instances in the same AOI into one instance (i.e. 3 5ms instances at Left -> 15 ms at Left), kept as numeric arrays until export (see export_view())
+        self.runs, self.run_offsets = run_lengths(self.lookAOI["AOI"], self.lookAOI["Time"], self.offsets)
+        for k,trial in enumerate(self.trials):
+            self.outDict[ID]["Timeline"][trial] = {key: self.runs[key][self.run_offsets[k]:self.run_offsets[k+1]] for key in self.runs}
+        return self.runs
     
-    def looks(self, ID, trial):
-        self.outDict[ID]["FirstLook"][trial] = self.outDict[ID]["Timeline"][trial][0]
-        self.outDict[ID]["LastLook"][trial] = self.outDict[ID]["Timeline"][trial][-1]
-        self.outDict[ID]["FirstValid"][trial] = "err"
-        self.outDict[ID]["LastValid"][trial] = "err"
+    def looks(self, ID):
+        #Each look is stored as an (AOI code, time) pair, None when the participant never looked at the Left or Right AOI
+        runs = self.runs
+        valid = np.flatnonzero(runs["AOI"] > 0)  #Looks at Left or Right, i.e. not NaN or Neither
+        first_valid = np.searchsorted(valid, self.run_offsets[:-1])  #Position in valid of each trial's first and last valid run
+        last_valid = np.searchsorted(valid, self.run_offsets[1:]) - 1
         
-        for entry in self.outDict[ID]["Timeline"][trial]:
-            if "NaN" not in entry and "Neither" not in entry:
-                self.outDict[ID]["FirstValid"][trial] = entry
-                break
-        for i in range(-1, -(len(self.outDict[ID]["Timeline"][trial])+1), -1):
-            entry = self.outDict[ID]["Timeline"][trial][i]
-            if "NaN" not in entry and "Neither" not in entry:
-                self.outDict[ID]["LastValid"][trial] = entry
-                break
+        for k,trial in enumerate(self.trials):
+            first = self.run_offsets[k]
+            last = self.run_offsets[k+1] - 1
+            self.outDict[ID]["FirstLook"][trial] = (int(runs["AOI"][first]), runs["Time"][first])
+            self.outDict[ID]["LastLook"][trial] = (int(runs["AOI"][last]), runs["Time"][last])
+            self.outDict[ID]["FirstValid"][trial] = None
+            self.outDict[ID]["LastValid"][trial] = None
+            if first_valid[k] <= last_valid[k]:
+                self.outDict[ID]["FirstValid"][trial] = (int(runs["AOI"][valid[first_valid[k]]]), runs["Time"][valid[first_valid[k]]])
+                self.outDict[ID]["LastValid"][trial] = (int(runs["AOI"][valid[last_valid[k]]]), runs["Time"][valid[last_valid[k]]])
     
     
-    def markov(self, ID, trial):
-        #This and all subsequent Markov calculations work by finding the start and end point of a transition and using them as indices.  These changes are summed up before being divided by the total number of transitions
-        self.outDict[ID]["Markov"][trial] = {"Left":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "Right":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "NaN":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "Neither":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]}}
-        
-        temp_df = self.outDict[ID]["Raw_Timeline"][trial][:,1:]
-        with np.nditer(temp_df, flags=['external_loop', 'refs_ok'], order='C') as it:
-            for i,row in enumerate(itertools.islice(it, (len(temp_df)-1))):
-                self.outDict[ID]["Markov"][trial][self.number_decode(row[0])][self.number_decode(temp_df[i+1,0])][1] += 1
-
-        for a in ["Left","Right","Neither","NaN"]:
-            for b in ["Left","Right","Neither","NaN"]:
-                self.outDict[ID]["Markov"][trial][a][b][0] = self.outDict[ID]["Markov"][trial][a][b][1]/np.nansum(a = [self.outDict[ID]["Markov"][trial][a]["Left"][1],
-                                                                                                                                          self.outDict[ID]["Markov"][trial][a]["Right"][1],
-                                                                                                                                       self.outDict[ID]["Markov"][trial][a]["NaN"][1],
-                                                                                                                                          self.outDict[ID]["Markov"][trial][a]["Neither"][1]])
+    def markov(self, ID):
+        #This and all subsequent Markov calculations count the transitions between successive entries of each trial as a 4x4 matrix (one row/column per AOI plus NaN and Neither, see transition_counts()), which export_view() turns into the nested dictionary of [probability, count] lists
+        counts = transition_counts(self.lookAOI["AOI"], offsets = self.offsets, size = self.aois.size)
+        for k,trial in enumerate(self.trials):
+            self.outDict[ID]["Markov"][trial] = counts[k]
     
-    def adj_markov(self, ID, trial, times):
+    def adj_markov(self, ID):
         #Uses the condensed timeline rather than the more extensive LookAOI array
-        self.outDict[ID]["Adj_Markov"][trial] = {"Left":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "Right":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "NaN":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "Neither":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]}}
-        
-        for i,entry in enumerate(times[:-1]):
-            first = entry.split(": ")[0]
-            second = times[i+1].split(": ")[0]                        
-            self.outDict[ID]["Adj_Markov"][trial][first][second][1] += 1
-        
-        for a in ["Left","Right","Neither","NaN"]:
-            for b in ["Left","Right","Neither","NaN"]:
-                self.outDict[ID]["Adj_Markov"][trial][a][b][0] = self.outDict[ID]["Adj_Markov"][trial][a][b][1]/np.nansum(a = [self.outDict[ID]["Adj_Markov"][trial][a]["Left"][1],
-                                                                                                                                          self.outDict[ID]["Adj_Markov"][trial][a]["Right"][1],
-                                                                                                                                       self.outDict[ID]["Adj_Markov"][trial][a]["NaN"][1],
-                                                                                                                                          self.outDict[ID]["Adj_Markov"][trial][a]["Neither"][1]])
+        counts = transition_counts(self.runs["AOI"], offsets = self.run_offsets, size = self.aois.size)
+        for k,trial in enumerate(self.trials):
+            self.outDict[ID]["Adj_Markov"][trial] = counts[k]
     
-    def nei_markov(self, ID, trial, times, neither_cut = 100):
-        self.outDict[ID]["Nei_Markov"][trial] = {"Left":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "Right":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "NaN":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]},
-                                                       "Neither":{"Left":[0,0], "Right":[0,0], "NaN":[0,0],"Neither":[0,0]}}
-        
-        i = 0
-        while i < (len(times)-1):
-            first = times[i].split(": ")[0]
-            second = times[i+1].split(": ")[0]
-            temp_time = float(times[i+1].split(": ")[1][:-2])
-            
-            i+=1
-            
-            if "Nei" in second and temp_time < 100 and i != 0 and i < len(times)-1:
-                if "Left" in times[i-1] and "Right" in times[i+1]:
-                    i += 1
-                    second = times[i].split(": ")[0]
-                elif "Right" in times[i-1] and "Left" in times[i+1]:
-                    i += 1
-                    second = times[i].split(": ")[0]
-            
-            self.outDict[ID]["Nei_Markov"][trial][first][second][1] += 1
-                
-        for a in ["Left","Right","Neither","NaN"]:
-            for b in ["Left","Right","Neither","NaN"]:
-                self.outDict[ID]["Nei_Markov"][trial][a][b][0] = self.outDict[ID]["Nei_Markov"][trial][a][b][1]/np.nansum(a = [self.outDict[ID]["Nei_Markov"][trial][a]["Left"][1],
-                                                                                                                                          self.outDict[ID]["Nei_Markov"][trial][a]["Right"][1],
-                                                                                                                                       self.outDict[ID]["Nei_Markov"][trial][a]["NaN"][1],
-                                                                                                                                          self.outDict[ID]["Nei_Markov"][trial][a]["Neither"][1]])
+    def nei_markov(self, ID, neither_cut = 100):
+        keep = ~transition_neithers(self.runs["AOI"], self.runs["Time"], neither_cut, self.run_offsets)
+        counts = transition_counts(self.runs["AOI"], keep = keep, offsets = self.run_offsets, size = self.aois.size)
+        for k,trial in enumerate(self.trials):
+            self.nei_sweep[neither_cut][trial] = counts[k]
+    
+    def errors(self, ID):
+        #NaNs are counted on the raw locations, i.e. before fill_gaps()
+        lengths = np.diff(self.offsets)
+        nans = np.bincount(segment_ids(self.offsets)[self.lookAOI["Raw"] == -1], minlength = len(self.trials))
+        for k,trial in enumerate(self.trials):
+            self.outDict[ID]["TrialError"][trial] = 1 - nans[k]/lengths[k]
+        self.outDict[ID]["ParticipantError"] = 1 - nans.sum()/lengths.sum()
     
-    def return_dict(self):
-        del self.outDict[self.ID]["Raw_Timeline"]  #Raw_Timeline is both redundant and also not exportable as a .json b/c it's a 2D array
-        return self.outDict
\ No newline at end of file
+    def return_dict(self, cutoff = None):
+        #cutoff picks which of the neither cutoffs Nei_Markov is reported for, the default is the first one
+        self.outDict[self.ID].pop("Raw_Timeline", None)  #Raw_Timeline is both redundant and also not exportable as a .json b/c it's made of arrays
+        if cutoff is None:
+            return self.outDict
+        out = {self.ID: dict(self.outDict[self.ID])}  #Shallow copy, everything but Nei_Markov is shared between cutoffs
+        out[self.ID]["Nei_Markov"] = self.nei_sweep[cutoff]
+        return out
\ No newline at end of file
@@ -1,13 +1,94 @@
-from EyeMotionsIntake_Final import check_files, Intake
-from GazeExport_Final import gazeExport
+from EyeMotionsIntake_Final import Intake, export_view
+from GazeCatalog_Final import DatasetCatalog
+from GazeCohort_Final import CohortAggregator
+from GazeCache_Final import PairLoader, RecordingCache, WorkbookLoader
+from GazeLayout_Final import load_layouts
+from GazeManifest_Final import RunManifest
+from GazeMetrics_Final import Metrics
+from GazeStore_Final import ResultsStore
+from GazeExport_Final import gazeLong, gazeTable, joinTables, long_name, ResultsWriter, writeTable
 
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from datetime import datetime
 from tqdm import tqdm
-import json
+import pandas as pd
+import os
 
 
 
-def GazeAOI(data_folder, timestamp_folder, results_folder, JSON_out = f"{datetime.now().date()}.json", CSV_out = f"{datetime.now().date()}.csv", error_out = f"Errors_{datetime.now().date()}.csv", neither_cutoff = 100):
+def process_pair(data_file, timestamp_file, neither_cutoff = 100, max_nan_gap = 1, cache = None, sheets = None, metrics = False, layouts = None, gaze = None, loaded = []):
+    """
+    Runs Intake on a single data/timestamp pair.  Only the exportable dictionary and the errors are returned (never the raw arrays), so this is cheap to send back from a worker process.
+    sheets and gaze are the already loaded timestamp_file and data_file, if any (see Intake).  If metrics is True, the stages of the Intake are recorded (see GazeMetrics_Final.py).  layouts are the AOI layouts of the trials, if not the default (see GazeLayout_Final.py).  loaded are the metrics records of loading sheets and gaze ahead (see PairLoader in GazeCache_Final.py), which come first in records.
+
+    Returns
+    -------
+    out : the Intake's return_dict() for each neither cutoff (keyed by cutoff), or None if the participant was thrown out
+    err_list : the Intake's err_list
+    records : the metrics records of the Intake, empty if metrics is False
+    """
+    recorder = Metrics(enabled = metrics)
+    recorder.records.extend(loaded)
+    a = Intake(data_file, timestamp_file, neither_cutoff = neither_cutoff, max_nan_gap = max_nan_gap, cache = cache, sheets = sheets, metrics = recorder, layouts = layouts, gaze = gaze)
+    recorder.close()
+    if a.check_err == True:
+        return {cutoff: a.return_dict(cutoff) for cutoff in a.neither_cutoffs}, a.err_list, recorder.records
+    return None, a.err_list, recorder.records
+
+def sweep_name(file_name, cutoff):
+    #i.e. "2022-03-08.csv" -> "2022-03-08_100ms.csv"
+    stem, ext = os.path.splitext(file_name)
+    return f"{stem}_{cutoff}ms{ext}"
+
+def shard_folder(results_folder, index, count):
+    #Where shard index of count writes its results within results_folder, i.e. f"{results_folder}shard_3_of_8/"
+    return os.path.join(results_folder, f"shard_{index}_of_{count}", "")
+
+def submit_pairs(executor, pairs, sheets, window, neither_cutoff, max_nan_gap, cache, metrics, layouts):
+    #Yields the process_pair() results of every pair in order (keeping the merge deterministic), handing each pair to executor as soon as its workbook (from sheets, in pair order, with the records of loading it) is loaded, with at most window pairs submitted but not yet yielded
+    futures = deque()
+    for row, (workbook, loaded) in zip(pairs, sheets):
+        futures.append(executor.submit(process_pair, row[0], row[1], neither_cutoff, max_nan_gap, cache, workbook, metrics, layouts, None, loaded))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while len(futures) > 0:
+        yield futures.popleft().result()
+
+def merge_results(arr, done, computed, manifest = None, params = None):
+    #Yields the results of every pair of arr in order, loading the pairs marked done from the manifest and taking the rest from computed (which is consumed in order).  Freshly computed pairs are recorded as soon as they finish
+    try:
+        for row, stored in zip(arr, done):
+            if stored:
+                out, err_list = manifest.load(row[0], row[1])[:2]
+                yield out, err_list, []
+                continue
+            result = next(computed)
+            if manifest is not None:
+                manifest.record(row[0], row[1], params, result[:2])  #Metrics only describe the run that made them
+            yield result
+    finally:  #Also when the run is interrupted, so the pairs recorded since the last save aren't redone
+        if manifest is not None and manifest.pending > 0:
+            manifest.save()
+
+def sweep_view(out, cutoffs):
+    #Merges the results of every cutoff into one dictionary in which Nei_Markov is keyed by cutoff first, i.e. the "long" JSON of a sweep
+    long = {}
+    for participant in out[cutoffs[0]]:
+        long[participant] = dict(out[cutoffs[0]][participant])
+        long[participant]["Nei_Markov"] = {str(cutoff): out[cutoff][participant]["Nei_Markov"] for cutoff in cutoffs}
+    return long
+
+def write_tables(tables, long_tables, CSV_out, columnar_format = None):
+    #Writes the joined per participant tables (see joinTables()), nothing is written if a participant is neither Arrow nor Letter
+    table = joinTables(tables)
+    if table is None:
+        return 0
+    writeTable(table, CSV_out, columnar_format)
+    if long_tables is not None:
+        writeTable(joinTables(long_tables), long_name(CSV_out), columnar_format)
+
+def GazeAOI(data_folder, timestamp_folder, results_folder, JSON_out = f"{datetime.now().date()}.json", CSV_out = f"{datetime.now().date()}.csv", error_out = f"Errors_{datetime.now().date()}.csv", neither_cutoff = 100, sweep_output = "split", timeline_strings = True, max_nan_gap = 1, workers = 1, cache_folder = None, cache_max_bytes = 20*1024**3, columnar_format = None, long_format = False, json_format = "json", return_results = True, incremental = False, metrics = False, metrics_out = f"Metrics_{datetime.now().date()}.csv", layout_file = None, prefetch = 2, cohort_out = None, store_out = None, shard = None):
     """
     Aggregates the process of checking the data, processing it, analyzing it, and then exporting it.
     
@@ -19,48 +100,219 @@ def GazeAOI(data_folder, timestamp_folder, results_folder, JSON_out = f"{datetim
     JSON_out : output path for data in a JSON format.  The default is f"{datetime.now().date()}.json".
     CSV_out : output path for data in a CSV format.  The default is f"{datetime.now().date()}.csv".
     neither_cutoff : the maximum time spent looking at Neither between Ls or Rs to be considered a "transition" Neither. The default is 100.
+                     A list of cutoffs runs a sweep: everything but Nei_Markov is only calculated once per participant, and the results for each cutoff are written as per sweep_output.
+    sweep_output : how the results of a sweep are written.  "split" (the default) writes one CSV and one JSON per cutoff, named e.g. f"{date}_100ms.csv".
+                   "long" writes a single CSV with an added "Neither_Cutoff" column (one row per cutoff per trial) and a single JSON in which each Nei_Markov is keyed by cutoff first.
+    timeline_strings : If True (the default), the .json holds each Timeline entry and look as a "{loc}: x.yzms" string.  If False, they are written as parallel lists of locations, start indices and times instead (see export_view() in EyeMotionsIntake_Final.py), which can be loaded without any string parsing.
+    max_nan_gap : the longest run of NaN samples (in ~5ms data points) that is filled in with the location before it.  The default is 1, i.e. only isolated NaNs.
+    workers : the number of processes participants are spread over.  The default of 1 runs everything in this process, None uses every core.  Results are merged in the same order either way, so the outputs do not depend on it.
+    cache_folder : Folder path for a cache of the parsed input files (see GazeCache_Final.py), reruns then skip parsing every file that hasn't changed.  The default of None disables the cache.
+    cache_max_bytes : Size cap of the cache, least recently used files are dropped beyond it.  The default is 20 GB.
+    columnar_format : "parquet" or "feather" to also write every .csv as a typed, compressed binary table with the same name (requires pyarrow).  The default of None only writes .csv files.
+    long_format : If True, the Markov chains are also written in long form, one row per participant/trial/matrix/transition (see gazeLong() in GazeExport_Final.py), e.g. to f"{date}_long.csv".  The default is False.
+    json_format : "json" (the default) writes JSON_out as a single JSON object, "ndjson" writes one line per participant instead (see ResultsWriter in GazeExport_Final.py).  Either way each participant is written as soon as it is done.
+    return_results : If False, nothing but the export table of each participant is kept in memory once it is written, and None is returned.  The default is True.
+    incremental : If True, every processed data/timestamp pair is recorded in a manifest in results_folder (see GazeManifest_Final.py), and reruns only process the pairs that are new, changed, or were run with other parameters; the results of all other pairs are loaded from the manifest and merged into the outputs as usual.  This also resumes an interrupted run.  The default is False.
+    metrics : If True, the wall time, samples and peak memory of every stage are recorded per participant (see GazeMetrics_Final.py) and written to metrics_out in results_folder, next to the error file.  The default is False, which costs next to nothing.
+              The pipeline is the same with or without metrics: with prefetch, the reading stages are timed in the background threads that run them, without a peak memory, and the peaks of the stages running meanwhile include what those threads allocate.  Set prefetch = 0 for the peak memory of the reading stages.
+    metrics_out : output path for the metrics.  The default is f"Metrics_{datetime.now().date()}.csv".
+    layout_file : optional .csv/.xlsx of the AOIs of each trial (see load_layouts() in GazeLayout_Final.py).  The results then hold a ratio per AOI and a Markov row/column per AOI, and the .csv a column per AOI (pair).  The default of None uses the Left and Right AOIs.
+    prefetch : the number of data/timestamp pairs read and parsed ahead in background threads while a participant is processed (see PairLoader in GazeCache_Final.py), so that waiting on the drive overlaps with the analysis.  Memory holds at most prefetch+1 parsed pairs.  The default is 2, 0 reads each pair only when it is processed.  With workers, only the response workbooks are loaded ahead (prefetch of them, see WorkbookLoader), and each worker is handed at most two pairs at a time.  With metrics, the loading is recorded in the background threads (see metrics).
+    cohort_out : optional output path in results_folder for a cohort summary: the mean and variance of every Ratios share and transition probability, and the pooled Markov matrices, per condition per trial (see GazeCohort_Final.py).  Each participant is folded in as soon as it is done, so this takes no more memory for a larger study.  A sweep writes one summary per cutoff as per sweep_output.  The default of None writes no summary.
+    store_out : optional output path in results_folder for a SQLite database of the results (see ResultsStore in GazeStore_Final.py), i.e. "results.db", in which single participants, trials or conditions can be looked up without loading the .json.  Every cutoff of a sweep is stored in it.  The default of None writes no database.
+    shard : optional (index, count) to only process shard index (0 to count-1) of count, split by participant (see DatasetCatalog.shard() in GazeCatalog_Final.py), i.e. one node's part of a sharded run.  The shards are combined with merge_shards().  The default of None processes every pair.
 
     Returns
     -------
-    dictionary : Same as the dictionary exported via JSON_out
+    dictionary : Same as the dictionary exported via JSON_out, i.e. the results after export_view() (see EyeMotionsIntake_Final.py).  For a sweep, a dictionary keyed by cutoff of that same form, as in the "split" JSON of each cutoff.  GazeStore_Final.ResultsStore.results() gives the numeric form instead.
     """
-    dictionary = {}
+    results_folder = os.path.join(results_folder, "")  #Output paths are results_folder + name
+    sweep = isinstance(neither_cutoff, (list, tuple))
+    cutoffs = list(neither_cutoff) if sweep else [neither_cutoff]
+    dictionaries = {cutoff: {} for cutoff in cutoffs}  #The returned results, in the form of the .json of each cutoff
+    tables = {cutoff: {} for cutoff in cutoffs}  #Only the export table rows of each participant are kept, the full results are written as soon as a participant is done
+    long_tables = {cutoff: {} for cutoff in cutoffs}
+    cohorts = {cutoff: CohortAggregator() for cutoff in cutoffs}
+    store = None
+    if store_out is not None:
+        store = ResultsStore(results_folder + store_out)
     errs = []
     
-    arr = check_files(data_folder, timestamp_folder)
+    if sweep and sweep_output == "long":
+        writers = {None: ResultsWriter(results_folder + JSON_out, json_format, timeline_strings)}
+    elif sweep:
+        writers = {cutoff: ResultsWriter(results_folder + sweep_name(JSON_out, cutoff), json_format, timeline_strings) for cutoff in cutoffs}
+    else:
+        writers = {neither_cutoff: ResultsWriter(results_folder + JSON_out, json_format, timeline_strings)}
+    
+    recorder = Metrics(enabled = metrics)
+    with recorder.stage("check_files"):
+        catalog = DatasetCatalog(data_folder, timestamp_folder)  #Pairs each data file with its response file (see check_files() in EyeMotionsIntake_Final.py)
+    catalog.report()
+    errs = errs + catalog.errors
+    arr = catalog.pairs
+    if shard is not None:
+        arr = catalog.shard(*shard)
+    cache = None
+    if cache_folder is not None:
+        cache = RecordingCache(cache_folder, max_bytes = cache_max_bytes)
      
-    for row in tqdm(arr):
-        a = Intake(row[0], row[1], neither_cutoff = neither_cutoff)
-        errs = errs + a.err_list
-        if a.check_err == True:
-            dictionary.update(a.return_dict())
+    layouts = None
+    if layout_file is not None:
+        layouts = load_layouts(layout_file)
+    
+    manifest = None
+    params = {"neither_cutoff": neither_cutoff, "max_nan_gap": max_nan_gap}  #Everything that affects the results of a pair
+    if layouts is not None:
+        params["layouts"] = layouts.fingerprint()
+    done = [False]*len(arr)
+    if incremental:
+        manifest = RunManifest(results_folder)
+        manifest.prune(arr)
+        done = [manifest.done(row[0], row[1], params) for row in arr]
+    pending = arr[[not d for d in done]]
+    
+    executor = None
+    loader = None
+    workbooks = None
+    if workers == 1 and prefetch == 0:
+        computed = (process_pair(row[0], row[1], neither_cutoff, max_nan_gap, cache, None, metrics, layouts) for row in pending)
+    elif workers == 1:
+        loader = PairLoader(cache, depth = prefetch, metrics = metrics)  #The next pairs are loaded in the background, while this one is processed
+        computed = (process_pair(row[0], row[1], neither_cutoff, max_nan_gap, cache, sheets, metrics, layouts, gaze, loaded) for row, (gaze, sheets, loaded) in zip(pending, loader.load(pending)))
+    else:
+        executor = ProcessPoolExecutor(max_workers = workers)
+        workbooks = WorkbookLoader(cache, depth = prefetch, metrics = metrics)  #The workers parse their own data files, the response workbooks are loaded ahead in the background
+        sheets = workbooks.load(pending)
+        computed = submit_pairs(executor, pending, sheets, 2*(workers or os.cpu_count()), neither_cutoff, max_nan_gap, cache, metrics, layouts)  #Two pairs per worker keep every worker busy
+    results = merge_results(arr, done, computed, manifest, params)
+    
+    for out, err_list, records in tqdm(results, total = len(arr)):
+        errs = errs + err_list
+        recorder.extend(records)
+        if out is None:
+            continue
+        for participant in out[cutoffs[0]]:
+            recorder.participant = participant
+            with recorder.stage("gaze_table"):
+                for cutoff in cutoffs:
+                    tables[cutoff][participant] = gazeTable(out[cutoff])
+                    if long_format:
+                        long_tables[cutoff][participant] = gazeLong(out[cutoff])
+        if store is not None:
+            with recorder.stage("write_store"):
+                store.write(out)
+        if cohort_out is not None:
+            with recorder.stage("cohort"):
+                for cutoff in cutoffs:
+                    cohorts[cutoff].add(out[cutoff])
         
-    gazeExport(data = dictionary, 
-                CSV_out = results_folder + CSV_out)
+        with recorder.stage("write_json"):
+            views = {}
+            if None in writers:
+                writers[None].write(sweep_view(out, cutoffs))
+            else:
+                for cutoff in writers:
+                    views[cutoff] = writers[cutoff].write(out[cutoff])
+        if return_results:
+            for cutoff in cutoffs:
+                dictionaries[cutoff].update(views[cutoff] if cutoff in views else export_view(out[cutoff], timeline_strings))
+    if executor is not None:
+        executor.shutdown()
+    if loader is not None:
+        loader.close()
+    if workbooks is not None:
+        workbooks.close()
+    for writer in writers.values():
+        writer.close()
+    if store is not None:
+        store.close()
+    
+    recorder.participant = None
+    with recorder.stage("write_csv"):
+        if not sweep:
+            write_tables(tables[neither_cutoff].values(), long_tables[neither_cutoff].values() if long_format else None, results_folder + CSV_out, columnar_format)
+        elif sweep_output == "long":
+            joined = []
+            long_joined = []
+            for cutoff in cutoffs:
+                table = joinTables(tables[cutoff].values())
+                table.insert(0, "Neither_Cutoff", cutoff)
+                joined.append(table)
+                if long_format:
+                    table = joinTables(long_tables[cutoff].values())
+                    table.insert(0, "Neither_Cutoff", cutoff)
+                    long_joined.append(table)
+            write_tables(joined, long_joined if long_format else None, results_folder + CSV_out, columnar_format)
+        else:
+            for cutoff in cutoffs:
+                write_tables(tables[cutoff].values(), long_tables[cutoff].values() if long_format else None, results_folder + sweep_name(CSV_out, cutoff), columnar_format)
     
-    out_file = open(results_folder + JSON_out, "w")
-    json.dump(dictionary, out_file, indent = 4)
+    if cohort_out is not None:
+        with recorder.stage("write_cohort"):
+            if not sweep:
+                cohorts[neither_cutoff].summary().to_csv(results_folder + cohort_out, index = False)
+            elif sweep_output == "long":
+                joined = []
+                for cutoff in cutoffs:
+                    table = cohorts[cutoff].summary()
+                    table.insert(0, "Neither_Cutoff", cutoff)
+                    joined.append(table)
+                pd.concat(joined, ignore_index = True).to_csv(results_folder + cohort_out, index = False)
+            else:
+                for cutoff in cutoffs:
+                    cohorts[cutoff].summary().to_csv(results_folder + sweep_name(cohort_out, cutoff), index = False)
     
     with open(results_folder + error_out, "w") as file:
         for item in errs:
             file.write(item + "\n")
-            
-    return dictionary
-
-c = GazeAOI(data_folder = "M:/AResearch/Gaze_AOI2/Eye Tracking/",
-        timestamp_folder= "M:/AResearch/Gaze_AOI2/Eye Tracking/Timestamps/",
-        results_folder = "M:/AResearch/Gaze_AOI2/Results/",
-        )
-
-# JSONs = ["100ms_cutoff.json", "200ms_cutoff.json"]
-# CSVs = ["100ms_cutoff.csv", "200ms_cutoff.csv"]
-# COs = [100,200]
-
-# for i in range(2):
-#     c = GazeAOI(data_folder = "M:/AResearch/Gaze_AOI2/Eye Tracking/",
-#             timestamp_folder= "M:/AResearch/Gaze_AOI2/Eye Tracking/Timestamps/",
-#             results_folder = "M:/AResearch/Gaze_AOI2/Results/",
-#             JSON_out= JSONs[i],
-#             CSV_out= CSVs[i],
-#             neither_cutoff= COs[i]
-#             )
\ No newline at end of file
+    if metrics:
+        recorder.write(results_folder + metrics_out)
+    recorder.close()
+    if manifest is not None:
+        manifest.outputs(JSON_out = results_folder + JSON_out, CSV_out = results_folder + CSV_out, error_out = results_folder + error_out)
+    
+    if not return_results:
+        return None
+    if not sweep:
+        return dictionaries[neither_cutoff]
+    return dictionaries
+
+def merge_shards(data_folder, timestamp_folder, results_folder, shard_folders, **options):
+    """
+    Combines the results of a sharded run (see shard in GazeAOI()) into the same outputs a single GazeAOI() run over the whole dataset writes.
+
+    Each shard's run has to be incremental, so that the results of every pair are stored in its manifest (see GazeManifest_Final.py).  Those are all taken over into the manifest of results_folder, and GazeAOI() is then rerun incrementally over the whole dataset, which loads every pair instead of processing it and writes the outputs in the usual order.
+    Pairs without stored results (i.e. of a shard that failed, or run with other parameters) are processed as part of the merge.
+
+    Parameters
+    ----------
+    data_folder : Folder path containing EyeMotions data, as given to the shards
+    timestamp_folder : Folder path containing the response files, as given to the shards
+    results_folder : Folder path for the merged outputs
+    shard_folders : list of the results folders of the shards, i.e. from shard_folder()
+    **options : passed on to GazeAOI(), the parameters that affect the results (neither_cutoff, max_nan_gap, layout_file) have to match those of the shards
+
+    Returns
+    -------
+    dictionary : as returned by GazeAOI()
+    """
+    manifest = RunManifest(results_folder)
+    for folder in shard_folders:
+        manifest.merge(folder)
+    return GazeAOI(data_folder, timestamp_folder, results_folder, incremental = True, **options)
+
+if __name__ == "__main__":  #Keeps worker processes from rerunning the script when they import it
+    c = GazeAOI(data_folder = "M:/AResearch/Gaze_AOI2/Eye Tracking/",
+            timestamp_folder= "M:/AResearch/Gaze_AOI2/Eye Tracking/Timestamps/",
+            results_folder = "M:/AResearch/Gaze_AOI2/Results/",
+            )
+
+    # Sensitivity analysis over several neither cutoffs, only Nei_Markov is recalculated per cutoff:
+    # c = GazeAOI(data_folder = "M:/AResearch/Gaze_AOI2/Eye Tracking/",
+    #         timestamp_folder= "M:/AResearch/Gaze_AOI2/Eye Tracking/Timestamps/",
+    #         results_folder = "M:/AResearch/Gaze_AOI2/Results/",
+    #         JSON_out= "cutoff.json",
+    #         CSV_out= "cutoff.csv",
+    #         neither_cutoff= [100,200]
+    #         )
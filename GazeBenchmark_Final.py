@@ -0,0 +1,183 @@
+from EyeMotionsIntake_Final import check_files, fill_gaps, Intake, look_aoi, read_eyemotions, read_timestamps, trial_indices, valid_times
+from GazeAOI_Final import GazeAOI, process_pair
+from GazeExport_Final import gazeTable, joinTables, ResultsWriter, writeTable
+from GazeSynthetic_Final import generate_dataset
+
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+OUTPUTS = {"JSON_out": "results.json", "CSV_out": "results.csv", "error_out": "errors.csv"}
+
+class MemoryCache():
+    #Hands Intake files that were already parsed (same interface as GazeCache_Final.RecordingCache), so that its stages are timed without the parsing
+    def __init__(self, parsed):
+        self.parsed = parsed
+
+    def load(self, path, reader):
+        return self.parsed[path]
+
+def timed(function, *args, **kwargs):
+    #Returns the result of function and how long it took (s)
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def stage_times(data_file, timestamp_file, neither_cutoff = 100, max_nan_gap = 1):
+    """
+    Times every stage of processing one data/timestamp pair.  Each stage is run on its own, on the same inputs Intake gives it.
+
+    Parameters
+    ----------
+    data_file : path of the EyeMotions file
+    timestamp_file : path of the response file
+    neither_cutoff : passed on to Intake
+    max_nan_gap : passed on to Intake
+
+    Returns
+    -------
+    times : dictionary of stage -> seconds
+    samples : number of gaze samples in the trials, 0 if the participant was thrown out
+    """
+    times = {}
+    gaze, times["read_eyemotions"] = timed(read_eyemotions, data_file)
+    sheets, times["read_timestamps"] = timed(read_timestamps, timestamp_file)
+    cache = MemoryCache({data_file: gaze, timestamp_file: sheets})
+    a, times["intake"] = timed(Intake, data_file, timestamp_file, neither_cutoff, max_nan_gap = max_nan_gap, cache = cache)
+    if not a.check_err:
+        return times, 0
+
+    times_sheet = valid_times(sheets["Times"])  #Filtered as in Intake
+    _, times["find_times"] = timed(trial_indices, a.data["Timestamp"], times_sheet[:,1].astype(float), times_sheet[:,2].astype(float))
+    start_i = np.array([a.times[trial]["start_i"] for trial in a.trials], dtype = np.int64)
+    end_i = np.array([a.times[trial]["end_i"] for trial in a.trials], dtype = np.int64)
+    lookAOI, times["look_aoi"] = timed(look_aoi, a.data, start_i, end_i)
+    _, times["fill_gaps"] = timed(fill_gaps, lookAOI, max_nan_gap, a.offsets)
+
+    for stage in ["ratios", "timeline", "looks", "markov", "adj_markov", "errors"]:
+        _, times[stage] = timed(getattr(a, stage), a.ID)
+    times["nei_markov"] = 0
+    for cutoff in a.neither_cutoffs:
+        times["nei_markov"] += timed(a.nei_markov, a.ID, neither_cut = cutoff)[1]
+    return times, int(a.offsets[-1])
+
+def run_outputs(folder):
+    #Hashes of the files a GazeAOI run wrote to folder
+    return {name: file_hash(folder + name) for name in OUTPUTS.values()}
+
+def benchmark(data_folder, timestamp_folder, results_folder, neither_cutoff = 100, workers = 2, baseline_file = None, tolerance = 1.5, min_seconds = 0.05, update_baseline = False):
+    """
+    Times the whole pipeline on a dataset, checks that every way of running it gives the same results, and compares both with a baseline from an earlier run.
+
+    Stages are timed per participant (see stage_times()) and summed, along with check_files, building/writing the export table and writing the .json.  The reference path (a serial, uncached GazeAOI run) is then timed end to end,
+    and its outputs compared byte for byte with a run over workers processes, a cold and a warm cached run, and an incremental rerun.
+
+    Parameters
+    ----------
+    data_folder : Folder path containing EyeMotions data, i.e. from GazeSynthetic_Final.generate_dataset()
+    timestamp_folder : Folder path containing the response files
+    results_folder : Folder path for the benchmark's scratch outputs, its subfolders are deleted and rewritten
+    neither_cutoff : passed on to GazeAOI
+    workers : processes of the parallel run
+    baseline_file : optional .json path of the baseline (stage times and output hashes), written if it doesn't exist yet
+    tolerance : a stage that takes more than tolerance times its baseline time is a regression.  The default is 1.5.
+    min_seconds : stages faster than this (in the baseline) are too noisy to flag
+    update_baseline : If True, the baseline is overwritten with this run
+
+    Returns
+    -------
+    report : dictionary of "stages" (seconds), "samples", "participants", "samples_per_second", "participants_per_minute", "outputs" (hashes of the reference outputs) and "failures" (a list of messages, empty if the run passed)
+    """
+    report = {"stages": {}, "failures": []}
+    stages = report["stages"]
+
+    arr, stages["check_files"] = timed(check_files, data_folder, timestamp_folder)
+
+    samples = 0
+    results = []
+    for row in arr:
+        times, count = stage_times(row[0], row[1], neither_cutoff)
+        samples += count
+        for stage in times:
+            stages[stage] = stages.get(stage, 0) + times[stage]
+        results.append(process_pair(row[0], row[1], neither_cutoff))
+
+    scratch = os.path.join(results_folder, "stages", "")
+    shutil.rmtree(scratch, ignore_errors = True)
+    os.makedirs(scratch)
+    outs = [result[0][neither_cutoff] for result in results if result[0] is not None]
+    table, stages["gaze_table"] = timed(lambda: joinTables(gazeTable(out) for out in outs))
+    _, stages["write_csv"] = timed(writeTable, table, scratch + "results.csv")
+    start = time.perf_counter()
+    writer = ResultsWriter(scratch + "results.json")
+    for out in outs:
+        writer.write(out)
+    writer.close()
+    stages["write_json"] = time.perf_counter() - start
+
+    runs = {"reference": {"workers": 1},
+            "parallel": {"workers": workers},
+            "cached_cold": {"cache_folder": os.path.join(results_folder, "cache", "")},
+            "cached_warm": {"cache_folder": os.path.join(results_folder, "cache", "")},
+            "incremental": {"incremental": True},
+            "incremental_rerun": {"incremental": True}}
+    shutil.rmtree(os.path.join(results_folder, "cache"), ignore_errors = True)
+    for name, options in runs.items():
+        folder = os.path.join(results_folder, name if name != "incremental_rerun" else "incremental", "")
+        if name != "incremental_rerun":
+            shutil.rmtree(folder, ignore_errors = True)
+            os.makedirs(folder)
+        _, stages[f"gaze_aoi_{name}"] = timed(GazeAOI, data_folder, timestamp_folder, folder, neither_cutoff = neither_cutoff, **OUTPUTS, **options)
+        outputs = run_outputs(folder)
+        if name == "reference":
+            report["outputs"] = outputs
+        elif outputs != report["outputs"]:
+            report["failures"].append(f"{name} run differs from the reference run: {[out for out in outputs if outputs[out] != report['outputs'][out]]}")
+
+    report["samples"] = samples
+    report["participants"] = len(arr)
+    report["samples_per_second"] = samples/stages["intake"] if stages.get("intake") else 0
+    report["participants_per_minute"] = 60*len(arr)/stages["gaze_aoi_reference"]
+
+    if baseline_file is not None and os.path.exists(baseline_file) and not update_baseline:
+        with open(baseline_file) as file:
+            baseline = json.load(file)
+        if baseline["outputs"] != report["outputs"]:
+            report["failures"].append("Results differ from the baseline: " + ", ".join(out for out in report["outputs"] if report["outputs"][out] != baseline["outputs"].get(out)))
+        for stage, seconds in baseline["stages"].items():
+            if seconds >= min_seconds and stages.get(stage, 0) > tolerance*seconds:
+                report["failures"].append(f"{stage} regressed: {stages[stage]:.3f}s vs {seconds:.3f}s in the baseline")
+    elif baseline_file is not None:
+        with open(baseline_file, "w") as file:
+            json.dump({"stages": stages, "outputs": report["outputs"]}, file, indent = 4)
+    return report
+
+def print_report(report):
+    width = max(len(stage) for stage in report["stages"])
+    for stage, seconds in report["stages"].items():
+        print(f"{stage:<{width}}  {seconds:9.3f}s")
+    print(f"{report['participants']} recordings, {report['samples']} samples")
+    print(f"{report['samples_per_second']:,.0f} samples/s through Intake, {report['participants_per_minute']:.1f} recordings/min end to end")
+    if len(report["failures"]) == 0:
+        print("PASSED")
+    else:
+        print("FAILED:")
+        for failure in report["failures"]:
+            print(f"    - {failure}")
+
+if __name__ == "__main__":
+    folder = "M:/AResearch/Gaze_AOI2/Benchmark/"
+    if not os.path.exists(folder + "data"):
+        generate_dataset(folder, participants = 10, overlapping = 1, missing_data = 1)
+    report = benchmark(folder + "data/", folder + "timestamps/", folder + "results/", baseline_file = folder + "baseline.json")
+    print_report(report)
+    if len(report["failures"]) > 0:
+        sys.exit(1)
@@ -0,0 +1,124 @@
+from GazeAOI_Final import GazeAOI, merge_shards, shard_folder
+from GazeHealth_Final import health_report
+
+from datetime import datetime
+import argparse
+import os
+import sys
+
+def parse_shard(text):
+    #"3/8" -> (3, 8)
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a shard as i/N (i.e. 3/8), got {text}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard {text} doesn't exist, i goes from 0 to N-1")
+    return index, count
+
+def parse_cutoff(text):
+    #"100" -> 100, "12.5" -> 12.5, whole numbers stay ints so the output names (i.e. f"{date}_100ms.csv") are the same as from GazeAOI()
+    try:
+        cutoff = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a cutoff in ms, got {text}")
+    return int(cutoff) if cutoff.is_integer() else cutoff
+
+def add_options(parser):
+    #The GazeAOI() options shared by every command
+    parser.add_argument("data_folder", help = "Folder containing the EyeMotions data")
+    parser.add_argument("timestamp_folder", help = "Folder containing the response files")
+    parser.add_argument("results_folder", help = "Folder for the results")
+    parser.add_argument("--json-out", default = f"{datetime.now().date()}.json")
+    parser.add_argument("--csv-out", default = f"{datetime.now().date()}.csv")
+    parser.add_argument("--error-out", default = f"Errors_{datetime.now().date()}.csv")
+    parser.add_argument("--neither-cutoff", type = parse_cutoff, nargs = "+", default = [100], help = "Several cutoffs run a sweep")
+    parser.add_argument("--sweep-output", choices = ["split", "long"], default = "split")
+    parser.add_argument("--max-nan-gap", type = int, default = 1)
+    parser.add_argument("--workers", type = int, default = 1, help = "0 uses every core")
+    parser.add_argument("--prefetch", type = int, default = 2)
+    parser.add_argument("--cache-folder", default = None)
+    parser.add_argument("--layout-file", default = None)
+    parser.add_argument("--columnar-format", choices = ["parquet", "feather"], default = None)
+    parser.add_argument("--long-format", action = "store_true")
+    parser.add_argument("--json-format", choices = ["json", "ndjson"], default = "json")
+    parser.add_argument("--numeric-timelines", action = "store_true", help = "Write the timelines and looks as lists rather than strings (timeline_strings = False)")
+    parser.add_argument("--cohort-out", default = None)
+    parser.add_argument("--store-out", default = None)
+
+def gaze_options(args):
+    #The keyword arguments of GazeAOI() for the parsed args
+    return {"JSON_out": args.json_out,
+            "CSV_out": args.csv_out,
+            "error_out": args.error_out,
+            "neither_cutoff": args.neither_cutoff[0] if len(args.neither_cutoff) == 1 else args.neither_cutoff,
+            "sweep_output": args.sweep_output,
+            "timeline_strings": not args.numeric_timelines,
+            "max_nan_gap": args.max_nan_gap,
+            "workers": None if args.workers == 0 else args.workers,
+            "cache_folder": args.cache_folder,
+            "columnar_format": args.columnar_format,
+            "long_format": args.long_format,
+            "json_format": args.json_format,
+            "return_results": False,
+            "layout_file": args.layout_file,
+            "prefetch": args.prefetch,
+            "cohort_out": args.cohort_out,
+            "store_out": args.store_out}
+
+def main(argv = None):
+    """
+    Command line entry point wrapping GazeAOI(), i.e.
+        python GazeCLI_Final.py run DATA TIMESTAMPS RESULTS
+    runs a whole study, and a study is spread over N nodes (sharing nothing but the filesystem) with
+        python GazeCLI_Final.py run DATA TIMESTAMPS RESULTS --shard i/N        (on each node, i from 0 to N-1)
+        python GazeCLI_Final.py merge DATA TIMESTAMPS RESULTS --shards N       (once every shard is done)
+    Each shard writes its own .csv, .json and error file to RESULTS/shard_i_of_N/, and merge writes the same files to RESULTS that a single run would (see merge_shards() in GazeAOI_Final.py).
+        python GazeCLI_Final.py health DATA TIMESTAMPS --out report.csv
+    checks the whole dataset without parsing the data files (see health_report() in GazeHealth_Final.py), exiting with 1 if any pair isn't OK or any file is misnamed.
+    Run with --help for every option.
+
+    Parameters
+    ----------
+    argv : list of the arguments, the default of None takes them from sys.argv
+    """
+    parser = argparse.ArgumentParser(prog = "GazeCLI_Final.py", description = "Gaze AOI analysis of EyeMotions recordings")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    run = commands.add_parser("run", help = "Process a study, or one shard of it")
+    add_options(run)
+    run.add_argument("--shard", type = parse_shard, default = None, help = "Only process shard i of N (i/N, i from 0), written to RESULTS/shard_i_of_N/")
+    run.add_argument("--incremental", action = "store_true", help = "Only process new or changed pairs (always on for a shard)")
+    run.add_argument("--metrics", action = "store_true")
+    merge = commands.add_parser("merge", help = "Combine the shards of a sharded run into the outputs of a single run")
+    add_options(merge)
+    merge.add_argument("--shards", type = int, required = True, help = "The N the shards were run with")
+    health = commands.add_parser("health", help = "Check every pair of a study without parsing the data files")
+    health.add_argument("data_folder", help = "Folder containing the EyeMotions data")
+    health.add_argument("timestamp_folder", help = "Folder containing the response files")
+    health.add_argument("--out", default = None, help = "Path of a .csv for the report")
+    health.add_argument("--workers", type = int, default = 4)
+    args = parser.parse_args(argv)
+    args.data_folder = os.path.join(args.data_folder, "")
+    args.timestamp_folder = os.path.join(args.timestamp_folder, "")
+
+    if args.command == "health":
+        report = health_report(args.data_folder, args.timestamp_folder, args.out, workers = args.workers)
+        return 0 if (report["Status"] == "OK").all() else 1  #Any naming problem or unhealthy pair fails the check
+
+    results_folder = os.path.join(args.results_folder, "")
+    options = gaze_options(args)
+    if args.command == "run":
+        if args.shard is not None:
+            results_folder = shard_folder(results_folder, *args.shard)
+        os.makedirs(results_folder, exist_ok = True)
+        GazeAOI(args.data_folder, args.timestamp_folder, results_folder, incremental = args.incremental or args.shard is not None, metrics = args.metrics, shard = args.shard, **options)
+    else:
+        folders = [shard_folder(results_folder, index, args.shards) for index in range(args.shards)]
+        missing = [folder for folder in folders if not os.path.exists(os.path.join(folder, "manifest", "manifest.json"))]
+        if len(missing) > 0:
+            parser.error("no results for " + ", ".join(missing) + ", their shards have to finish first")
+        merge_shards(args.data_folder, args.timestamp_folder, results_folder, folders, **options)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
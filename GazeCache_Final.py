@@ -0,0 +1,301 @@
+from EyeMotionsIntake_Final import missing_data, participant_id, read_eyemotions, read_timestamps, valid_times
+from GazeMetrics_Final import Metrics
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+class RecordingCache():
+    def __init__(self, cache_folder, max_bytes = 20*1024**3):
+        """
+        An on-disk cache of parsed input files (EyeMotions .csv and _Resps_Scenes.xlsx) so that reruns skip the text parsing entirely.
+
+        Every parsed file is stored as one .npy file per column in its own folder, named after the hash of the file contents.  Columns are loaded back memory-mapped, so only the parts that are actually used get read.
+        A file is looked up by its path, size and modification time first; only when those change is the content hashed, so a touched or copied file with the same contents still hits the cache.
+        When the cache grows past max_bytes, the least recently used entries are deleted.  The size of the cache is scanned once on creation and then kept as a running total of the entries written, so the folder is only scanned again when the total goes past max_bytes (entries written by other processes are counted from then on).
+
+        Parameters
+        ----------
+        cache_folder : Folder path for the cache, created if needed.  Can be shared between runs (and between worker processes).
+        max_bytes : Size cap of the cache in bytes.  The default is 20 GB.
+        """
+        self.cache_folder = os.path.join(cache_folder, "")
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  #Guards total, entries are written from several loader threads
+        self.total = 0  #Bytes in the cache, as of the last scan plus every entry written since
+        os.makedirs(self.cache_folder + "paths", exist_ok = True)
+        self.evict()  #In case max_bytes shrank since the last run
+
+    def __getstate__(self):
+        #Sent to worker processes without the lock, each process gets its own
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def load(self, path, reader):
+        """
+        Returns the parsed columns of path, parsing it with reader (and storing the result) only if it isn't cached yet.
+
+        Parameters
+        ----------
+        path : the file to load
+        reader : function that parses path into a dictionary of arrays, i.e. read_eyemotions or read_timestamps
+
+        Returns
+        -------
+        dict : the same dictionary reader(path) returns
+        """
+        stat_file = self.cache_folder + "paths/" + self.stat_key(path)
+        if os.path.exists(stat_file):
+            with open(stat_file) as file:
+                content = file.read()
+            out = self.read_entry(content)
+            if out is not None:
+                return out
+
+        content = self.content_hash(path)
+        out = self.read_entry(content)
+        if out is None:
+            out = reader(path)
+            self.write_entry(content, out)
+        self.write_atomic(stat_file, content)
+        return out
+
+    def stat_key(self, path):
+        #Cheap key: absolute path, size and modification time
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def content_hash(self, path):
+        digest = hashlib.blake2b(digest_size = 20)
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024*1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def read_entry(self, content):
+        folder = self.cache_folder + content + "/"
+        try:
+            with open(folder + "meta.json") as file:
+                meta = json.load(file)
+            out = {}
+            for i,column in enumerate(meta["columns"]):
+                if meta["pickled"][i]:  #Object columns (e.g. mixed text in a sheet) can't be memory-mapped
+                    out[column] = np.load(folder + f"{i}.npy", allow_pickle = True)
+                else:
+                    out[column] = np.load(folder + f"{i}.npy", mmap_mode = "r")
+            os.utime(folder)  #The folder's mtime doubles as the last used time for eviction
+        except (OSError, ValueError, KeyError):
+            return None
+        return out
+
+    def write_entry(self, content, columns):
+        #Written to a temporary folder and renamed into place, so a crash or a second process never leaves a half written entry behind
+        tmp = self.cache_folder + f".tmp-{content}-{os.getpid()}-{threading.get_ident()}/"
+        os.makedirs(tmp, exist_ok = True)
+        meta = {"columns": [], "pickled": []}
+        for i,column in enumerate(columns):
+            arr = np.asarray(columns[column])
+            np.save(tmp + f"{i}.npy", arr, allow_pickle = arr.dtype.hasobject)
+            meta["columns"].append(column)
+            meta["pickled"].append(bool(arr.dtype.hasobject))
+        with open(tmp + "meta.json", "w") as file:
+            json.dump(meta, file)
+        size = sum(entry.stat().st_size for entry in os.scandir(tmp))
+
+        try:
+            os.rename(tmp, self.cache_folder + content)
+        except OSError:  #Another process (or thread) stored the same file first
+            shutil.rmtree(tmp, ignore_errors = True)
+            return
+        with self.lock:
+            self.total += size
+            full = self.total > self.max_bytes
+        if full:
+            self.evict()
+
+    def write_atomic(self, path, text):
+        tmp = path + f".tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, "w") as file:
+            file.write(text)
+        os.replace(tmp, path)
+
+    def entries(self):
+        #Returns the (size, last used time, folder) of every entry
+        entries = []
+        for name in os.listdir(self.cache_folder):
+            folder = self.cache_folder + name
+            if name == "paths" or name.startswith(".tmp-") or not os.path.isdir(folder):
+                continue
+            try:
+                total = sum(entry.stat().st_size for entry in os.scandir(folder))
+                entries.append((total, os.stat(folder).st_mtime, folder))
+            except OSError:  #Evicted by another process in the meantime
+                continue
+        return entries
+
+    def evict(self):
+        #Deletes the least recently used entries until the cache fits in max_bytes, resetting the running total to what is left
+        with self.lock:
+            entries = sorted(self.entries(), key = lambda entry: entry[1])
+            total = sum(entry[0] for entry in entries)
+            evicted = 0
+            for size, last_used, folder in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(folder, ignore_errors = True)
+                total -= size
+                evicted += 1
+            self.total = total
+        if evicted == 0:
+            return
+
+        for entry in os.scandir(self.cache_folder + "paths"):  #Path records pointing at evicted entries
+            try:
+                with open(entry.path) as file:
+                    content = file.read()
+                if not os.path.isdir(self.cache_folder + content):
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+class WorkbookLoader():
+    def __init__(self, cache = None, workers = 2, depth = 2, metrics = False):
+        """
+        Loads the response workbooks (see read_timestamps()) in background threads, so that they are ready by the time their participant is handed to a worker.
+
+        As in PairLoader, at most depth workbooks are loaded ahead of the one being handed out, so the parsed sheets held in memory don't grow with the number of pairs.
+        With a RecordingCache, the parsed sheets are kept in it and reused until the .xlsx changes.
+
+        Parameters
+        ----------
+        cache : optional RecordingCache
+        workers : number of background threads.  The default is 2.
+        depth : number of workbooks loaded ahead.  The default is 2.
+        metrics : If True, the read_timestamps stage of every pair is recorded in its thread (time only, see GazeMetrics_Final.Metrics)
+        """
+        self.cache = cache
+        self.depth = depth
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.queue = deque()  #Futures of the sheets being loaded, in pair order
+
+    def read(self, row):
+        recorder = Metrics(enabled = self.metrics)
+        recorder.participant = participant_id(row[0])
+        with recorder.stage("read_timestamps", memory = False):
+            if self.cache is None:
+                sheets = read_timestamps(row[1])
+            else:
+                sheets = self.cache.load(row[1], read_timestamps)
+        return sheets, recorder.records
+
+    def load(self, pairs):
+        """
+        Yields the parsed workbook of every pair, in order, keeping up to depth workbooks loading ahead.
+
+        Parameters
+        ----------
+        pairs : array of data/timestamp paths, i.e. from check_files()
+
+        Yields
+        ------
+        sheets : the pair's workbook as returned by read_timestamps()
+        records : the metrics records of loading it, empty if metrics is False
+        """
+        rows = iter(pairs)
+        while True:
+            for row in rows:  #Tops the queue up to this workbook and the depth after it
+                self.queue.append(self.executor.submit(self.read, row))
+                if len(self.queue) > self.depth:
+                    break
+            if len(self.queue) == 0:
+                return
+            yield self.queue.popleft().result()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures = True)
+        self.queue.clear()
+
+class PairLoader():
+    def __init__(self, cache = None, workers = 2, depth = 2, metrics = False):
+        """
+        Loads and parses the next data/timestamp pairs (see check_files()) in background threads while the current one is processed, so reading from a slow (network) drive overlaps with the analysis.
+
+        At most depth pairs are loaded ahead of the one being processed, so no more than depth+1 parsed pairs are ever held in memory however many pairs there are.
+        With a RecordingCache, both files of a pair are loaded through it (see RecordingCache.load()).
+
+        Parameters
+        ----------
+        cache : optional RecordingCache
+        workers : number of background threads, each loading one pair at a time.  The default is 2.
+        depth : number of pairs loaded ahead.  The default is 2.
+        metrics : If True, the read_timestamps, precheck and read_eyemotions stages of every pair are recorded in its thread (time and samples only, see GazeMetrics_Final.Metrics)
+        """
+        self.cache = cache
+        self.depth = depth
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.queue = deque()  #Futures of the (gaze, sheets, records) being loaded, in pair order
+
+    def read(self, path, reader):
+        if self.cache is None:
+            return reader(path)
+        return self.cache.load(path, reader)
+
+    def read_pair(self, row):
+        #The workbook first, so a data file that is certain to be thrown out (see missing_data()) isn't parsed at all
+        recorder = Metrics(enabled = self.metrics)
+        recorder.participant = participant_id(row[0])
+        with recorder.stage("read_timestamps", memory = False):
+            sheets = self.read(row[1], read_timestamps)
+        records = list(recorder.records)
+        with recorder.stage("precheck", memory = False):
+            rejected = missing_data(row[0], valid_times(sheets["Times"]))
+        if rejected:  #The Intake checks it again when it throws the participant out, recording the precheck itself
+            return None, sheets, records
+        with recorder.stage("read_eyemotions", memory = False) as stage:
+            gaze = self.read(row[0], read_eyemotions)
+            stage.samples = gaze["Timestamp"].shape[0]
+        return gaze, sheets, recorder.records
+
+    def submit(self, row):
+        return self.executor.submit(self.read_pair, row)
+
+    def load(self, pairs):
+        """
+        Yields the parsed files of every pair, in order, keeping up to depth pairs loading ahead.
+
+        Parameters
+        ----------
+        pairs : array of data/timestamp paths, i.e. from check_files()
+
+        Yields
+        ------
+        gaze : the pair's data file as returned by read_eyemotions(), None if it was left unparsed because the participant will be thrown out for missing data
+        sheets : the pair's workbook as returned by read_timestamps()
+        records : the metrics records of loading the pair, empty if metrics is False
+        """
+        rows = iter(pairs)
+        while True:
+            for row in rows:  #Tops the queue up to this pair and the depth after it
+                self.queue.append(self.submit(row))
+                if len(self.queue) > self.depth:
+                    break
+            if len(self.queue) == 0:
+                return
+            yield self.queue.popleft().result()  #Waits only if the pair isn't loaded yet
+
+    def close(self):
+        self.executor.shutdown(cancel_futures = True)
+        self.queue.clear()
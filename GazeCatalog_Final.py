@@ -0,0 +1,155 @@
+import numpy as np
+import os
+import re
+import zlib
+
+DATA_NAME = re.compile(r"^(?:(?P<index>\d+)_)?(?P<participant>\d+)CE(?P<rest>.*)\.csv$", re.IGNORECASE)  #i.e. "001_109CE Letter 03-08-22 14h22m.csv", the index is optional
+TIMESTAMP_NAME = re.compile(r"^(?P<participant>\d+)CE(?P<code>[A-Z])_Resps_Scenes\.xlsx$", re.IGNORECASE)  #i.e. "4CEJ_Resps_Scenes.xlsx"
+CONDITION = re.compile(r"(?:^|[ _])(?P<condition>Arrow|Letter)(?=[ _.]|$)", re.IGNORECASE)
+DATE = re.compile(r"(?P<month>\d{2})-(?P<day>\d{2})-(?P<year>\d{2})(?: (?P<hours>\d+)h(?P<minutes>\d+)m)?")
+CONDITION_CODES = {"Arrow": "I", "Letter": "J"}  #Condition of the EyeMotions file -> letter code of its response file
+
+def parse_data_name(name):
+    """
+    Parses the name of an EyeMotions file (see README) into a record.
+
+    Parameters
+    ----------
+    name : file name, without the folder
+
+    Returns
+    -------
+    record : dictionary with the "file" name, the "index" (as written, None if the name has none), "participant" number (as written), "condition" ("Arrow" or "Letter"), its response file "code" ("I" or "J") and the "date" ("yy-mm-dd", or None) and "time" ("hh:mm", or None) of the recording.  None if name doesn't follow the naming scheme
+    """
+    match = DATA_NAME.match(name)
+    if match is None:
+        return None
+    condition = CONDITION.search(match["rest"])
+    if condition is None:
+        return None
+    condition = condition["condition"].capitalize()
+
+    date = DATE.search(match["rest"])
+    record = {"file": name, "index": match["index"], "participant": match["participant"], "condition": condition, "code": CONDITION_CODES[condition], "date": None, "time": None}
+    if date is not None:
+        record["date"] = f"{date['year']}-{date['month']}-{date['day']}"
+        if date["hours"] is not None:
+            record["time"] = f"{int(date['hours']):02d}:{int(date['minutes']):02d}"
+    return record
+
+def record_id(record):
+    #The participant ID of a parsed data file in the results, i.e. "001_109CELetter" (the index, when there is one, keeps recordings of the same participant and condition apart)
+    prefix = "" if record["index"] is None else record["index"] + "_"
+    return prefix + record["participant"] + "CE" + record["condition"]
+
+def parse_timestamp_name(name):
+    #Same as parse_data_name() for a response file, the record holds the "file" name, "participant" number and letter "code"
+    match = TIMESTAMP_NAME.match(name)
+    if match is None:
+        return None
+    return {"file": name, "participant": match["participant"], "code": match["code"].upper()}
+
+def participant_shard(participant, count):
+    #The shard (0 to count-1) a participant number belongs to.  A checksum rather than hash(), which changes between Python processes, so every node agrees on it
+    return zlib.crc32(str(int(participant)).encode()) % count
+
+def scan_folder(folder, parser):
+    """
+    Parses the name of every file in folder.  Nothing is cached between scans: only the names are parsed, and listing the folder is already what noticing a changed file would cost.
+
+    Parameters
+    ----------
+    folder : Folder path
+    parser : parse_data_name or parse_timestamp_name
+
+    Returns
+    -------
+    records : list of the parsed records, in os.listdir() order
+    unknown : list of the file names parser didn't recognise
+    """
+    records = []
+    unknown = []
+    for name in os.listdir(folder):
+        record = parser(name)
+        if record is None:
+            unknown.append(name)
+        else:
+            records.append(record)
+    return records, unknown
+
+class DatasetCatalog():
+    def __init__(self, data_folder, timestamp_folder):
+        """
+        Pairs every EyeMotions file in data_folder with its response file in timestamp_folder, via an index of the response files keyed by (participant number, letter code).
+
+        Every problem with the folders (unrecognised .csv/.xlsx names, data files without or with several response files) is collected in self.errors instead of stopping at the first one.  Data files that can't be paired are left out of self.pairs.
+
+        Parameters
+        ----------
+        data_folder : The folder containing the raw EyeMotions files
+        timestamp_folder : The folder containing the response files formated as per README
+        """
+        self.data_folder = data_folder
+        self.timestamp_folder = timestamp_folder
+        self.errors = []
+
+        data, unknown = scan_folder(data_folder, parse_data_name)
+        for name in unknown:
+            if name.lower().endswith(".csv"):
+                self.errors.append(f"{name} - Error w/ naming")
+        timestamps, unknown = scan_folder(timestamp_folder, parse_timestamp_name)
+        for name in unknown:
+            if name.lower().endswith(".xlsx"):
+                self.errors.append(f"{name} - Error w/ naming")
+
+        self.index = {}  #(participant number, letter code) -> response file records
+        for record in timestamps:
+            self.index.setdefault((int(record["participant"]), record["code"]), []).append(record)
+
+        IDs = {}  #Participant ID -> data files, two files with the same ID would overwrite each other's results
+        for record in data:
+            IDs.setdefault(record_id(record), []).append(record["file"])
+        
+        self.records = []  #Records of the paired data files, each with the "timestamp_file" it was paired with
+        for record in data:
+            if len(IDs[record_id(record)]) > 1:
+                self.errors.append(f"{record['file']} - Duplicate participant ID {record_id(record)} ({', '.join(IDs[record_id(record)])})")
+                continue
+            matches = self.index.get((int(record["participant"]), record["code"]), [])
+            if len(matches) == 0:
+                self.errors.append(f"{record['file']} - No Timestamp")
+                continue
+            if len(matches) > 1:
+                self.errors.append(f"{record['file']} - Multiple Timestamps ({', '.join(match['file'] for match in matches)})")
+                continue
+            self.records.append(dict(record, timestamp_file = matches[0]["file"]))
+
+        self.pairs = np.empty([len(self.records),2], dtype = object)
+        for i,record in enumerate(self.records):
+            self.pairs[i,0] = os.path.join(data_folder, record["file"])  #With or without a trailing slash on the folders
+            self.pairs[i,1] = os.path.join(timestamp_folder, record["timestamp_file"])
+
+    def report(self):
+        #Prints every error at once
+        if len(self.errors) > 0:
+            print(f"{len(self.errors)} problem(s) with the input files:")
+            for err in self.errors:
+                print(f"    - {err}")
+
+    def shard(self, index, count):
+        """
+        The pairs of one shard of the dataset, i.e. for splitting a study over several nodes.  Pairs are split by participant number (see participant_shard()), so both conditions of a participant end up in the same shard and every node gets the same split.
+
+        Parameters
+        ----------
+        index : the shard, 0 to count-1
+        count : the number of shards
+
+        Returns
+        -------
+        array : the rows of self.pairs in shard index, in the same order
+        """
+        if not 0 <= index < count:
+            raise ValueError(f"Shard {index} doesn't exist, expected 0 to {count-1}")
+        keep = [participant_shard(record["participant"], count) == index for record in self.records]
+        return self.pairs[np.array(keep, dtype = bool)]
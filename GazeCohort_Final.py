@@ -0,0 +1,117 @@
+from EyeMotionsIntake_Final import transition_probs
+from GazeExport_Final import letter_code, MATRIX_COLUMNS
+from GazeLayout_Final import participant_aois
+
+import pandas as pd
+import numpy as np
+
+COHORT_COLUMNS = ["Letter_Code", "Row", "Column", "Measure", "N", "Mean", "Variance", "Pooled_Count", "Pooled_Probability"]
+
+class CohortAggregator():
+    def __init__(self):
+        """
+        Folds the results of each participant, as soon as they are done, into group level summaries per condition (Arrow/Letter) per trial (row-column), without keeping any participant's results.
+
+        For every Ratios share and every Markov/Adj_Markov/Nei_Markov transition probability (the measures of the .csv, named after its columns, i.e. "%L" or "Adj_L_to_R"), each group keeps a running count, mean and sum of squared deviations (Welford's algorithm), so the mean and variance across participants are updated in one pass.
+        A participant's NaN values (i.e. the probabilities of an AOI they never left) are skipped, so N can differ between the measures of a group.  For the transitions, the count matrices are also summed over the group, giving the pooled (count weighted) probability of each transition.
+        Memory only grows with the number of groups and AOIs, never with the number of participants.
+
+        Participants that are neither Arrow nor Letter (see letter_code() in GazeExport_Final.py) are left out.
+        """
+        self.aois = None
+        self.groups = {}  #(Letter_Code, trial) -> row of the arrays below
+        self.n = None  #Non-NaN values per group per measure
+        self.mean = None
+        self.m2 = None  #Sum of squared deviations from the mean
+        self.pooled = None  #Summed transition counts per group, in the order of the transition measures
+
+    def setup(self, aois):
+        self.aois = aois
+        self.index = np.array([code+1 for key,code in aois.ratio_keys])  #Matrix rows/columns in export order
+        self.measures = [f"%{key}" for key,code in aois.ratio_keys] + [f"{prefix}{a}_to_{b}" for prefix in MATRIX_COLUMNS for a,_ in aois.ratio_keys for b,_ in aois.ratio_keys]
+        self.ratio_count = len(aois.ratio_keys)
+        self.n = np.zeros((0, len(self.measures)), dtype = np.int64)
+        self.mean = np.zeros((0, len(self.measures)))
+        self.m2 = np.zeros((0, len(self.measures)))
+        self.pooled = np.zeros((0, len(self.measures) - self.ratio_count), dtype = np.int64)
+
+    def rows(self, code, trials):
+        #Row of each trial's group, adding the groups that are new
+        new = [trial for trial in trials if (code, trial) not in self.groups]
+        for trial in new:
+            self.groups[(code, trial)] = len(self.groups)
+        if len(new) > 0:
+            self.n = np.vstack([self.n, np.zeros((len(new), self.n.shape[1]), dtype = np.int64)])
+            self.mean = np.vstack([self.mean, np.zeros((len(new), self.mean.shape[1]))])
+            self.m2 = np.vstack([self.m2, np.zeros((len(new), self.m2.shape[1]))])
+            self.pooled = np.vstack([self.pooled, np.zeros((len(new), self.pooled.shape[1]), dtype = np.int64)])
+        return np.array([self.groups[(code, trial)] for trial in trials], dtype = np.int64)
+
+    def add(self, data):
+        """
+        Folds in the results of one or more participants.
+
+        Parameters
+        ----------
+        data : A dictionary of participant -> results (as per EyeMotionsIntake_Final.py, i.e. Intake.return_dict()), with the Markov chains still as count matrices
+        """
+        for participant in data:
+            code = letter_code(participant)
+            if code is None:
+                continue
+            aois = participant_aois(data[participant])
+            if self.aois is None:
+                self.setup(aois)
+            elif aois.names != self.aois.names or aois.keys != self.aois.keys:
+                raise ValueError("Participants were processed with different AOIs, their results can't be aggregated together")
+
+            size = self.aois.size
+            trials = list(data[participant]["TrialError"].keys())
+            if len(trials) == 0:
+                continue
+            ratios = [data[participant]["Ratios"][trial] for trial in trials]
+            values = [np.array([[ratio[key][0] for key,_ in self.aois.ratio_keys] for ratio in ratios], dtype = float)]
+            counts = []
+            for category in MATRIX_COLUMNS.values():
+                matrices = np.array([data[participant][category][trial] for trial in trials]).reshape(-1,size,size)[:,self.index][:,:,self.index]
+                values.append(transition_probs(matrices).reshape(len(trials), -1))
+                counts.append(matrices.reshape(len(trials), -1))
+            values = np.hstack(values)
+
+            rows = self.rows(code, trials)  #Every trial is a different group, so each row is updated once
+            valid = ~np.isnan(values)
+            self.n[rows] += valid
+            delta = np.where(valid, values - self.mean[rows], 0)
+            mean = self.mean[rows] + np.where(valid, delta/np.maximum(self.n[rows], 1), 0)
+            self.m2[rows] += np.where(valid, delta*(values - mean), 0)
+            self.mean[rows] = mean
+            self.pooled[rows] += np.hstack(counts).astype(np.int64)
+
+    def summary(self):
+        """
+        Returns
+        -------
+        result : DataFrame with one row per group per measure and the columns Letter_Code, Row, Column, Measure, N, Mean, Variance (the sample variance, NaN below 2 values), Pooled_Count and Pooled_Probability (both NaN for the Ratios shares)
+        """
+        if self.aois is None:
+            return pd.DataFrame(columns = COHORT_COLUMNS)
+        groups = list(self.groups.keys())
+        measures = len(self.measures)
+        size = len(self.index)
+        pooled = self.pooled.reshape(len(groups), len(MATRIX_COLUMNS), size, size)
+        probs = transition_probs(pooled.astype(float)).reshape(len(groups), -1)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            variance = np.where(self.n > 1, self.m2/(self.n - 1), np.nan)
+        blank = np.full((len(groups), self.ratio_count), np.nan)
+
+        result = pd.DataFrame(data = {"Letter_Code": np.repeat([group[0] for group in groups], measures).astype(object),
+                                      "Row": np.repeat([group[1].split("-")[0] for group in groups], measures).astype(object),
+                                      "Column": np.repeat([group[1].split("-")[1] for group in groups], measures).astype(object),
+                                      "Measure": np.tile(self.measures, len(groups)).astype(object),
+                                      "N": self.n.reshape(-1),
+                                      "Mean": np.where(self.n > 0, self.mean, np.nan).reshape(-1),
+                                      "Variance": variance.reshape(-1),
+                                      "Pooled_Count": np.hstack([blank, self.pooled]).reshape(-1),
+                                      "Pooled_Probability": np.hstack([blank, probs]).reshape(-1)})
+        result["Pooled_Count"] = result["Pooled_Count"].astype("Int64")  #Whole counts, blank for the Ratios shares
+        return result
@@ -1,219 +1,251 @@
+from EyeMotionsIntake_Final import export_view, numeric_results, transition_probs
+from GazeLayout_Final import DEFAULT_AOIS, participant_aois
+
 import pandas as pd
 import numpy as np
+import json
+import os
+
+LOOK_COLUMNS = {"First_Look": "FirstLook", "First_Valid_Look": "FirstValid", "Last_Look": "LastLook", "Last_Valid_Look": "LastValid"}  #Column -> category of each look
+MATRIX_COLUMNS = {"": "Markov", "Adj_": "Adj_Markov", "Nei_": "Nei_Markov"}  #Column prefix -> Markov category
+
+def table_columns(aois = DEFAULT_AOIS):
+    #Columns of the table for a GazeLayout_Final.AOISet: a % and _Time column per AOI (named by its Ratios key) and a column per pair of AOIs per Markov category
+    keys = [key for key,code in aois.ratio_keys]
+    return (["Participant", "Letter_Code", "Row", "Column"]
+            + [column for name in LOOK_COLUMNS for column in (name, name + "_Time")]
+            + ["Total_Time"] + [column for name in keys for column in (f"%{name}", f"{name}_Time")]
+            + [f"{prefix}{a}_to_{b}" for prefix in MATRIX_COLUMNS for a in keys for b in keys]
+            + ["Participant_NaN_Ratio", "Trial_NaN_Ratio"])
+
+#COLUMNS
+TABLE_COLUMNS = table_columns()  #For the default Left/Right AOIs
 
-def gazeExport(data, CSV_out):
+def gazeExport(data, CSV_out, columnar_format = None, long_format = False):
     """
     Converts all of the relevant JSON data to a CSV format for subsequent analysis via transcribing the data to a simplified dictionary -> dataframe
 
     Parameters
     ----------
-    data : A dictionary containing all of the outlined data (as per EyeMotionsIntake_Final.py)
+    data : A dictionary containing all of the outlined data (as per EyeMotionsIntake_Final.py), i.e. as returned by GazeAOI(), loaded from its JSON_out or returned by GazeStore_Final.ResultsStore.results() (see numeric_results() in EyeMotionsIntake_Final.py)
     CSV_out : The name of the file where the data should be written to
+    columnar_format : "parquet" or "feather" to also write the table as a typed, compressed binary file next to CSV_out (e.g. "2022-03-08.parquet", requires pyarrow).  The default of None only writes the CSV.
+    long_format : If True, the Markov chains are also written in long form (see gazeLong()) to e.g. "2022-03-08_long.csv", plus its columnar_format copy
     """
-    participants = list(data.keys())
-    #COLUMNS
-    out_template = {
-        "Participant": [],
-        "Letter_Code": [],
-        
-        "Row": [],
-        "Column": [],
-        
-        "First_Look": [],
-        "First_Look_Time": [],
-        "First_Valid_Look": [],
-        "First_Valid_Look_Time": [],
-        "Last_Look":[],
-        "Last_Look_Time": [],
-        "Last_Valid_Look": [],
-        "Last_Valid_Look_Time":[],
-        
-        "Total_Time": [],
-        "%L": [],
-        "L_Time": [],
-        "%R": [],
-        "R_Time": [],
-        "%NaN": [],
-        "NaN_Time": [],
-        "%Neither": [],
-        "Neither_Time": [],
-        
-        "L_to_L": [],
-        "L_to_R": [],
-        "L_to_NaN": [],
-        "L_to_Neither": [],
-        
-        "R_to_L": [],
-        "R_to_R": [],
-        "R_to_NaN": [],
-        "R_to_Neither": [],
-        
-        "NaN_to_L": [],
-        "NaN_to_R": [],
-        "NaN_to_NaN": [],
-        "NaN_to_Neither": [],
-        
-        "Neither_to_L": [],
-        "Neither_to_R": [],
-        "Neither_to_NaN": [],
-        "Neither_to_Neither": [],
-        
-        ####
-        
-        "Adj_L_to_L": [],
-        "Adj_L_to_R": [],
-        "Adj_L_to_NaN": [],
-        "Adj_L_to_Neither": [],
-        
-        "Adj_R_to_L": [],
-        "Adj_R_to_R": [],
-        "Adj_R_to_NaN": [],
-        "Adj_R_to_Neither": [],
-        
-        "Adj_NaN_to_L": [],
-        "Adj_NaN_to_R": [],
-        "Adj_NaN_to_NaN": [],
-        "Adj_NaN_to_Neither": [],
-        
-        "Adj_Neither_to_L": [],
-        "Adj_Neither_to_R": [],
-        "Adj_Neither_to_NaN": [],
-        "Adj_Neither_to_Neither": [],
-        
-        ####
-        
-        "Nei_L_to_L": [],
-        "Nei_L_to_R": [],
-        "Nei_L_to_NaN": [],
-        "Nei_L_to_Neither": [],
-        
-        "Nei_R_to_L": [],
-        "Nei_R_to_R": [],
-        "Nei_R_to_NaN": [],
-        "Nei_R_to_Neither": [],
-        
-        "Nei_NaN_to_L": [],
-        "Nei_NaN_to_R": [],
-        "Nei_NaN_to_NaN": [],
-        "Nei_NaN_to_Neither": [],
-        
-        "Nei_Neither_to_L": [],
-        "Nei_Neither_to_R": [],
-        "Nei_Neither_to_NaN": [],
-        "Nei_Neither_to_Neither": [],
-        
-        "Participant_NaN_Ratio": [],
-        "Trial_NaN_Ratio": []
-        }
+    result = gazeTable(data)
+    if result is None:
+        return 0
+    writeTable(result, CSV_out, columnar_format)
+    if long_format:
+        writeTable(gazeLong(data), long_name(CSV_out), columnar_format)
+
+def long_name(file_name):
+    #i.e. "2022-03-08.csv" -> "2022-03-08_long.csv"
+    stem, ext = os.path.splitext(file_name)
+    return f"{stem}_long{ext}"
+
+def writeTable(table, CSV_out, columnar_format = None):
+    #Writes table to CSV_out and, if asked for, to a Parquet/Feather file with the same name
+    table.to_csv(CSV_out, index = False)
+    if columnar_format == "parquet":
+        table.to_parquet(os.path.splitext(CSV_out)[0] + ".parquet", index = False)
+    elif columnar_format == "feather":
+        table.to_feather(os.path.splitext(CSV_out)[0] + ".feather")
+    elif columnar_format is not None:
+        raise ValueError(f"Unknown columnar_format {columnar_format}, expected 'parquet' or 'feather'")
+
+def joinTables(tables):
+    """
+    Concatenates the tables of several participants (as built by gazeTable() or gazeLong() one participant at a time) into the table those functions would build for all of them at once.
+
+    Parameters
+    ----------
+    tables : list of DataFrames, in participant order
+
+    Returns
+    -------
+    result : the concatenated DataFrame, or None if any of the tables is None (i.e. a participant isn't named as either Arrow or Letter)
+    """
+    tables = list(tables)
+    if any(table is None for table in tables):
+        return None
+    if len(tables) == 0:
+        return gazeTable({})
+    result = pd.concat(tables, ignore_index = True)
+    for name in tables[0].columns:  #Categories that differ between participants are concatenated as plain objects
+        if isinstance(tables[0][name].dtype, pd.CategoricalDtype):
+            result[name] = result[name].astype("category")
+    return result
+
+def letter_code(participant):
+    #"A" for Arrow participants, "L" for Letter participants, None otherwise
+    if "Arrow" in participant:
+        return "A"
+    elif "Letter" in participant:
+        return "L"
+    return None
+
+def stack(parts):
+    #Concatenates the per participant column arrays, an empty column if there are none
+    if len(parts) == 0:
+        return np.array([])
+    return np.concatenate(parts)
+
+def study_aois(data):
+    #The AOIs shared by every participant in data (the default Left/Right ones if data is empty), the table can't mix layouts
+    aois = [participant_aois(data[participant]) for participant in data]
+    if len(aois) == 0:
+        return DEFAULT_AOIS
+    if any(other.names != aois[0].names or other.keys != aois[0].keys for other in aois):
+        raise ValueError("Participants were processed with different AOIs, their results can't share a table")
+    return aois[0]
+
+def gazeTable(data):
+    """
+    Builds the table gazeExport writes, one row per participant per trial.  Every column is built as one array per participant straight from the numeric results (e.g. all of a participant's Markov matrices are normalised at once), rather than appended to trial by trial.
+
+    Parameters
+    ----------
+    data : A dictionary containing all of the outlined data (as per EyeMotionsIntake_Final.py), in numeric or .json form (see gazeExport())
+
+    Returns
+    -------
+    result : the table as a DataFrame, or None if a participant isn't named as either Arrow or Letter
+    """
+    data = numeric_results(data)
+    aois = study_aois(data)
+    size = aois.size
+    columns = {name: [] for name in table_columns(aois)}  #Column name -> list of one array per participant
+    def add(name, values):
+        columns[name].append(values)
     
-    for i,participant in enumerate(participants):
-        trials = data[participant]["TrialError"].keys()
-        for trial in trials:
-            out_template["Participant"].append(participant.split("CE")[0])
-            
-            if "Arrow" in participant:
-                out_template["Letter_Code"].append("A")
-            elif "Letter" in participant:
-                out_template["Letter_Code"].append("L")
-            else:
-                return 0
-        
-            out_template["Row"].append(trial.split("-")[0])
-            out_template["Column"].append(trial.split("-")[1])
-            
-            out_template["First_Look"].append(data[participant]["FirstLook"][trial].split(": ")[0])
-            out_template["First_Look_Time"].append(data[participant]["FirstLook"][trial].split(": ")[1][:-2])
-            out_template["Last_Look"].append(data[participant]["LastLook"][trial].split(": ")[0])
-            out_template["Last_Look_Time"].append(data[participant]["LastLook"][trial].split(": ")[1][:-2])
-            
-            if data[participant]["FirstValid"][trial] != "err":
-                out_template["First_Valid_Look"].append(data[participant]["FirstValid"][trial].split(": ")[0])
-                out_template["First_Valid_Look_Time"].append(data[participant]["FirstValid"][trial].split(": ")[1][:-2])
-            else:
-                out_template["First_Valid_Look"].append(np.nan)
-                out_template["First_Valid_Look_Time"].append(np.nan)
-            if data[participant]["LastValid"][trial] != "err":
-                out_template["Last_Valid_Look"].append(data[participant]["LastValid"][trial].split(": ")[0])
-                out_template["Last_Valid_Look_Time"].append(data[participant]["LastValid"][trial].split(": ")[1][:-2])
-            else:
-                out_template["Last_Valid_Look"].append(np.nan)
-                out_template["Last_Valid_Look_Time"].append(np.nan)
-                
-            out_template["Total_Time"].append(data[participant]["Ratios"][trial]["Total"])
-            out_template["%L"].append(data[participant]["Ratios"][trial]["L"][0])
-            out_template["L_Time"].append(data[participant]["Ratios"][trial]["L"][1])
-            out_template["%R"].append(data[participant]["Ratios"][trial]["R"][0])
-            out_template["R_Time"].append(data[participant]["Ratios"][trial]["R"][1])
-            out_template["%NaN"].append(data[participant]["Ratios"][trial]["NaN"][0])
-            out_template["NaN_Time"].append(data[participant]["Ratios"][trial]["NaN"][1])
-            out_template["%Neither"].append(data[participant]["Ratios"][trial]["Neither"][0])
-            out_template["Neither_Time"].append(data[participant]["Ratios"][trial]["Neither"][1])
-            
-            out_template["L_to_L"].append(data[participant]["Markov"][trial]["Left"]["Left"][0])
-            out_template["L_to_R"].append(data[participant]["Markov"][trial]["Left"]["Right"][0])
-            out_template["L_to_NaN"].append(data[participant]["Markov"][trial]["Left"]["NaN"][0])
-            out_template["L_to_Neither"].append(data[participant]["Markov"][trial]["Left"]["Neither"][0])
-            
-            out_template["R_to_L"].append(data[participant]["Markov"][trial]["Right"]["Left"][0])
-            out_template["R_to_R"].append(data[participant]["Markov"][trial]["Right"]["Right"][0])
-            out_template["R_to_NaN"].append(data[participant]["Markov"][trial]["Right"]["NaN"][0])
-            out_template["R_to_Neither"].append(data[participant]["Markov"][trial]["Right"]["Neither"][0])
-            
-            out_template["NaN_to_L"].append(data[participant]["Markov"][trial]["NaN"]["Left"][0])
-            out_template["NaN_to_R"].append(data[participant]["Markov"][trial]["NaN"]["Right"][0])
-            out_template["NaN_to_NaN"].append(data[participant]["Markov"][trial]["NaN"]["NaN"][0])
-            out_template["NaN_to_Neither"].append(data[participant]["Markov"][trial]["NaN"]["Neither"][0])
-            
-            out_template["Neither_to_L"].append(data[participant]["Markov"][trial]["Neither"]["Left"][0])
-            out_template["Neither_to_R"].append(data[participant]["Markov"][trial]["Neither"]["Right"][0])
-            out_template["Neither_to_NaN"].append(data[participant]["Markov"][trial]["Neither"]["NaN"][0])
-            out_template["Neither_to_Neither"].append(data[participant]["Markov"][trial]["Neither"]["Neither"][0])
-            
-            
-            out_template["Adj_L_to_L"].append(data[participant]["Adj_Markov"][trial]["Left"]["Left"][0])
-            out_template["Adj_L_to_R"].append(data[participant]["Adj_Markov"][trial]["Left"]["Right"][0])
-            out_template["Adj_L_to_NaN"].append(data[participant]["Adj_Markov"][trial]["Left"]["NaN"][0])
-            out_template["Adj_L_to_Neither"].append(data[participant]["Adj_Markov"][trial]["Left"]["Neither"][0])
-            
-            out_template["Adj_R_to_L"].append(data[participant]["Adj_Markov"][trial]["Right"]["Left"][0])
-            out_template["Adj_R_to_R"].append(data[participant]["Adj_Markov"][trial]["Right"]["Right"][0])
-            out_template["Adj_R_to_NaN"].append(data[participant]["Adj_Markov"][trial]["Right"]["NaN"][0])
-            out_template["Adj_R_to_Neither"].append(data[participant]["Adj_Markov"][trial]["Right"]["Neither"][0])
-            
-            out_template["Adj_NaN_to_L"].append(data[participant]["Adj_Markov"][trial]["NaN"]["Left"][0])
-            out_template["Adj_NaN_to_R"].append(data[participant]["Adj_Markov"][trial]["NaN"]["Right"][0])
-            out_template["Adj_NaN_to_NaN"].append(data[participant]["Adj_Markov"][trial]["NaN"]["NaN"][0])
-            out_template["Adj_NaN_to_Neither"].append(data[participant]["Adj_Markov"][trial]["NaN"]["Neither"][0])
-            
-            out_template["Adj_Neither_to_L"].append(data[participant]["Adj_Markov"][trial]["Neither"]["Left"][0])
-            out_template["Adj_Neither_to_R"].append(data[participant]["Adj_Markov"][trial]["Neither"]["Right"][0])
-            out_template["Adj_Neither_to_NaN"].append(data[participant]["Adj_Markov"][trial]["Neither"]["NaN"][0])
-            out_template["Adj_Neither_to_Neither"].append(data[participant]["Adj_Markov"][trial]["Neither"]["Neither"][0])
-            
-            
-            out_template["Nei_L_to_L"].append(data[participant]["Nei_Markov"][trial]["Left"]["Left"][0])
-            out_template["Nei_L_to_R"].append(data[participant]["Nei_Markov"][trial]["Left"]["Right"][0])
-            out_template["Nei_L_to_NaN"].append(data[participant]["Nei_Markov"][trial]["Left"]["NaN"][0])
-            out_template["Nei_L_to_Neither"].append(data[participant]["Nei_Markov"][trial]["Left"]["Neither"][0])
-            
-            out_template["Nei_R_to_L"].append(data[participant]["Nei_Markov"][trial]["Right"]["Left"][0])
-            out_template["Nei_R_to_R"].append(data[participant]["Nei_Markov"][trial]["Right"]["Right"][0])
-            out_template["Nei_R_to_NaN"].append(data[participant]["Nei_Markov"][trial]["Right"]["NaN"][0])
-            out_template["Nei_R_to_Neither"].append(data[participant]["Nei_Markov"][trial]["Right"]["Neither"][0])
-            
-            out_template["Nei_NaN_to_L"].append(data[participant]["Nei_Markov"][trial]["NaN"]["Left"][0])
-            out_template["Nei_NaN_to_R"].append(data[participant]["Nei_Markov"][trial]["NaN"]["Right"][0])
-            out_template["Nei_NaN_to_NaN"].append(data[participant]["Nei_Markov"][trial]["NaN"]["NaN"][0])
-            out_template["Nei_NaN_to_Neither"].append(data[participant]["Nei_Markov"][trial]["NaN"]["Neither"][0])
-            
-            out_template["Nei_Neither_to_L"].append(data[participant]["Nei_Markov"][trial]["Neither"]["Left"][0])
-            out_template["Nei_Neither_to_R"].append(data[participant]["Nei_Markov"][trial]["Neither"]["Right"][0])
-            out_template["Nei_Neither_to_NaN"].append(data[participant]["Nei_Markov"][trial]["Neither"]["NaN"][0])
-            out_template["Nei_Neither_to_Neither"].append(data[participant]["Nei_Markov"][trial]["Neither"]["Neither"][0])
-            
-            out_template["Participant_NaN_Ratio"].append(data[participant]["ParticipantError"])
-            out_template["Trial_NaN_Ratio"].append(data[participant]["TrialError"][trial])
+    for participant in data:
+        code = letter_code(participant)
+        if code is None:
+            return None
+        trials = list(data[participant]["TrialError"].keys())
+        n = len(trials)
+        
+        add("Participant", np.repeat(participant.split("CE")[0], n).astype(object))
+        add("Letter_Code", np.repeat(code, n).astype(object))
+        add("Row", np.array([trial.split("-")[0] for trial in trials], dtype = object))
+        add("Column", np.array([trial.split("-")[1] for trial in trials], dtype = object))
+        
+        for name,category in LOOK_COLUMNS.items():
+            looks = [data[participant][category][trial] for trial in trials]  #Looks are (AOI code, time) pairs (None if there wasn't one), see Intake.looks()
+            add(name, np.array([np.nan if look is None else aois.labels[look[0]] for look in looks], dtype = object))
+            add(name + "_Time", np.array([np.nan if look is None else look[1] for look in looks], dtype = float))
+        
+        ratios = [data[participant]["Ratios"][trial] for trial in trials]
+        add("Total_Time", np.array([ratio["Total"] for ratio in ratios]))
+        for key,aoi in aois.ratio_keys:
+            add(f"%{key}", np.array([ratio[key][0] for ratio in ratios]))
+            add(f"{key}_Time", np.array([ratio[key][1] for ratio in ratios]))  #Not forced to float, an AOI nobody ever looked at stays an integer 0 column
+        
+        for prefix,category in MATRIX_COLUMNS.items():
+            probs = transition_probs(np.array([data[participant][category][trial] for trial in trials]).reshape(-1,size,size))  #Rows/columns are code+1, i.e. NaN, Neither, Left, Right
+            for a,code_a in aois.ratio_keys:
+                for b,code_b in aois.ratio_keys:
+                    add(f"{prefix}{a}_to_{b}", probs[:,code_a+1,code_b+1])
+        
+        add("Participant_NaN_Ratio", np.repeat(data[participant]["ParticipantError"], n))
+        add("Trial_NaN_Ratio", np.array([data[participant]["TrialError"][trial] for trial in trials]))
+    
+    result = pd.DataFrame(data = {name: stack(parts) for name,parts in columns.items()})
+    return result
+
+def gazeLong(data):
+    """
+    Builds the Markov chains of every trial in long (tidy) form, i.e. one row per participant per trial per matrix per transition, so they can be filtered/grouped without reshaping the wide table.
+
+    Parameters
+    ----------
+    data : A dictionary containing all of the outlined data (as per EyeMotionsIntake_Final.py), in numeric or .json form (see gazeExport())
+
+    Returns
+    -------
+    result : DataFrame with the columns Participant, Letter_Code, Row, Column, Matrix (Markov, Adj_Markov or Nei_Markov), From, To, Probability and Count, or None if a participant isn't named as either Arrow or Letter
+    """
+    data = numeric_results(data)
+    aois = study_aois(data)
+    size = aois.size
+    order = np.array(aois.order) + 1  #Matrix rows/columns in export order
+    labels = [aois.labels[code] for code in aois.order]
+    columns = {"Participant": [], "Letter_Code": [], "Row": [], "Column": [], "Matrix": [], "From": [], "To": [], "Probability": [], "Count": []}
     
-    result = pd.DataFrame(data = out_template)
-    result.to_csv(CSV_out, index = False)
+    for participant in data:
+        code = letter_code(participant)
+        if code is None:
+            return None
+        trials = list(data[participant]["TrialError"].keys())
+        rows = np.array([trial.split("-")[0] for trial in trials], dtype = object)
+        cols = np.array([trial.split("-")[1] for trial in trials], dtype = object)
+        
+        for category in MATRIX_COLUMNS.values():
+            counts = np.array([data[participant][category][trial] for trial in trials]).reshape(-1,size,size)[:,order][:,:,order]
+            n = counts.size
+            columns["Participant"].append(np.repeat(participant.split("CE")[0], n).astype(object))
+            columns["Letter_Code"].append(np.repeat(code, n).astype(object))
+            columns["Row"].append(np.repeat(rows, size*size))
+            columns["Column"].append(np.repeat(cols, size*size))
+            columns["Matrix"].append(np.repeat(category, n).astype(object))
+            columns["From"].append(np.tile(np.repeat(labels, size), len(trials)).astype(object))
+            columns["To"].append(np.tile(labels, size*len(trials)).astype(object))
+            columns["Probability"].append(transition_probs(counts).reshape(-1))
+            columns["Count"].append(counts.reshape(-1).astype(np.int64))
+    
+    result = pd.DataFrame(data = {name: stack(parts) for name,parts in columns.items()})
+    for name in ["Letter_Code", "Matrix", "From", "To"]:  #Few distinct values, stored as categories (dictionary encoded in Parquet/Feather)
+        result[name] = result[name].astype("category")
+    return result
+
+class ResultsWriter():
+    def __init__(self, JSON_out, json_format = "json", timeline_strings = True):
+        """
+        Writes the results of each participant to JSON_out as soon as they are done, so that only one participant at a time has to be held in memory.
+
+        The results are first written to f"{JSON_out}.partial" and flushed to disk after every participant, so a crash keeps everything written up to then.  close() then moves the finished file into place, i.e. JSON_out is never left half written.
+
+        Parameters
+        ----------
+        JSON_out : output path
+        json_format : "json" (the default) writes a single JSON object exactly like json.dump(..., indent = 4) of all participants would.  "ndjson" writes one line per participant instead, each a {participant: results} object, which can be read back one participant at a time.
+        timeline_strings : passed on to export_view()
+        """
+        if json_format not in ["json", "ndjson"]:
+            raise ValueError(f"Unknown json_format {json_format}, expected 'json' or 'ndjson'")
+        self.JSON_out = JSON_out
+        self.json_format = json_format
+        self.timeline_strings = timeline_strings
+        self.count = 0
+        self.file = open(JSON_out + ".partial", "w")
+    
+    def write(self, dictionary):
+        """
+        Appends the results of one or more participants.
+
+        Parameters
+        ----------
+        dictionary : {participant: results} as returned by Intake.return_dict(), i.e. not yet passed through export_view()
+
+        Returns
+        -------
+        view : the export_view() of dictionary that was written
+        """
+        view = export_view(dictionary, timeline_strings = self.timeline_strings)
+        for participant in view:
+            if self.json_format == "ndjson":
+                text = json.dumps({participant: view[participant]}) + "\n"
+            else:  #The participant's entry as it appears within the indented object, i.e. without the outer braces
+                text = ("{\n" if self.count == 0 else ",\n") + json.dumps({participant: view[participant]}, indent = 4)[2:-2]
+            self.file.write(text)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.count += 1
+        return view
     
+    def close(self):
+        if self.json_format == "json":
+            self.file.write("\n}" if self.count > 0 else "{}")
+        self.file.close()
+        os.replace(self.JSON_out + ".partial", self.JSON_out)
@@ -0,0 +1,77 @@
+from EyeMotionsIntake_Final import last_timestamp, read_timestamps, valid_times
+from GazeCatalog_Final import DatasetCatalog
+
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import math
+import os
+
+HEALTH_COLUMNS = ["Data_File", "Timestamp_File", "Trials", "Last_Timestamp", "Last_Trial_End", "Margin", "Status"]
+
+def pair_health(data_file, timestamp_file, cache = None):
+    """
+    Checks one data/timestamp pair without parsing the data file, i.e. whether the recording covers every trial (see missing_data() in EyeMotionsIntake_Final.py).
+
+    Returns
+    -------
+    row : list of the HEALTH_COLUMNS values.  Status is "OK", "Missing Data" (Intake would throw the participant out), "Unknown" (only a full parse can tell, i.e. the last line can't be read on its own) or "Unreadable: ..." with the error when a file exists but can't be parsed
+
+    Raises
+    ------
+    FileNotFoundError : data_file or timestamp_file doesn't exist (i.e. a wrong folder), which is not a problem of the recording
+    """
+    for path in [data_file, timestamp_file]:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} doesn't exist")
+    row = [os.path.basename(data_file), os.path.basename(timestamp_file), 0, math.nan, math.nan, math.nan, "OK"]
+    try:
+        sheets = read_timestamps(timestamp_file) if cache is None else cache.load(timestamp_file, read_timestamps)
+        times_sheet = valid_times(sheets["Times"])
+        row[2] = len(times_sheet)
+        end = times_sheet[-1,2]*1000
+        last = last_timestamp(data_file)
+    except (OSError, ValueError, KeyError, IndexError) as err:
+        row[6] = f"Unreadable: {err}"
+        return row
+
+    row[4] = float(end)
+    if last is not None:
+        row[3] = last
+        row[5] = last - end
+    if end*0 != 0 or (last is not None and (math.isnan(last) or last < end - 1e-6)):  #Same as missing_data()
+        row[6] = "Missing Data"
+    elif last is None or not last > end:
+        row[6] = "Unknown"
+    return row
+
+def health_report(data_folder, timestamp_folder, report_out = None, cache = None, workers = 4):
+    """
+    A quick health report of a whole dataset: the naming problems of the folders (see DatasetCatalog in GazeCatalog_Final.py) and, for every data/timestamp pair, whether the recording runs until the end of the last trial.
+    Only the response workbooks are parsed, the data files are checked from their header and last lines (see last_timestamp() in EyeMotionsIntake_Final.py), so this takes a fraction of the time of a run.
+
+    Parameters
+    ----------
+    data_folder : Folder path containing EyeMotions data.
+    timestamp_folder : Folder path containing the response files.
+    report_out : optional .csv path the report is written to
+    cache : optional GazeCache_Final.RecordingCache the workbooks are loaded through
+    workers : number of threads reading the pairs.  The default is 4.
+
+    Returns
+    -------
+    report : DataFrame with one row per pair (Data_File, Timestamp_File, the number of Trials, the Last_Timestamp of the recording, the Last_Trial_End and their Margin, all in ms, and the Status, see pair_health()), followed by a row per naming problem with the problem as its Status
+    """
+    if not os.path.isdir(data_folder) or not os.path.isdir(timestamp_folder):
+        raise FileNotFoundError(f"{data_folder if not os.path.isdir(data_folder) else timestamp_folder} is not a folder")
+    catalog = DatasetCatalog(data_folder, timestamp_folder)
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        rows = list(executor.map(pair_health, catalog.pairs[:,0], catalog.pairs[:,1], [cache]*len(catalog.pairs)))
+    rows += [[None, None, 0, math.nan, math.nan, math.nan, err] for err in catalog.errors]
+    report = pd.DataFrame(rows, columns = HEALTH_COLUMNS)
+    report["Trials"] = report["Trials"].astype(int)
+
+    statuses = report["Status"][:len(catalog.pairs)].str.split(":").str[0].value_counts()
+    print(f"{len(catalog.pairs)} pairs: " + ", ".join(f"{count} {status}" for status,count in statuses.items()) + f", {len(catalog.errors)} naming problem(s)")
+    if report_out is not None:
+        report.to_csv(report_out, index = False)
+    return report
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import bisect
+import hashlib
+import math
+
+LAYOUT_COLUMNS = ["Trial", "AOI", "X0", "Y0", "X1", "Y1"]  #Columns of a layout file, see load_layouts()
+
+class AOISet():
+    def __init__(self, names, keys = None):
+        """
+        The AOIs of a study and the codes they are stored as: the AOI names[k] is code k+1, while 0 is Neither and -1 is NaN.  Matrices are (N+2)x(N+2) with row/column code+1 holding code, as for the original Left/Right AOIs.
+
+        Parameters
+        ----------
+        names : list of the AOI names, in code order
+        keys : optional list of the shorter names used as Ratios keys and in the .csv column names (i.e. "L" for "Left"), the default is the names themselves
+        """
+        self.names = list(names)
+        self.keys = list(names) if keys is None else list(keys)
+        self.size = len(self.names) + 2
+        self.labels = {code+1: name for code,name in enumerate(self.names)}  #AOI code -> name, as in the exported data
+        self.labels[0] = "Neither"
+        self.labels[-1] = "NaN"
+        self.order = list(range(1, len(self.names)+1)) + [-1, 0]  #Order of the AOIs in the exports
+        self.ratio_keys = [(key, code+1) for code,key in enumerate(self.keys)] + [("NaN", -1), ("Neither", 0)]  #(Ratios key, code), in export order
+        self.dtype = np.int8 if len(self.names) < 127 else np.int16  #Smallest type holding every code
+
+DEFAULT_AOIS = AOISet(["Left", "Right"], keys = ["L", "R"])
+
+def participant_aois(results):
+    #The AOISet of one participant's results (i.e. Intake.return_dict()[ID]), which only carry their "AOIs" if they weren't the default Left/Right layout, and their "AOI_Keys" if those aren't the names themselves
+    if "AOIs" not in results:
+        return DEFAULT_AOIS
+    return AOISet(results["AOIs"], results.get("AOI_Keys"))
+
+class AOILayout():
+    def __init__(self, regions, dtype = np.int8):
+        """
+        A set of rectangular AOIs with a grid index over them, so that any number of points are classified with four binary searches each, however many AOIs there are.
+
+        The x (and y) edges of every rectangle split the screen into intervals.  Each coordinate is mapped to a slot, an odd slot being a value exactly on an edge and an even slot the open interval between two edges, and a table over (x slot, y slot) holds the AOI of every cell.
+        As in classify_gaze(), a point has to lie strictly inside a rectangle, so points on an edge are Neither (unless they are inside another AOI).
+
+        Parameters
+        ----------
+        regions : list of (code, x0, y0, x1, y1) rectangles, an earlier region wins where two overlap
+        dtype : type of the returned codes, see AOISet.dtype
+        """
+        self.regions = list(regions)
+        self.x_edges = np.unique(np.array([[region[1], region[3]] for region in self.regions], dtype = np.float64).reshape(-1))
+        self.y_edges = np.unique(np.array([[region[2], region[4]] for region in self.regions], dtype = np.float64).reshape(-1))
+        self.table = np.zeros((2*len(self.x_edges)+1, 2*len(self.y_edges)+1), dtype = dtype)
+        for code, x0, y0, x1, y1 in reversed(self.regions):  #Painted last to first so the first region ends up on top
+            ix0, ix1 = np.searchsorted(self.x_edges, [x0, x1])
+            iy0, iy1 = np.searchsorted(self.y_edges, [y0, y1])
+            self.table[2*ix0+2:2*ix1+1, 2*iy0+2:2*iy1+1] = code  #Slots strictly between the edges
+        self.x_list = self.x_edges.tolist()  #For classify_point()
+        self.y_list = self.y_edges.tolist()
+        self.cells = self.table.tolist()
+
+    def classify(self, x, y):
+        """
+        Vectorized point in AOI lookup.
+
+        Parameters
+        ----------
+        x : array of "Gaze X" values
+        y : array of "Gaze Y" values
+
+        Returns
+        -------
+        codes : array of AOI codes, one per point (-1 where a coordinate is missing)
+        """
+        x_slot = np.searchsorted(self.x_edges, x, side = "left") + np.searchsorted(self.x_edges, x, side = "right")
+        y_slot = np.searchsorted(self.y_edges, y, side = "left") + np.searchsorted(self.y_edges, y, side = "right")
+        codes = self.table[x_slot, y_slot]
+        codes[~(np.isfinite(x) & np.isfinite(y))] = -1
+        return codes
+
+    def classify_point(self, x, y):
+        #Plain float version of classify() for one sample at a time
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return -1
+        return self.cells[bisect.bisect_left(self.x_list, x) + bisect.bisect_right(self.x_list, x)][bisect.bisect_left(self.y_list, y) + bisect.bisect_right(self.y_list, y)]
+
+class TrialLayouts():
+    def __init__(self, regions, keys = None):
+        """
+        The AOI layout of every trial of a study.  Every AOI name gets one code for the whole study (in order of first appearance), so trials with different layouts still share their matrices' rows and columns.
+
+        Parameters
+        ----------
+        regions : dictionary of trial (row-column, as in the results) -> list of (AOI name, x0, y0, x1, y1) rectangles.  The trial "*" holds the layout of every trial that isn't listed.
+        keys : optional dictionary of AOI name -> shorter name for the Ratios keys and .csv columns (see AOISet)
+        """
+        names = []
+        for trial in regions:
+            for region in regions[trial]:
+                if region[0] not in names:
+                    names.append(region[0])
+        self.aois = AOISet(names, None if keys is None else [keys.get(name, name) for name in names])
+        codes = {name: code+1 for code,name in enumerate(names)}
+        self.layouts = {trial: AOILayout([(codes[region[0]],) + tuple(region[1:]) for region in regions[trial]], self.aois.dtype) for trial in regions}
+
+    def layout(self, trial):
+        if trial in self.layouts:
+            return self.layouts[trial]
+        if "*" in self.layouts:
+            return self.layouts["*"]
+        raise ValueError(f"No AOI layout for trial {trial}")
+
+    def fingerprint(self):
+        #Changes whenever any of the layouts does, i.e. for GazeManifest_Final.RunManifest params
+        digest = hashlib.blake2b(digest_size = 20)
+        for trial,layout in self.layouts.items():
+            digest.update(repr((trial, layout.regions)).encode())
+        digest.update(repr(self.aois.keys).encode())
+        return digest.hexdigest()
+
+def load_layouts(layout_file):
+    """
+    Reads the AOI layouts of a study from a .csv (or .xlsx) with the columns Trial, AOI, X0, Y0, X1 and Y1, one row per rectangle.
+
+    Trial is the row-column identifier of a trial (i.e. "3-12") or "*" for every trial without rows of its own.  A point is in an AOI if X0 < x < X1 and Y0 < y < Y1 (screen pixels), and within a trial an earlier row wins where two AOIs overlap.
+    The same AOI name can be used by several trials (i.e. "Target" at a different position per trial), it is then the same row/column of the Markov matrices.
+
+    Parameters
+    ----------
+    layout_file : path of the layout file
+
+    Returns
+    -------
+    layouts : TrialLayouts
+    """
+    if layout_file.lower().endswith(".xlsx"):
+        table = pd.read_excel(layout_file, usecols = LAYOUT_COLUMNS, dtype = {"Trial": str, "AOI": str})
+    else:
+        table = pd.read_csv(layout_file, usecols = LAYOUT_COLUMNS, dtype = {"Trial": str, "AOI": str})
+    regions = {}
+    for row in table.itertuples(index = False):
+        regions.setdefault(row.Trial.strip(), []).append((row.AOI.strip(), float(row.X0), float(row.Y0), float(row.X1), float(row.Y1)))
+    return TrialLayouts(regions)
@@ -0,0 +1,193 @@
+import numpy as np
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+def plain_params(value):
+    #value with only JSON types, as it reads back from manifest.json (i.e. (100, 200) -> [100, 200], np.int64(100) -> 100), so params compare equal before and after a save
+    if isinstance(value, dict):
+        return {str(key): plain_params(item) for key,item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [plain_params(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+class RunManifest():
+    def __init__(self, results_folder, batch = 50):
+        """
+        A record in results_folder of every data/timestamp pair that has already been processed, so that a rerun only processes new or changed pairs (and an interrupted run picks up where it stopped).
+
+        For each pair the manifest keeps the fingerprint (size, modification time and content hash) of both files, the parameters they were processed with and the file their results were stored in.  A pair is reused only if all of those still match.
+        The results of each pair (Intake.return_dict() per neither cutoff and the err_list, see GazeAOI_Final.process_pair()) are pickled into f"{results_folder}manifest/", and the manifest itself is manifest/manifest.json.
+        The manifest is saved every batch recorded pairs (and by outputs()), rather than rewritten for every pair.  Until then, each recorded pair's entry is also written next to its results (f"{hash}.json"), and entries left behind by an interrupted run are taken back into the manifest when it is next opened, so no finished pair is ever reprocessed.
+
+        Parameters
+        ----------
+        results_folder : Folder path where the results of GazeAOI() are written
+        batch : number of recorded pairs between saves of the manifest.  The default is 50.
+        """
+        self.folder = os.path.join(results_folder, "manifest", "")
+        os.makedirs(self.folder, exist_ok = True)
+        self.manifest_file = self.folder + "manifest.json"
+        self.batch = batch
+        self.pending = 0  #Changes since the last save
+        self.unsaved = []  #Entry files of the pairs recorded since the last save
+        self.manifest = {"pairs": {}, "outputs": {}}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as file:
+                self.manifest = json.load(file)
+        self.recover()
+
+    def recover(self):
+        #Takes in the entries of pairs recorded after the last save, i.e. by an interrupted run
+        for name in sorted(os.listdir(self.folder)):
+            if not name.endswith(".json") or name == "manifest.json":
+                continue
+            try:
+                with open(self.folder + name) as file:
+                    record = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if os.path.exists(self.folder + record["results"]):
+                self.manifest["pairs"][self.pair_key(record["data_file"], record["timestamp_file"])] = record
+                self.pending += 1
+            self.unsaved.append(self.folder + name)
+
+    def pair_key(self, data_file, timestamp_file):
+        return f"{data_file}|{timestamp_file}"
+
+    def fingerprint(self, path, known = None):
+        #Size and modification time, plus the content hash.  The hash is only recomputed if the size or modification time changed since known
+        stat = os.stat(path)
+        if known is not None and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known
+        digest = hashlib.blake2b(digest_size = 20)
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024*1024), b""):
+                digest.update(chunk)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+    def done(self, data_file, timestamp_file, params):
+        """
+        Checks whether a pair was already processed with params and neither of its files changed since.
+
+        Parameters
+        ----------
+        data_file : path of the EyeMotions file
+        timestamp_file : path of the response file
+        params : dictionary of the parameters that affect the results (JSON types, tuples or numpy scalars, see plain_params())
+
+        Returns
+        -------
+        bool : True if the stored results of the pair can be reused
+        """
+        record = self.manifest["pairs"].get(self.pair_key(data_file, timestamp_file))
+        if record is None or record["params"] != plain_params(params) or not os.path.exists(self.folder + record["results"]):
+            return False
+        try:
+            data = self.fingerprint(data_file, record["data"])
+            timestamps = self.fingerprint(timestamp_file, record["timestamps"])
+        except OSError:
+            return False
+        if data["hash"] != record["data"]["hash"] or timestamps["hash"] != record["timestamps"]["hash"]:
+            return False
+        if data != record["data"] or timestamps != record["timestamps"]:  #Touched but unchanged, saves rehashing next time
+            record["data"] = data
+            record["timestamps"] = timestamps
+            self.pending += 1
+        return True
+
+    def load(self, data_file, timestamp_file):
+        #Returns the stored results of a pair, only valid after done() returned True
+        record = self.manifest["pairs"][self.pair_key(data_file, timestamp_file)]
+        with open(self.folder + record["results"], "rb") as file:
+            return pickle.load(file)
+
+    def record(self, data_file, timestamp_file, params, result):
+        """
+        Stores the results of a freshly processed pair and records it in the manifest, which is saved once batch pairs are pending.  Both are written atomically, so an interrupted run never leaves a half written pair behind.
+
+        Parameters
+        ----------
+        data_file : path of the EyeMotions file
+        timestamp_file : path of the response file
+        params : dictionary of the parameters the pair was processed with
+        result : the (results, err_list) pair returned by process_pair()
+        """
+        key = self.pair_key(data_file, timestamp_file)
+        name = hashlib.sha1(key.encode()).hexdigest()
+        results = name + ".pkl"
+        tmp = self.folder + results + f".tmp-{os.getpid()}"
+        with open(tmp, "wb") as file:
+            pickle.dump(result, file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.folder + results)
+
+        record = {"data_file": data_file,
+                  "timestamp_file": timestamp_file,
+                  "data": self.fingerprint(data_file),
+                  "timestamps": self.fingerprint(timestamp_file),
+                  "params": plain_params(params),
+                  "results": results}
+        self.write_atomic(self.folder + name + ".json", record)  #Kept until the manifest is saved, see recover()
+        self.unsaved.append(self.folder + name + ".json")
+        self.manifest["pairs"][key] = record
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.save()
+
+    def prune(self, pairs):
+        #Drops every record (and its stored results) whose pair is no longer in pairs, i.e. whose files were removed or renamed
+        keep = set(self.pair_key(row[0], row[1]) for row in pairs)
+        for key in list(self.manifest["pairs"]):
+            if key not in keep:
+                try:
+                    os.remove(self.folder + self.manifest["pairs"][key]["results"])
+                except OSError:
+                    pass
+                del self.manifest["pairs"][key]
+        self.save()
+
+    def merge(self, results_folder):
+        """
+        Takes over every pair recorded in the manifest of another results folder (i.e. of one shard of a sharded run), along with its stored results.  A rerun with incremental = True then loads those pairs instead of processing them.
+
+        Parameters
+        ----------
+        results_folder : Folder path of the other run's results
+
+        Returns
+        -------
+        int : the number of pairs taken over
+        """
+        other = RunManifest(results_folder)
+        for key,record in other.manifest["pairs"].items():
+            tmp = self.folder + record["results"] + f".tmp-{os.getpid()}"
+            shutil.copyfile(other.folder + record["results"], tmp)
+            os.replace(tmp, self.folder + record["results"])
+            self.manifest["pairs"][key] = record
+        self.save()
+        return len(other.manifest["pairs"])
+
+    def outputs(self, **paths):
+        #Records the files the merged results were last written to
+        self.manifest["outputs"] = paths
+        self.save()
+
+    def save(self):
+        self.write_atomic(self.manifest_file, self.manifest, indent = 4)
+        for path in self.unsaved:  #Now part of the manifest
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.unsaved = []
+        self.pending = 0
+
+    def write_atomic(self, path, value, indent = None):
+        tmp = path + f".tmp-{os.getpid()}"
+        with open(tmp, "w") as file:
+            json.dump(value, file, indent = indent)
+        os.replace(tmp, path)
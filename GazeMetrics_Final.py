@@ -0,0 +1,86 @@
+import pandas as pd
+import time
+import tracemalloc
+
+METRIC_COLUMNS = ["Participant", "Trial", "Stage", "Seconds", "Samples", "Peak_Bytes"]
+
+class Metrics():
+    def __init__(self, enabled = True):
+        """
+        Records the wall time, number of samples and peak memory of each stage of a run, per participant (and per trial where a stage is per trial).
+        The stages of Intake run over every trial of a participant at once, so the per trial records of a run are the number of samples of each trial (see count()), not a time or memory of their own.
+
+        Stages are recorded with
+            with metrics.stage("look_aoi", samples = n):
+                ...
+        When disabled, stage() hands back a shared do-nothing context, so instrumented code costs next to nothing.
+        Peak memory is the most memory (as tracked by tracemalloc, which includes numpy arrays) allocated on top of what was in use when the stage started.  Tracing memory slows allocations down, which is why metrics are off by default.
+        tracemalloc only has one peak for the whole process, so stages run in background threads (i.e. by a GazeCache_Final.PairLoader) are recorded with memory = False: their time and samples, but no Peak_Bytes.  The peaks of the stages running meanwhile then include what the background threads allocate.
+
+        Parameters
+        ----------
+        enabled : If False, nothing is recorded
+        """
+        self.enabled = enabled
+        self.records = []
+        self.participant = None
+        self.started = False
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+
+    def stage(self, name, samples = 0, trial = None, memory = True):
+        #Context manager timing one stage, its samples can also be set inside the block (i.e. stage.samples = n) once they are known.  memory = False leaves the peak memory out (and tracemalloc's peak untouched)
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, samples, trial, memory)
+
+    def count(self, name, samples, trial = None):
+        #Records a sample count without timing anything, i.e. the samples of each trial
+        if self.enabled:
+            self.records.append([self.participant, trial, name, 0.0, samples, 0])
+
+    def extend(self, records):
+        #Adds records from another Metrics (i.e. from a worker process)
+        if self.enabled:
+            self.records.extend(records)
+
+    def close(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def write(self, metrics_out):
+        #Writes every record as a .csv, one row per stage per participant (per trial)
+        pd.DataFrame(self.records, columns = METRIC_COLUMNS).to_csv(metrics_out, index = False)
+
+class Stage():
+    def __init__(self, metrics, name, samples, trial, memory = True):
+        self.metrics = metrics
+        self.name = name
+        self.samples = samples
+        self.trial = trial
+        self.traced = memory
+
+    def __enter__(self):
+        if self.traced:
+            tracemalloc.reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        peak = tracemalloc.get_traced_memory()[1] - self.memory if self.traced else None
+        self.metrics.records.append([self.metrics.participant, self.trial, self.name, seconds, self.samples, peak])
+        return False
+
+class NullStage():
+    #Stand-in for Stage when metrics are disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
@@ -0,0 +1,171 @@
+from EyeMotionsIntake_Final import numeric_results, transition_probs
+from GazeExport_Final import letter_code
+from GazeLayout_Final import participant_aois
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import pandas as pd
+import numpy as np
+import warnings
+
+def transition_units(data, category = "Nei_Markov", unit = "trial"):
+    """
+    Stacks the transition count matrices of every trial (or participant) of data, along with the condition each belongs to.
+
+    Parameters
+    ----------
+    data : A dictionary containing all of the outlined data (as per EyeMotionsIntake_Final.py), with the Markov chains either as count matrices (i.e. as returned by GazeStore_Final.ResultsStore.results()) or in their .json form (i.e. as returned by GazeAOI() or loaded from its JSON_out, see numeric_results() in EyeMotionsIntake_Final.py)
+    category : "Markov", "Adj_Markov" or "Nei_Markov"
+    unit : "trial" (the default) makes every trial a resampling unit, "participant" sums each participant's trials into one matrix first, so the resampling keeps each participant's trials together
+
+    Returns
+    -------
+    counts : n x size x size float array of transition counts (rows/columns are code+1)
+    groups : array of the letter code of each unit ("A" or "L", see letter_code() in GazeExport_Final.py)
+    aois : the GazeLayout_Final.AOISet of the matrices
+    """
+    if unit not in ["trial", "participant"]:
+        raise ValueError(f"Unknown unit {unit}, expected 'trial' or 'participant'")
+    data = numeric_results(data)
+    aois = None
+    counts = []
+    groups = []
+    for participant in data:
+        code = letter_code(participant)
+        if code is None:
+            continue
+        if aois is None:
+            aois = participant_aois(data[participant])
+        elif participant_aois(data[participant]).names != aois.names:
+            raise ValueError("Participants were processed with different AOIs, their matrices can't be compared")
+        trials = [trial for trial in data[participant]["TrialError"] if trial in data[participant][category]]  #A trial without any looks has no Markov chains
+        matrices = np.array([data[participant][category][trial] for trial in trials], dtype = np.float64).reshape(-1, aois.size, aois.size)
+        if unit == "participant":
+            matrices = matrices.sum(axis = 0, keepdims = True)
+        counts.append(matrices)
+        groups += [code]*len(matrices)
+    if aois is None:
+        raise ValueError("No Arrow or Letter participants to compare")
+    return np.concatenate(counts), np.array(groups, dtype = object), aois
+
+def pooled_probs(weights, counts):
+    """
+    The pooled transition probabilities of many resamples at once: every resample's count matrix is a weighted sum of the units' matrices, so all of them are one matrix product.
+
+    Parameters
+    ----------
+    weights : resamples x n array, how often each unit is drawn in each resample (i.e. bootstrap multiplicities or 0/1 group membership)
+    counts : n x size x size array of transition counts
+
+    Returns
+    -------
+    probs : resamples x size x size array of transition probabilities, rows without any transitions being NaN
+    """
+    size = counts.shape[1]
+    return transition_probs((weights @ counts.reshape(len(counts), -1)).reshape(-1, size, size))
+
+def bootstrap_chunk(counts_a, counts_b, resamples, seed):
+    #Resamples the units of each group with replacement (within the group), returning the pooled probabilities of each group per resample
+    rng = np.random.default_rng(seed)
+    weights_a = rng.multinomial(len(counts_a), np.full(len(counts_a), 1/len(counts_a)), size = resamples).astype(np.float64)
+    weights_b = rng.multinomial(len(counts_b), np.full(len(counts_b), 1/len(counts_b)), size = resamples).astype(np.float64)
+    return pooled_probs(weights_a, counts_a), pooled_probs(weights_b, counts_b)
+
+def permutation_chunk(counts, in_a, permutations, seed):
+    #Shuffles the group labels across units, returning the difference of the pooled probabilities (first group - second group) per permutation
+    rng = np.random.default_rng(seed)
+    labels = rng.permuted(np.tile(in_a, (permutations, 1)), axis = 1).astype(np.float64)
+    return pooled_probs(labels, counts) - pooled_probs(1 - labels, counts)
+
+def chunks(total, chunk_size, seed):
+    #Splits total resamples into chunks of chunk_size, each with its own seed, so the results depend on seed alone and not on how the chunks are spread over processes
+    sizes = [chunk_size]*(total//chunk_size) + ([total % chunk_size] if total % chunk_size else [])
+    return sizes, seed.spawn(len(sizes))
+
+def compare_conditions(data, categories = None, groups = ("A", "L"), unit = "trial", resamples = 10000, permutations = 10000, alpha = 0.05, seed = None, workers = 1, chunk_size = 500):
+    """
+    Compares the pooled transition probabilities of two conditions (Arrow vs Letter by default) with bootstrap confidence intervals and a permutation test, for every transition of every Markov category.
+
+    A condition's pooled probability of a transition is its summed count divided by the summed counts of the transition's row, over all of its units (trials or participants, see transition_units()).
+    The bootstrap resamples each condition's units with replacement, and the permutation test shuffles the condition labels across all units.  Every resample is one row of a weight matrix, so a whole chunk of resamples is a single matrix product over the stacked count matrices (see pooled_probs()) rather than a loop.
+    Chunks of chunk_size resamples are drawn from their own seeds (spawned from seed), and are spread over workers processes, so the same seed gives the same results for any number of workers.
+
+    Parameters
+    ----------
+    data : A dictionary containing all of the outlined data (as per EyeMotionsIntake_Final.py), as returned by GazeAOI() or GazeStore_Final.ResultsStore.results() (see transition_units())
+    categories : Markov categories to compare.  The default of None compares ["Adj_Markov", "Nei_Markov"].
+    groups : letter codes of the two conditions, the difference is groups[0] - groups[1]
+    unit : "trial" (the default) or "participant", see transition_units()
+    resamples : number of bootstrap resamples (at least 1).  The default is 10000.
+    permutations : number of permutations (at least 1).  The default is 10000.
+    alpha : the confidence intervals are the alpha/2 and 1-alpha/2 percentiles of the bootstrap.  The default is 0.05, i.e. 95% intervals.
+    seed : seed (int or numpy SeedSequence) of the random draws, the default of None is a fresh seed every run
+    workers : the number of processes the chunks are spread over.  The default of 1 runs everything in this process, None uses every core.
+    chunk_size : resamples per chunk, bounding the memory of each chunk to chunk_size x units weights.  The default is 500.
+
+    Returns
+    -------
+    result : DataFrame with one row per category per transition and the columns Matrix, From, To, then for each group f"{group}_Probability", f"{group}_CI_Low" and f"{group}_CI_High", then Difference, Difference_CI_Low, Difference_CI_High and P_Value (two sided)
+    """
+    if categories is None:
+        categories = ["Adj_Markov", "Nei_Markov"]
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    boot_seed, perm_seed = seed.spawn(2)
+    boot_sizes, boot_seeds = chunks(resamples, chunk_size, boot_seed)
+    perm_sizes, perm_seeds = chunks(permutations, chunk_size, perm_seed)
+    executor = None
+    if workers != 1:
+        executor = ProcessPoolExecutor(max_workers = workers)
+    mapper = map if executor is None else executor.map
+    bounds = [100*alpha/2, 100*(1 - alpha/2)]
+
+    try:
+        tables = []
+        for category in categories:
+            counts, labels, aois = transition_units(data, category, unit)
+            counts_a = counts[labels == groups[0]]
+            counts_b = counts[labels == groups[1]]
+            if len(counts_a) == 0 or len(counts_b) == 0:
+                raise ValueError(f"Both {groups[0]} and {groups[1]} need at least one {unit} to compare")
+            in_a = (labels[(labels == groups[0]) | (labels == groups[1])] == groups[0])
+            both = counts[(labels == groups[0]) | (labels == groups[1])]
+
+            observed_a = pooled_probs(np.ones((1, len(counts_a))), counts_a)[0]
+            observed_b = pooled_probs(np.ones((1, len(counts_b))), counts_b)[0]
+            observed = pooled_probs(in_a[None].astype(np.float64), both)[0] - pooled_probs(1 - in_a[None].astype(np.float64), both)[0]  #Same arithmetic as the permutations
+
+            boot = list(mapper(bootstrap_chunk, repeat(counts_a), repeat(counts_b), boot_sizes, boot_seeds))
+            boot_a = np.concatenate([chunk[0] for chunk in boot])
+            boot_b = np.concatenate([chunk[1] for chunk in boot])
+            perms = np.concatenate(list(mapper(permutation_chunk, repeat(both), repeat(in_a), perm_sizes, perm_seeds)))
+
+            with warnings.catch_warnings(), np.errstate(invalid = "ignore"):
+                warnings.simplefilter("ignore", RuntimeWarning)  #Transitions out of an AOI a group never left are NaN in every resample
+                ci_a = np.nanpercentile(boot_a, bounds, axis = 0)
+                ci_b = np.nanpercentile(boot_b, bounds, axis = 0)
+                ci_diff = np.nanpercentile(boot_a - boot_b, bounds, axis = 0)
+                extreme = (np.abs(perms) >= np.abs(observed) - 1e-12).sum(axis = 0)  #A permutation as extreme as the observed difference, allowing for rounding
+                valid = (~np.isnan(perms)).sum(axis = 0)
+                p_value = np.where(np.isnan(observed), np.nan, (1 + extreme)/(1 + valid))
+
+            order = np.array(aois.order) + 1  #Rows/columns in export order
+            labels_order = [aois.labels[code] for code in aois.order]
+            size = len(order)
+            def flat(values):
+                return values[order][:,order].reshape(-1)
+            table = {"Matrix": np.repeat(category, size*size).astype(object),
+                     "From": np.repeat(labels_order, size).astype(object),
+                     "To": np.tile(labels_order, size).astype(object)}
+            for group, probs, ci in [(groups[0], observed_a, ci_a), (groups[1], observed_b, ci_b)]:
+                table[f"{group}_Probability"] = flat(probs)
+                table[f"{group}_CI_Low"] = flat(ci[0])
+                table[f"{group}_CI_High"] = flat(ci[1])
+            table["Difference"] = flat(observed)
+            table["Difference_CI_Low"] = flat(ci_diff[0])
+            table["Difference_CI_High"] = flat(ci_diff[1])
+            table["P_Value"] = flat(p_value)
+            tables.append(pd.DataFrame(data = table))
+    finally:  #Also when a category can't be compared, so no worker processes are left behind
+        if executor is not None:
+            executor.shutdown()
+    return pd.concat(tables, ignore_index = True)
@@ -0,0 +1,213 @@
+from GazeLayout_Final import participant_aois
+
+from itertools import repeat
+import numpy as np
+import json
+import sqlite3
+
+LOOK_CATEGORIES = ["FirstLook", "LastLook", "FirstValid", "LastValid"]
+MATRIX_CATEGORIES = ["Markov", "Adj_Markov", "Nei_Markov"]
+
+#One row per participant, per trial, per trial per AOI/look/run/transition.  Values without a declared type are stored exactly as given, i.e. an integer 0 time stays an integer
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS participants (participant_id INTEGER PRIMARY KEY, participant TEXT UNIQUE NOT NULL, condition TEXT, participant_error REAL, aois TEXT, aoi_keys TEXT, cutoffs TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS trials (participant_id INTEGER NOT NULL, trial TEXT NOT NULL, position INTEGER NOT NULL, total_time, trial_error REAL, PRIMARY KEY (participant_id, trial));
+CREATE TABLE IF NOT EXISTS ratios (participant_id INTEGER NOT NULL, trial TEXT NOT NULL, aoi TEXT NOT NULL, share, time);
+CREATE TABLE IF NOT EXISTS looks (participant_id INTEGER NOT NULL, trial TEXT NOT NULL, look TEXT NOT NULL, aoi INTEGER, time REAL);
+CREATE TABLE IF NOT EXISTS timeline (participant_id INTEGER NOT NULL, trial TEXT NOT NULL, run INTEGER NOT NULL, aoi INTEGER, start INTEGER, time REAL, PRIMARY KEY (participant_id, trial, run));
+CREATE TABLE IF NOT EXISTS transitions (participant_id INTEGER NOT NULL, trial TEXT NOT NULL, matrix TEXT NOT NULL, neither_cutoff REAL, from_aoi INTEGER, to_aoi INTEGER, count INTEGER);
+CREATE INDEX IF NOT EXISTS participants_condition ON participants (condition);
+CREATE INDEX IF NOT EXISTS trials_trial ON trials (trial);
+CREATE INDEX IF NOT EXISTS ratios_trial ON ratios (participant_id, trial);
+CREATE INDEX IF NOT EXISTS looks_trial ON looks (participant_id, trial);
+CREATE INDEX IF NOT EXISTS transitions_trial ON transitions (participant_id, trial, matrix);
+"""
+TABLES = ["trials", "ratios", "looks", "timeline", "transitions"]  #Every table with rows per trial
+
+def condition(participant):
+    #i.e. "101CEArrow" -> "Arrow"
+    return participant.split("CE")[-1]
+
+class ResultsStore():
+    def __init__(self, db_path, batch = 50):
+        """
+        A SQLite database of the results of every participant, so a single participant, trial or condition can be looked up (or exported) in milliseconds instead of loading the whole .json.
+
+        Each category of the results is its own table (see SCHEMA), indexed on participant and trial, with participants indexed on their condition (i.e. "Arrow").  The Markov chains only keep their non-zero transitions, and the timelines their runs.
+        Participants are written in transactions of batch participants, writing a participant again (i.e. on a rerun) replaces it.
+
+        Parameters
+        ----------
+        db_path : path of the .db file, created if needed
+        batch : number of participants written per transaction.  The default is 50.
+        """
+        self.db_path = db_path
+        self.batch = batch
+        self.pending = 0
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript(SCHEMA)
+
+    def write(self, out):
+        """
+        Stores the results of one or more participants.
+
+        Parameters
+        ----------
+        out : dictionary of neither cutoff -> Intake.return_dict(cutoff), as returned by GazeAOI_Final.process_pair().  Nei_Markov is stored for every cutoff, everything else only once.
+        """
+        cutoffs = list(out.keys())
+        first = out[cutoffs[0]]
+        cursor = self.connection.cursor()
+        for participant in first:
+            data = first[participant]
+            values = (condition(participant), float(data["ParticipantError"]), json.dumps(data["AOIs"]) if "AOIs" in data else None, json.dumps(data["AOI_Keys"]) if "AOI_Keys" in data else None, json.dumps(cutoffs), participant)
+            ID = self.clear(participant)
+            if ID is None:
+                cursor.execute("INSERT INTO participants (condition, participant_error, aois, aoi_keys, cutoffs, participant) VALUES (?, ?, ?, ?, ?, ?)", values)
+                ID = cursor.lastrowid
+            else:  #Rewritten in place, so the participant keeps its position
+                cursor.execute("UPDATE participants SET condition = ?, participant_error = ?, aois = ?, aoi_keys = ?, cutoffs = ? WHERE participant = ?", values)
+            aois = participant_aois(data)
+            trials = list(data["TrialError"].keys())
+
+            cursor.executemany("INSERT INTO trials VALUES (?, ?, ?, ?, ?)",
+                               [(ID, trial, k, data["Ratios"][trial]["Total"], float(data["TrialError"][trial])) for k,trial in enumerate(trials)])
+            cursor.executemany("INSERT INTO ratios VALUES (?, ?, ?, ?, ?)",
+                               [(ID, trial, key, plain(data["Ratios"][trial][key][0]), plain(data["Ratios"][trial][key][1])) for trial in trials for key,code in aois.ratio_keys])
+            cursor.executemany("INSERT INTO looks VALUES (?, ?, ?, ?, ?)",
+                               [(ID, trial, look, int(data[look][trial][0]), float(data[look][trial][1])) for look in LOOK_CATEGORIES for trial in trials if data[look][trial] is not None])
+            for trial in trials:
+                runs = data["Timeline"][trial]
+                cursor.executemany("INSERT INTO timeline VALUES (?, ?, ?, ?, ?, ?)",
+                                   zip(repeat(ID), repeat(trial), range(len(runs["AOI"])), runs["AOI"].tolist(), runs["Start"].tolist(), runs["Time"].tolist()))
+
+            matrices = [(category, None, out[cutoffs[0]][participant][category]) for category in MATRIX_CATEGORIES[:2]]
+            matrices += [("Nei_Markov", cutoff, out[cutoff][participant]["Nei_Markov"]) for cutoff in cutoffs]
+            for category, cutoff, counts in matrices:
+                for trial in trials:
+                    rows, cols = np.nonzero(counts[trial])  #Rows/columns are code+1
+                    cursor.executemany("INSERT INTO transitions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       [(ID, trial, category, cutoff, a-1, b-1, int(counts[trial][a,b])) for a,b in zip(rows.tolist(), cols.tolist())])
+
+            self.pending += 1
+            if self.pending >= self.batch:
+                self.commit()
+
+    def clear(self, participant):
+        #Drops the trials of participant if it was already stored, returning its participant_id (None if it is new)
+        row = self.connection.execute("SELECT participant_id FROM participants WHERE participant = ?", (participant,)).fetchone()
+        if row is None:
+            return None
+        for table in TABLES:
+            self.connection.execute(f"DELETE FROM {table} WHERE participant_id = ?", row)
+        return row[0]
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def participants(self, condition = None):
+        #The stored participants in the order they were written, only those of condition (i.e. "Arrow") if given
+        if condition is None:
+            rows = self.connection.execute("SELECT participant FROM participants ORDER BY participant_id")
+        else:
+            rows = self.connection.execute("SELECT participant FROM participants WHERE condition = ? ORDER BY participant_id", (condition,))
+        return [row[0] for row in rows]
+
+    def trials(self, participant):
+        return [row[0] for row in self.connection.execute("SELECT trial FROM trials JOIN participants USING (participant_id) WHERE participant = ? ORDER BY position", (participant,))]
+
+    def timeline(self, participant, trial):
+        """
+        Returns one trial's run-length timeline.
+
+        Returns
+        -------
+        runs : dict of the parallel arrays "AOI", "Start" and "Time", as in Intake.return_dict() (see run_lengths())
+        """
+        ID, aois = self.lookup(participant)
+        return self.runs(ID, trial, aois)
+
+    def results(self, participants = None, condition = None, trials = None, cutoff = None):
+        """
+        Rebuilds the results of the chosen participants and trials exactly as Intake.return_dict() held them, so they can be passed straight to export_view(), gazeTable() or gazeExport() for a partial export.
+
+        Parameters
+        ----------
+        participants : optional list of participants, the default is every participant (of condition)
+        condition : optional condition (i.e. "Arrow" or "Letter") the participants are limited to
+        trials : optional list of trials (row-column) to include, the default is every trial
+        cutoff : the neither cutoff Nei_Markov is taken for, the default is the first cutoff of the participant's run
+
+        Returns
+        -------
+        dictionary : {participant: {data category: {trial: data}}}
+        """
+        if participants is None:
+            participants = self.participants(condition)
+        out = {}
+        for participant in participants:
+            ID, aois = self.lookup(participant)
+            if condition is not None and self.connection.execute("SELECT condition FROM participants WHERE participant_id = ?", (ID,)).fetchone()[0] != condition:
+                continue
+            out[participant] = self.participant_results(ID, aois, trials, cutoff)
+        return out
+
+    def lookup(self, participant):
+        row = self.connection.execute("SELECT participant_id, aois, aoi_keys FROM participants WHERE participant = ?", (participant,)).fetchone()
+        if row is None:
+            raise KeyError(f"{participant} is not in {self.db_path}")
+        return row[0], participant_aois(self.stored_aois(row[1], row[2]))
+
+    def stored_aois(self, aois, aoi_keys):
+        #The "AOIs" and "AOI_Keys" entries of a participant's results from their columns, empty for the default AOIs
+        stored = {}
+        if aois is not None:
+            stored["AOIs"] = json.loads(aois)
+        if aoi_keys is not None:
+            stored["AOI_Keys"] = json.loads(aoi_keys)
+        return stored
+
+    def runs(self, ID, trial, aois):
+        rows = self.connection.execute("SELECT aoi, start, time FROM timeline WHERE participant_id = ? AND trial = ? ORDER BY run", (ID, trial)).fetchall()
+        return {"AOI": np.array([row[0] for row in rows], dtype = aois.dtype),
+                "Start": np.array([row[1] for row in rows], dtype = np.int64),
+                "Time": np.array([row[2] for row in rows], dtype = np.float64)}
+
+    def participant_results(self, ID, aois, trials, cutoff):
+        participant_error, stored_aois, stored_keys, cutoffs = self.connection.execute("SELECT participant_error, aois, aoi_keys, cutoffs FROM participants WHERE participant_id = ?", (ID,)).fetchone()
+        if cutoff is None:
+            cutoff = json.loads(cutoffs)[0]
+        rows = self.connection.execute("SELECT trial, total_time, trial_error FROM trials WHERE participant_id = ? ORDER BY position", (ID,)).fetchall()
+        if trials is not None:
+            rows = [row for row in rows if row[0] in trials]
+        data = {category: {} for category in ["Timeline", "LastLook", "FirstLook", "Ratios", "Time_Total", "LastValid", "FirstValid", "Markov", "Adj_Markov", "Nei_Markov", "TrialError"]}
+        size = aois.size
+        for trial, total_time, trial_error in rows:
+            data["Timeline"][trial] = self.runs(ID, trial, aois)
+            data["Time_Total"][trial] = total_time
+            data["Ratios"][trial] = {"Total": total_time}
+            for key, share, time in self.connection.execute("SELECT aoi, share, time FROM ratios WHERE participant_id = ? AND trial = ? ORDER BY rowid", (ID, trial)):
+                data["Ratios"][trial][key] = [np.nan if share is None else share, time]
+            for look in LOOK_CATEGORIES:
+                data[look][trial] = None
+            for look, aoi, time in self.connection.execute("SELECT look, aoi, time FROM looks WHERE participant_id = ? AND trial = ?", (ID, trial)):
+                data[look][trial] = (aoi, time)
+            for category in MATRIX_CATEGORIES:
+                data[category][trial] = np.zeros((size, size), dtype = np.int64)
+            for category, a, b, count in self.connection.execute("SELECT matrix, from_aoi, to_aoi, count FROM transitions WHERE participant_id = ? AND trial = ? AND (neither_cutoff IS NULL OR neither_cutoff = ?)", (ID, trial, cutoff)):
+                data[category][trial][a+1, b+1] = count
+            data["TrialError"][trial] = trial_error
+        data["ParticipantError"] = participant_error
+        data.update(self.stored_aois(stored_aois, stored_keys))
+        return data
+
+def plain(value):
+    #numpy scalars as the Python number SQLite takes, keeping integers (i.e. the time of an AOI never looked at) integers
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return float(value)
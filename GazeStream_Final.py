@@ -0,0 +1,508 @@
+from EyeMotionsIntake_Final import classify_point, read_eyemotions, read_timestamps
+from GazeLayout_Final import DEFAULT_AOIS
+
+import numpy as np
+import math
+import socket
+import time
+
+CATEGORIES = ["Timeline", "LastLook", "FirstLook", "Ratios", "Time_Total", "LastValid", "FirstValid", "Markov", "Adj_Markov", "Nei_Markov", "TrialError"]  #Same order as Intake.return_dict()
+
+class TrialAccumulator():
+    def __init__(self, cutoffs, size = 4):
+        """
+        Running statistics of one trial, fed one (interpolated) sample at a time in constant time: the time and samples per AOI, the run-length timeline and the three Markov count matrices.
+        Every total is added up in sample order, exactly like the bincounts of Intake, so the results are identical to the batch ones.
+
+        Parameters
+        ----------
+        cutoffs : the neither cutoffs Nei_Markov is counted for
+        size : number of codes including NaN and Neither (GazeLayout_Final.AOISet.size)
+        """
+        self.size = size
+        self.times = [0.0]*size  #Per AOI, index code+1 as in the Markov matrices
+        self.samples = [0]*size
+        self.markov = [0]*(size*size)  #Flattened matrices, [a+1, b+1] -> size*(a+1) + b+1
+        self.adj = [0]*(size*size)
+        self.nei = {cut: [0]*(size*size) for cut in cutoffs}
+        self.kept = {cut: None for cut in cutoffs}  #Index of the last run Nei_Markov kept, per cutoff
+        self.n = 0
+        self.last = None  #Index of the current run's code
+        self.run_start = 0
+        self.run_time = 0.0
+        self.run_codes = []  #Finished runs
+        self.run_starts = []
+        self.run_times = []
+
+    def add(self, code, time):
+        i = code + 1
+        self.times[i] += time
+        self.samples[i] += 1
+        if self.last is None:
+            self.run_time = 0.0 + time
+        elif i == self.last:
+            self.markov[self.size*i + i] += 1
+            self.run_time += time
+        else:
+            self.markov[self.size*self.last + i] += 1
+            self.adj[self.size*self.last + i] += 1
+            self.finish_run(i)
+            self.run_start = self.n
+            self.run_time = 0.0 + time
+        self.last = i
+        self.n += 1
+
+    def finish_run(self, following = None):
+        #Stores the current run, and settles whether it is a transition Neither now that the run following it (None at the end of the trial) is known
+        self.run_codes.append(self.last)
+        self.run_starts.append(self.run_start)
+        self.run_times.append(self.run_time)
+        before = self.run_codes[-2] if len(self.run_codes) > 1 else None
+        for cut in self.nei:
+            if following is not None and before is not None and self.last == 1 and self.run_time < cut and before > 1 and following > 1 and before != following:
+                continue  #A transition Neither (between two different AOIs), skipped over
+            if self.kept[cut] is not None:
+                self.nei[cut][self.size*self.kept[cut] + self.last] += 1
+            self.kept[cut] = self.last
+
+    def close(self):
+        #Stores the last run
+        if self.last is not None:
+            self.finish_run()
+
+class TrialStream():
+    def __init__(self, name, start, cutoffs, max_gap = 1, aois = DEFAULT_AOIS):
+        """
+        One trial of a StreamIntake: fills the NaN gaps of its samples as they arrive (the same rule as fill_gaps()) and feeds them to a TrialAccumulator.
+
+        A gap is only filled once it is known to be at most max_gap samples long, so at most max_gap+1 sample times are ever held back.
+        A gap at the very start of the trial takes the sample right after it instead.
+
+        Parameters
+        ----------
+        name : the trial identifier (row-column, as in the results)
+        start : start time of the trial (seconds)
+        cutoffs : the neither cutoffs Nei_Markov is counted for
+        max_gap : the longest run of NaNs that gets filled, see fill_gaps()
+        aois : the GazeLayout_Final.AOISet of the study
+        """
+        self.name = name
+        self.start = start
+        self.end = None
+        self.start_i = None
+        self.end_i = None
+        self.overlap = None  #Decided once the previous trial has closed, see StreamIntake.check_overlap()
+        self.dropped = False
+        self.buffer = None  #Samples held back until the end of the recording, see StreamIntake.feed()
+        self.result = None
+
+        self.classify = classify_point  #Replaced by the trial's own layout, see StreamIntake.start_trial()
+        self.cutoffs = cutoffs
+        self.max_gap = max_gap
+        self.aois = aois
+        self.accumulator = None
+        self.gap = []  #Times of the current NaN run, until it is known to be filled or not
+        self.leading = False  #The current NaN run started the trial
+        self.long = False  #The current NaN run is longer than max_gap
+        self.previous = None  #Raw code of the sample before the current NaN run
+        self.raw = None  #Raw code of the latest sample
+        self.length = 0
+        self.nans = 0
+
+    def add(self, raw, time):
+        if self.buffer is not None:
+            self.buffer.append((raw, time))
+            return
+        self.length += 1
+        if raw == -1:
+            self.nans += 1
+            if self.long:
+                self.emit(-1, time)
+            else:
+                if len(self.gap) == 0:
+                    self.leading = self.length == 1
+                self.gap.append(time)
+                if len(self.gap) > self.max_gap:
+                    for gap_time in self.gap:
+                        self.emit(-1, gap_time)
+                    self.gap = []
+                    self.long = True
+        else:
+            if len(self.gap) > 0:
+                for gap_time in self.gap:
+                    self.emit(raw if self.leading else self.previous, gap_time)
+                self.gap = []
+            self.long = False
+            self.emit(raw, time)
+            self.previous = raw
+        self.raw = raw
+
+    def emit(self, code, time):
+        if self.accumulator is None:
+            self.accumulator = TrialAccumulator(self.cutoffs, self.aois.size)
+        self.accumulator.add(code, time)
+
+    def close(self):
+        #Fills a gap at the very end of the trial and returns the trial's results
+        if len(self.gap) > 0:
+            fill = self.raw if self.leading else self.previous  #A trial that is a single gap has nothing to fill from, i.e. stays NaN
+            for gap_time in self.gap:
+                self.emit(fill, gap_time)
+            self.gap = []
+        self.accumulator.close()
+        self.result = self.summarize(self.accumulator)
+        self.accumulator = None
+        return self.result
+
+    def summarize(self, accumulator):
+        """
+        Converts an accumulator into the results of this trial, each of the same type and value as the trial's entry in that category of Intake.return_dict()
+
+        Returns
+        -------
+        result : dictionary of category -> data, Nei_Markov holding one count matrix per cutoff
+        """
+        size = self.aois.size
+        runs = {"AOI": (np.array(accumulator.run_codes, dtype = np.int64) - 1).astype(self.aois.dtype),
+                "Start": np.array(accumulator.run_starts, dtype = np.int64),
+                "Time": np.array(accumulator.run_times, dtype = np.float64)}
+        valid = np.flatnonzero(runs["AOI"] > 0)
+        times = np.array(accumulator.times, dtype = np.float64)
+        total = sum(times[code+1] for name,code in self.aois.ratio_keys)  #L + R + NaN + Neither, as in Intake.ratios()
+        duration = (self.end - self.start)*1000
+
+        result = {"Timeline": runs,
+                  "LastLook": (int(runs["AOI"][-1]), runs["Time"][-1]),
+                  "FirstLook": (int(runs["AOI"][0]), runs["Time"][0]),
+                  "Ratios": {"Total": duration},
+                  "Time_Total": duration,
+                  "LastValid": None,
+                  "FirstValid": None,
+                  "Markov": np.array(accumulator.markov, dtype = np.int64).reshape(size,size),
+                  "Adj_Markov": np.array(accumulator.adj, dtype = np.int64).reshape(size,size),
+                  "Nei_Markov": {cut: np.array(counts, dtype = np.int64).reshape(size,size) for cut,counts in accumulator.nei.items()},
+                  "TrialError": 1 - np.int64(self.nans)/np.int64(self.length)}
+        for name,code in self.aois.ratio_keys:
+            time = times[code+1] if accumulator.samples[code+1] > 0 else 0  #An AOI that was never looked at stays an integer 0
+            result["Ratios"][name] = [time/total, time]
+        if len(valid) > 0:
+            result["FirstValid"] = (int(runs["AOI"][valid[0]]), runs["Time"][valid[0]])
+            result["LastValid"] = (int(runs["AOI"][valid[-1]]), runs["Time"][valid[-1]])
+        return result
+
+class StreamIntake():
+    def __init__(self, ID, neither_cutoff, max_nan_gap = 1, layouts = None):
+        """
+        Streaming counterpart of Intake for live tracker feeds: gaze samples are fed one at a time with feed(), and the trials announced with start_trial() and end_trial() as the experiment runs.
+        Each sample updates its trial's AOI code, ratios, timeline, Markov chains and TrialError in constant time, and only the open trial's statistics are held in memory (never the recording).
+        Every trial's results are returned by feed() as soon as the trial closes, and once finish() is called return_dict() gives exactly what Intake.return_dict() gives for the same recording.
+
+        Trials are resolved to samples the way trial_indices() does it, which requires the events to be fed in time order with the samples: a trial's start (or end) must be announced before the first sample at or after that time.
+        A trial is only reported one sample after it closes, once the next trial is known not to overlap it (overlapping trials are dropped, as in Intake.find_times()).
+
+        Parameters
+        ----------
+        ID : participant identifier the results are keyed by, i.e. "109CELetter"
+        neither_cutoff : the maximum time of a transition Neither (ms), or a list of cutoffs (see Intake)
+        max_nan_gap : the longest run of NaN samples that gets filled in, see fill_gaps()
+        layouts : optional GazeLayout_Final.TrialLayouts with the AOIs of every trial, the default of None being the Left/Right AOIs (see Intake)
+        """
+        self.ID = ID
+        self.layouts = layouts
+        self.aois = DEFAULT_AOIS if layouts is None else layouts.aois
+        self.neither_cutoffs = list(neither_cutoff) if isinstance(neither_cutoff, (list, tuple)) else [neither_cutoff]
+        self.max_nan_gap = max_nan_gap
+        self.err_list = []
+        self.check_err = None  #Set by finish()
+
+        self.n = 0  #Samples fed so far
+        self.recent = (None, None)  #Timestamps of the two latest samples
+        self.lag = None  #(trial, raw code) of the latest sample, whose time needs the next timestamp
+        self.queue = []  #Announced trials that haven't opened yet, in start order
+        self.open = None
+        self.held = None  #The latest closed trial, until the next trial is known not to overlap it
+        self.search_from = 0  #Index of the first sample the next trial can start at
+        self.search_ts = None  #Timestamp of that sample
+        self.trials = []  #Every trial that opened, in start order
+        self.announced = {}  #Trial name -> TrialStream
+        self.latest = None  #The trial with the latest start
+        self.overlaps = []
+
+    def start_trial(self, trial, start, end = None):
+        #Announces a trial starting at start (seconds), its end can be given here or later with end_trial()
+        stream = TrialStream(trial, start, self.neither_cutoffs, self.max_nan_gap, self.aois)
+        stream.end = end
+        if self.layouts is not None:
+            stream.classify = self.layouts.layout(trial).classify_point
+        self.queue.append(stream)
+        self.announced[trial] = stream
+        self.latest = stream
+        if self.open is None and self.search_ts is not None:
+            self.check_overlap([])
+
+    def end_trial(self, trial, end):
+        self.announced[trial].end = end
+
+    def feed(self, timestamp, x, y):
+        """
+        Adds the next gaze sample.
+
+        Parameters
+        ----------
+        timestamp : time of the sample (ms)
+        x : "Gaze X" of the sample (NaN if missing)
+        y : "Gaze Y" of the sample (NaN if missing)
+
+        Returns
+        -------
+        trials : list of (trial, result) for every trial finished by this sample (usually none), see TrialStream.summarize()
+        """
+        finished = []
+        n = self.n
+        if self.lag is not None:  #The time of the previous sample is half the distance between its neighbours, see dwell_times()
+            trial, raw = self.lag
+            if n == 1:  #The very first sample wraps around to the last one (as in dwell_times()), so its trial is held back until finish()
+                trial.buffer = [(raw, timestamp)]
+            else:
+                trial.add(raw, (timestamp - self.recent[0])/2)
+            self.lag = None
+        if n == self.search_from:
+            self.search_ts = timestamp
+            self.check_overlap(finished)
+
+        trial = self.open
+        if trial is not None and n > trial.start_i and trial.end is not None and timestamp >= trial.end*1000:
+            self.close(trial, n)
+        elif trial is not None:
+            if not trial.dropped:
+                self.lag = (trial, trial.classify(x, y))
+        elif len(self.queue) > 0 and self.queue[0].overlap is not None and timestamp >= self.queue[0].start*1000:
+            trial = self.queue.pop(0)
+            trial.start_i = n
+            self.open = trial
+            self.trials.append(trial)
+            if not trial.dropped:
+                self.lag = (trial, trial.classify(x, y))
+
+        self.recent = (self.recent[1], timestamp)
+        self.n += 1
+        return finished
+
+    def check_overlap(self, finished):
+        #The next trial overlaps the previous one when the first sample it could start at is already past its start (see trial_indices()), both are then dropped
+        if len(self.queue) > 0 and self.queue[0].overlap is None:
+            trial = self.queue[0]
+            trial.overlap = self.search_ts > trial.start*1000
+            if trial.overlap:
+                if self.held is not None:
+                    self.drop(self.held)
+                self.drop(trial)
+        self.release(finished)
+
+    def release(self, finished):
+        #Reports the held trial, unless it was dropped
+        if self.held is not None:
+            if not self.held.dropped and self.held.result is not None:
+                finished.append((self.held.name, self.held.result))
+            self.held = None
+
+    def drop(self, trial):
+        trial.dropped = True
+        trial.result = None
+        if trial.name not in self.overlaps:
+            self.overlaps.append(trial.name)
+
+    def close(self, trial, n):
+        trial.end_i = n
+        if not trial.dropped and trial.buffer is None:
+            trial.close()
+        self.open = None
+        self.held = trial
+        self.search_from = n + 1
+        self.search_ts = None
+
+    def finish(self):
+        """
+        Ends the recording: the last closed trial is released, a trial held back by the first sample is worked out, and the recording is checked for missing data like Intake does.
+
+        Returns
+        -------
+        trials : list of (trial, result) of the trials finished by the end of the recording
+        """
+        finished = []
+        self.release(finished)  #No sample left for another trial to start at, so it can't overlap
+        for trial in self.trials:
+            if trial.buffer is not None and trial.end_i is not None and not trial.dropped:
+                samples = trial.buffer
+                trial.buffer = None
+                trial.add(samples[0][0], (samples[0][1] - self.recent[1])/2)
+                for raw, stamp in samples[1:]:
+                    trial.add(raw, stamp)
+                finished.append((trial.name, trial.close()))
+
+        if self.latest is not None and self.latest.end is not None and self.n > 0 and self.recent[1] > self.latest.end*1000:
+            self.check_err = True
+            if len(self.overlaps) > 0:
+                self.err_list.append(f"{self.ID} - Overlapping trials ({len(self.overlaps)}):")
+                print(f"{self.ID} contains overlapping trials, continuing with all non overlapping trials")
+                for over in self.overlaps:
+                    self.err_list.append(f"    - {self.ID}: {over}")
+        else:  #The tracker stopped recording before the end of the last trial
+            self.check_err = False
+            print(f"{self.ID} skipped: missing time")
+            self.err_list.append(f"{self.ID} - Missing Data")
+        return finished
+
+    def return_dict(self, cutoff = None):
+        #Same as Intake.return_dict(), only valid after finish() found no missing data
+        if cutoff is None:
+            cutoff = self.neither_cutoffs[0]
+        out = {self.ID: {category: {} for category in CATEGORIES}}
+        nans = 0
+        length = 0
+        for trial in self.trials:
+            if trial.dropped or trial.result is None:
+                continue
+            for category in CATEGORIES:
+                out[self.ID][category][trial.name] = trial.result[category]
+            out[self.ID]["Nei_Markov"][trial.name] = trial.result["Nei_Markov"][cutoff]
+            nans += trial.nans
+            length += trial.length
+        out[self.ID]["ParticipantError"] = 1 - np.int64(nans)/np.int64(length)
+        if self.layouts is not None:
+            out[self.ID]["AOIs"] = self.aois.names
+            if self.aois.keys != self.aois.names:
+                out[self.ID]["AOI_Keys"] = self.aois.keys
+        return out
+
+def read_stream(lines):
+    """
+    Parses the lines of a live EyeMotions export (a header ending in "#DATA", the column names, then one sample per line) into messages for run_stream().
+    Trial events are lines of their own, "#TRIAL_START,{trial},{seconds}" and "#TRIAL_END,{trial},{seconds}", written into the stream as the experiment runs.
+
+    Parameters
+    ----------
+    lines : iterable of lines, i.e. from tail_lines() or socket_lines()
+
+    Yields
+    ------
+    message : ("sample", timestamp, x, y), ("start", trial, seconds) or ("end", trial, seconds)
+    """
+    columns = None
+    header = True
+    for line in lines:
+        fields = [field.strip().strip('"') for field in line.rstrip("\r\n").split(",")]
+        if fields[0] == "#TRIAL_START":
+            yield ("start", fields[1], float(fields[2]))
+        elif fields[0] == "#TRIAL_END":
+            yield ("end", fields[1], float(fields[2]))
+        elif header:
+            header = fields[0] != "#DATA"
+        elif columns is None:
+            columns = [fields.index(column) for column in ["Timestamp", "Gaze X", "Gaze Y"]]
+        elif len(fields) > max(columns):
+            yield ("sample",) + tuple(float(fields[i]) if fields[i] != "" else math.nan for i in columns)
+
+def tail_lines(path, poll = 0.1, idle = None):
+    """
+    Follows a file that is still being written (i.e. a recording in progress), yielding every complete line as it is appended.
+
+    Parameters
+    ----------
+    path : path of the file
+    poll : seconds to wait before checking for new lines again
+    idle : stop after this many seconds without a new line, the default of None follows the file forever
+    """
+    with open(path) as file:
+        partial = ""
+        waited = 0
+        while True:
+            line = file.readline()
+            if line == "":
+                if idle is not None and waited >= idle:
+                    return
+                time.sleep(poll)
+                waited += poll
+                continue
+            waited = 0
+            partial += line
+            if partial.endswith("\n"):
+                yield partial
+                partial = ""
+
+def socket_lines(host = "127.0.0.1", port = 5555):
+    #Stand-in for a tracker's live feed: yields the lines sent over a local TCP connection until the sender closes it
+    with socket.create_connection((host, port)) as connection:
+        with connection.makefile("r") as stream:
+            for line in stream:
+                yield line
+
+def recorded_messages(data_file, timestamp_file):
+    """
+    Replays a recorded EyeMotions file and its response file as a live feed, each trial event just before the first sample at or after its time.  Useful to check a stream against Intake.
+
+    Parameters
+    ----------
+    data_file : path of the EyeMotions .csv
+    timestamp_file : path of the response file
+
+    Yields
+    ------
+    message : the messages of read_stream()
+    """
+    gaze = read_eyemotions(data_file)
+    sheets = read_timestamps(timestamp_file)
+    IDs = {str(row[0]): f"{int(row[1])}-{int(row[2])}" for row in sheets["Resps"][1:]}
+    times_sheet = sheets["Times"]
+    times_sheet = times_sheet[times_sheet[:,0]*0 == 0]
+    times_sheet = times_sheet[times_sheet[:,1]*0 == 0]
+
+    events = []
+    for row in times_sheet:
+        trial = IDs[str(int(row[0]))]
+        events.append((row[1]*1000, ("start", trial, row[1])))
+        events.append((row[2]*1000, ("end", trial, row[2])))
+    events.sort(key = lambda event: event[0])  #Stable, so trials starting at the same time stay in sheet order
+
+    k = 0
+    for timestamp, x, y in zip(gaze["Timestamp"].tolist(), gaze["Gaze X"].tolist(), gaze["Gaze Y"].tolist()):
+        while k < len(events) and events[k][0] <= timestamp:
+            yield events[k][1]
+            k += 1
+        yield ("sample", timestamp, x, y)
+    for event in events[k:]:
+        yield event[1]
+
+def run_stream(intake, messages, on_trial = None):
+    """
+    Feeds messages (see read_stream()) to a StreamIntake until they run out, then finishes it.
+
+    Parameters
+    ----------
+    intake : StreamIntake
+    messages : iterable of messages
+    on_trial : optional function called with (trial, result) as soon as each trial is finished
+
+    Returns
+    -------
+    intake : the finished StreamIntake, its results are in intake.return_dict() if intake.check_err
+    """
+    for message in messages:
+        if message[0] == "sample":
+            finished = intake.feed(message[1], message[2], message[3])
+            if on_trial is not None:
+                for trial, result in finished:
+                    on_trial(trial, result)
+        elif message[0] == "start":
+            intake.start_trial(message[1], message[2])
+        else:
+            intake.end_trial(message[1], message[2])
+    for trial, result in intake.finish():
+        if on_trial is not None:
+            on_trial(trial, result)
+    return intake
+
+if __name__ == "__main__":
+    intake = StreamIntake("109CELetter", 100)
+    run_stream(intake, read_stream(tail_lines("M:/AResearch/Gaze_AOI2/Live/109CE Letter 03-08-22 14h22m.csv", idle = 30)),
+               on_trial = lambda trial, result: print(f"{trial}: L {result['Ratios']['L'][0]:.2f}, R {result['Ratios']['R'][0]:.2f}, TrialError {result['TrialError']:.2f}"))
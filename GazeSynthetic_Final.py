@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+import os
+
+AOI_TARGETS = {1: (510, 540), 2: (1410, 540)}  #Centre of the Left and Right AOIs (see classify_gaze() in EyeMotionsIntake_Final.py), Neither fixations land anywhere else on a 1920x1080 screen
+DATA_COLUMNS = ["Row", "Timestamp", "EventSource", "Gaze X", "Gaze Y", "ET_PupilLeft", "ET_PupilRight"]
+
+def synthetic_trials(n_trials = 144, trial_seconds = (2, 5), gap_seconds = (0.5, 1.5), first_start = 2, overlap = False, rng = None):
+    """
+    Generates the trial schedule of one participant.
+
+    Parameters
+    ----------
+    n_trials : number of trials.  The default is 144.
+    trial_seconds : (min, max) length of a trial in seconds, drawn uniformly
+    gap_seconds : (min, max) time between trials in seconds, drawn uniformly
+    first_start : start of the first trial in seconds
+    overlap : If True, one trial starts before the previous one ends (which Intake removes, see find_times())
+    rng : numpy Generator, the default of None uses a fresh unseeded one
+
+    Returns
+    -------
+    trials : n_trials x 3 array of trial number, start and end (seconds), in chronological order
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    lengths = rng.uniform(*trial_seconds, n_trials)
+    gaps = rng.uniform(*gap_seconds, n_trials)
+    starts = first_start + np.concatenate(([0], np.cumsum(lengths + gaps)[:-1]))
+    trials = np.column_stack((np.arange(1, n_trials+1), starts, starts + lengths))
+    if overlap and n_trials > 1:
+        k = rng.integers(1, n_trials)
+        trials[k,1] = trials[k-1,2] - 0.2
+    return trials
+
+def synthetic_gaze(duration, rate = 200, fixation_ms = 300, nan_rate = 0.02, blinks_per_minute = 15, blink_ms = (50, 300), rng = None):
+    """
+    Generates a gaze recording: fixations of exponentially distributed length on the Left AOI, the Right AOI or elsewhere, with gaussian jitter, isolated dropped samples and longer blinks (NaN bursts).
+
+    Parameters
+    ----------
+    duration : length of the recording in seconds
+    rate : sampling rate in Hz.  The default is 200, i.e. ~5ms per sample
+    fixation_ms : mean length of a fixation in ms
+    nan_rate : probability of any single sample being dropped
+    blinks_per_minute : mean number of NaN bursts per minute
+    blink_ms : (min, max) length of a NaN burst in ms
+    rng : numpy Generator, the default of None uses a fresh unseeded one
+
+    Returns
+    -------
+    dict : "Timestamp" (ms), "Gaze X" and "Gaze Y" arrays, like read_eyemotions() returns
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    n = int(duration*rate)
+    period = 1000/rate
+    timestamps = np.round(np.cumsum(rng.uniform(0.96*period, 1.04*period, n)), 3)
+
+    n_fixations = int(n*period/fixation_ms*2) + 1
+    fixation_ends = np.cumsum(np.maximum(1, rng.exponential(fixation_ms/period, n_fixations)).astype(np.int64))
+    fixation = np.searchsorted(fixation_ends, np.arange(n), side = "right")  #Fixation of each sample
+    target = rng.choice([1, 2, 0], n_fixations, p = [0.4, 0.4, 0.2])
+    centre_x = np.where(target == 1, AOI_TARGETS[1][0], np.where(target == 2, AOI_TARGETS[2][0], rng.uniform(0, 1920, n_fixations)))
+    centre_y = np.where(target == 0, rng.uniform(0, 1080, n_fixations), AOI_TARGETS[1][1])
+    x = np.round(centre_x[fixation] + rng.normal(0, 60, n), 4)
+    y = np.round(centre_y[fixation] + rng.normal(0, 50, n), 4)
+
+    missing = rng.random(n) < nan_rate
+    n_blinks = rng.poisson(blinks_per_minute*duration/60)
+    blink_starts = rng.integers(0, n, n_blinks)
+    blink_lengths = (rng.uniform(*blink_ms, n_blinks)/period).astype(np.int64)
+    edges = np.zeros(n+1, dtype = np.int64)
+    np.add.at(edges, blink_starts, 1)
+    np.add.at(edges, np.minimum(blink_starts + blink_lengths, n), -1)
+    missing |= np.cumsum(edges[:-1]) > 0
+    x[missing] = np.nan
+    y[missing & (rng.random(n) < 0.5)] = np.nan  #The tracker doesn't always drop both coordinates
+    return {"Timestamp": timestamps, "Gaze X": x, "Gaze Y": y}
+
+def write_eyemotions(data_file, gaze, header_lines = 28):
+    """
+    Writes a gaze recording as an EyeMotions export (see README): a header ending in "#DATA", then the column names and the samples.
+
+    Parameters
+    ----------
+    data_file : output path
+    gaze : dict of "Timestamp", "Gaze X" and "Gaze Y" arrays, i.e. from synthetic_gaze()
+    header_lines : number of header lines before "#DATA"
+    """
+    n = len(gaze["Timestamp"])
+    blank = "," * (len(DATA_COLUMNS)-2)
+    with open(data_file, "w") as file:
+        file.write(f"#Study name,Synthetic{blank}\n")
+        for i in range(header_lines-1):
+            file.write(f"#Header {i},value{blank}\n")
+        file.write("#DATA" + "," * (len(DATA_COLUMNS)-1) + "\n")
+        file.write(",".join(DATA_COLUMNS) + "\n")
+        pd.DataFrame({"Row": np.arange(n),
+                      "Timestamp": gaze["Timestamp"],
+                      "EventSource": "ET",
+                      "Gaze X": gaze["Gaze X"],
+                      "Gaze Y": gaze["Gaze Y"],
+                      "ET_PupilLeft": 3.1,
+                      "ET_PupilRight": 3.2}).to_csv(file, header = False, index = False)
+
+def write_resps(timestamp_file, trials, columns = 12, rng = None):
+    """
+    Writes the response workbook of one participant (see README): a "Resps" sheet with each trial's row and column, and a "Times" sheet with each trial's start and end (in shuffled order).
+
+    Parameters
+    ----------
+    timestamp_file : output path
+    trials : array of trial number, start and end, i.e. from synthetic_trials()
+    columns : number of columns of the trial grid, trial k is at row (k-1)//columns + 1, column (k-1)%columns + 1
+    rng : numpy Generator used to shuffle the Times sheet
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    number = trials[:,0].astype(np.int64)
+    resps = pd.DataFrame({"Trial": np.concatenate(([0], number)),  #The first row isn't a trial, Intake skips it
+                          " row": np.concatenate(([0], (number-1)//columns + 1)),
+                          " column": np.concatenate(([0], (number-1)%columns + 1))})
+    order = rng.permutation(len(trials))
+    times = pd.DataFrame({"Trial": number[order], "Start (seconds)": trials[order,1], "End": trials[order,2]})
+    with pd.ExcelWriter(timestamp_file) as writer:
+        resps.to_excel(writer, sheet_name = "Resps", index = False)
+        times.to_excel(writer, sheet_name = "Times", index = False)
+
+def generate_dataset(folder, participants = 10, n_trials = 144, conditions = ("Arrow", "Letter"), rate = 200, seed = 0, overlapping = 0, missing_data = 0, **gaze_options):
+    """
+    Writes a synthetic study: one EyeMotions .csv and one _Resps_Scenes.xlsx per participant per condition, named as per README.
+
+    Parameters
+    ----------
+    folder : Folder path, the files are written to f"{folder}data/" and f"{folder}timestamps/"
+    participants : number of participants.  The default is 10.
+    n_trials : trials per recording.  The default is 144.
+    conditions : the conditions every participant is recorded in
+    rate : sampling rate in Hz.  The default is 200.
+    seed : seed of the random generator, the same seed always writes the same files
+    overlapping : number of recordings with one overlapping trial
+    missing_data : number of recordings that stop before the last trial ends (which Intake throws out)
+    **gaze_options : passed on to synthetic_gaze()
+
+    Returns
+    -------
+    data_folder : folder of the EyeMotions files
+    timestamp_folder : folder of the response files
+    """
+    rng = np.random.default_rng(seed)
+    data_folder = os.path.join(folder, "data", "")
+    timestamp_folder = os.path.join(folder, "timestamps", "")
+    os.makedirs(data_folder, exist_ok = True)
+    os.makedirs(timestamp_folder, exist_ok = True)
+
+    recording = 0
+    for participant in range(101, 101+participants):
+        for condition in conditions:
+            trials = synthetic_trials(n_trials, overlap = recording < overlapping, rng = rng)
+            end = trials[:,2].max() + 2
+            if overlapping <= recording < overlapping + missing_data:
+                end = trials[:,2].max() - 1
+            write_eyemotions(data_folder + f"{participant}CE Scene {condition} 03-08-22 14h22m.csv", synthetic_gaze(end, rate = rate, rng = rng, **gaze_options))
+            write_resps(timestamp_folder + f"{participant}CE{'I' if condition == 'Arrow' else 'J'}_Resps_Scenes.xlsx", trials, rng = rng)
+            recording += 1
+    return data_folder, timestamp_folder
+
+if __name__ == "__main__":
+    generate_dataset("M:/AResearch/Gaze_AOI2/Synthetic/", participants = 10)
@@ -0,0 +1,20 @@
+from EyeMotionsIntake_Final import fill_gaps
+
+import numpy as np
+
+def filled(raw, max_gap, offsets = None):
+    raw = np.array(raw, dtype = np.int8)
+    return fill_gaps({"Raw": raw, "AOI": raw.copy()}, max_gap = max_gap, offsets = offsets)["AOI"].tolist()
+
+def test_leading_gap_same_for_any_max_gap():
+    #A 1 sample gap at the start of a trial takes the sample after it, whatever the gap limit
+    raw = [-1, 2, 1, 1, 1]
+    assert filled(raw, 1) == [2, 2, 1, 1, 1]
+    assert filled(raw, 3) == [2, 2, 1, 1, 1]
+
+def test_leading_gap_per_trial():
+    #Every trial's leading gap fills from within the trial, never from the end of the trial or the next one
+    raw = [-1, -1, 2, 1, -1, 1, -1, -1, -1, -1, 2, 1]
+    offsets = np.array([0, 6, 9, 12])
+    assert filled(raw, 1, offsets) == [-1, -1, 2, 1, 1, 1, -1, -1, -1, 2, 2, 1]
+    assert filled(raw, 3, offsets) == [2, 2, 2, 1, 1, 1, -1, -1, -1, 2, 2, 1]